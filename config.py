@@ -17,11 +17,14 @@ ArrayName = 'phi'
 Filter = 'None'
 ThresholdMin = None
 ThresholdMax = None
+Query = ''  # Data View selection on top of the threshold, e.g. 'rho > 1e10 & type in (gas, star)', see dataops.query
+ROI = None  # region of interest (xmin, xmax, ymin, ymax, zmin, zmax), wrapping around the box; None for all
 RangeMin = None
 RangeMax = None
 CurrentTime = "-1"
 CurrentView = 'Data View'
-ArrayNameList = ['vx', 'vy', 'vz', 'mass', 'uu', 'hh', 'mu', 'rho', 'phi']
+ArrayNameList = ['vx', 'vy', 'vz', 'mass', 'uu', 'hh', 'mu', 'rho', 'phi',
+                 'T', '|v|', 'log_rho', 'kinetic_energy', 'specific_energy']  # the last ones are dataops.derived
 FilterList = ['dm', 'baryon', 'star', 'wind', 'gas', 'agn']
 FilterListLongName = {'dm':'Dark Matter', 'baryon':'Baryon', 'star':'Star', 'wind':'Wind', 'gas':'Gas', 'agn':'Active Galactic Nuclei'}
 NumPoints = 'None'
@@ -36,10 +39,43 @@ GlyphScale = 1.0
 GlyphOpacity = 0.5
 GlyphDensity = 0.05
 ColorGlyph = False
+GlyphInstancing = True  # draw velocity glyphs as GPU instances of one arrow instead of building a mesh per glyph
 
 DataViewOpacity = 0.5
 DataViewRadius = 0.3
 CoordMax = 64  # max x/y/z coordinate value
 CellRes = 50  # number of cells in each dimension during interpolation 
+ScanPlaneMode = 'kernel'  # 'kernel' interpolates the particles on every move, 'grid' slices a field deposited once
+ScanPlaneGridKernel = 'cic'  # deposit kernel of the 'grid' mode field, which has CellRes grid points per axis
+AsyncScanPlane = True  # interpolate the scan plane on a worker thread instead of blocking the UI
+ScanPlaneCoarseFactor = 4  # the plane has CellRes / ScanPlaneCoarseFactor cells per side while the slider is dragged
+ScanPlaneSettleMs = 150  # refine to full CellRes once the slider has not moved for this long
+PlaneCacheBytes = 512 * 1024 ** 2  # memory budget of scan plane kernel weights kept for revisited plane positions
+SliceStackSlices = 64  # default number of scan plane slices in File > Export Slice Stack
+SliceStackPNG = True  # also write every exported slice as a colored PNG next to the stack
+
+UseSnapshotCache = True  # convert each snapshot once to memory-mapped columns and read those instead of the .vtp
+ReaderBackend = 'native'  # 'native' maps the appended binary data with numpy, 'vtk' uses vtkXMLPolyDataReader
+CacheDir = None  # root directory of all on-disk caches, None puts them next to the snapshots in .zwickypixies/
+CacheDerivedFields = True  # store derived fields like temperature next to the columnar cache once computed
+GlobalColorRange = False  # color by the range of the array over all snapshots in the catalog instead of the current one
+PrefetchRadius = 2  # number of neighbouring snapshots loaded in the background in each direction
+PrefetchWorkers = 2
+SnapshotCacheBytes = 4 * 1024 ** 3  # memory budget of loaded snapshots kept around for revisits
+ProgressiveDisplay = True  # draw a random sample of a large snapshot first and fill in the rest in steps
+ProgressiveFirstFraction = 0.01
+ProgressiveMinPoints = 1000000  # smaller snapshots are drawn in one go
+ExportFraction = 1.  # share of the particles rendered into exported videos, the same ones in every frame
+LOD = True  # draw a coarse subsample of the points while the camera moves
+LODFrameBudget = 1. / 20.  # seconds per frame during interaction
+VolumeResolution = (100, 100, 100)  # grid points per axis of the Volume View when the camera is still
+VolumeMinResolution = 32  # coarsest level of the volume mip pyramid drawn while the camera moves
+VolumeInteractiveResolution = None  # grid points per axis while the camera moves, None picks by LODFrameBudget
+VolumeReduction = 'mean'  # how particles are combined per grid point: mean, sum, weighted_mean (by mass), max, count
+VolumeKernel = 'cic'  # ngp (nearest grid point), cic, tsc or sph (cubic spline of width hh, much slower); max uses ngp
+DepositWorkers = None  # threads depositing particles onto volume grids, None uses all cores
+GridCache = True  # keep Volume View grids on disk and grid neighbouring snapshots ahead of time
+GridCacheBytes = 2 * 1024 ** 3  # disk quota of stored grids, least recently used ones are deleted first
+SnapshotCacheMinFreeBytes = 1024 ** 3  # drop cached snapshots when the system has less memory available
 
 Lut = None  # Lookup table for coloring the particles, shared by different viewactors
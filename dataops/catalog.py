@@ -0,0 +1,209 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import config
+from dataops import snapshot, particletype
+
+CATALOG = 'catalog.json'
+CATALOG_VERSION = 1
+SNAPSHOT_PATTERN = re.compile(r'^(?P<prefix>.*?)(?P<step>\d+)\.vtp$')  # e.g. Full.cosmo.624.vtp
+
+# Time steps are linear in the scale factor a = 1/(1+z), from z = 200 to z = 0 in 625 steps (see data_description.txt)
+SCALE_FACTORS = np.linspace(1. / 201., 1., 626)[1:]
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def scale_factor(step):
+    return float(SCALE_FACTORS[min(step, len(SCALE_FACTORS) - 1)])
+
+
+def redshift(step):
+    return 1. / scale_factor(step) - 1.
+
+
+def parse_step(filename):
+    # Time step encoded in a snapshot filename, None if it does not look like a snapshot
+    match = SNAPSHOT_PATTERN.match(os.path.basename(filename))
+    return int(match.group('step')) if match else None
+
+
+def snapshot_stats(filename):
+    '''
+    Particle count per type and min/max of every array of a snapshot
+    '''
+    if config.UseSnapshotCache:
+        manifest = snapshot.read_manifest(filename) or snapshot.build_cache(filename)
+        columns = {name: snapshot.load_column(filename, name) for name in manifest['arrays']}
+    else:
+        _, columns = snapshot.read_vtp(filename)
+    stats = {'ranges': {}}
+    for name, values in columns.items():
+        if len(values) and values.ndim == 1:
+            stats['ranges'][name] = [float(values.min()), float(values.max())]
+    if 'mask' in columns:
+        labels = columns.get(particletype.TYPE_ARRAY)
+        if labels is None:
+            labels = particletype.label_particles(columns['mask'])
+        stats['counts'] = particletype.type_counts(labels)
+        stats['num_points'] = len(labels)
+    return stats
+
+
+class Catalog:
+    '''
+    Persisted index of the snapshots in a directory: time step, scale factor and redshift, file size, and
+    optionally particle counts per type and array ranges. Entries are invalidated by file size and mtime.
+    '''
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.catalog_path = os.path.join(snapshot.cache_root(os.path.join(self.directory, CATALOG)), CATALOG)
+        self.entries = {}  # step -> entry dict
+        self.directory_mtime = None
+        self.lock = threading.Lock()
+        self.scan_thread = None  # background scan of scan_async
+        self.load()
+
+    @classmethod
+    def for_file(cls, filename):
+        # Shared catalog of the directory of a snapshot, rescanned when the directory has changed
+        directory = os.path.dirname(os.path.abspath(filename))
+        with _catalogs_lock:
+            catalog = _catalogs.get(directory)
+            if catalog is None:
+                catalog = _catalogs[directory] = cls(directory)
+        if catalog.directory_mtime != os.stat(directory).st_mtime:
+            catalog.scan()
+        return catalog
+
+    def load(self):
+        try:
+            with open(self.catalog_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != CATALOG_VERSION or data.get('directory') != self.directory:
+            return
+        self.entries = {int(step): entry for step, entry in data['entries'].items()}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.catalog_path), exist_ok=True)
+        with self.lock:
+            data = {'version': CATALOG_VERSION, 'directory': self.directory,
+                    'entries': {str(step): entry for step, entry in sorted(self.entries.items())}}
+        tmp = self.catalog_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.catalog_path)
+
+    def scan(self, stats=False, workers=None):
+        '''
+        Bring the catalog up to date with the directory. Only new or modified snapshots are looked at, in parallel.
+        Entries are never modified: updated ones are new dicts swapped in under the lock, so that the UI can read
+        the catalog while a scan runs in the background.
+
+        stats: also compute particle counts and array ranges, which requires reading the snapshots
+        '''
+        self.directory_mtime = os.stat(self.directory).st_mtime
+        found = {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                step = parse_step(entry.name)
+                if step is not None and entry.is_file():
+                    found[step] = entry
+        with self.lock:
+            current = {}
+            todo = []
+            for step, dir_entry in found.items():
+                stat = dir_entry.stat()
+                entry = self.entries.get(step)
+                if entry is None or entry['file'] != dir_entry.name or entry['size'] != stat.st_size \
+                        or entry['mtime'] != stat.st_mtime:
+                    entry = {'step': step, 'file': dir_entry.name, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                             'scale_factor': scale_factor(step), 'redshift': redshift(step)}
+                current[step] = entry
+                if stats and 'ranges' not in entry:
+                    todo.append(entry)
+            changed = current.keys() != self.entries.keys() or any(current[s] is not self.entries[s] for s in current)
+            self.entries = current
+        if todo:
+            with ThreadPoolExecutor(max_workers=workers or config.PrefetchWorkers) as executor:
+                paths = [os.path.join(self.directory, entry['file']) for entry in todo]
+                scanned = [dict(entry, **result) for entry, result in zip(todo, executor.map(snapshot_stats, paths))]
+            with self.lock:
+                entries = dict(self.entries)
+                for old, entry in zip(todo, scanned):
+                    # Unless another scan has replaced the entry meanwhile, e.g. because the snapshot was rewritten
+                    if entries.get(old['step']) is old:
+                        entries[old['step']] = entry
+                self.entries = entries
+        if changed or todo:
+            self.save()
+
+    def scan_async(self, stats=True, callback=None):
+        # Scan in a background thread, e.g. to collect global array ranges without blocking the UI. While one is
+        # running, it is returned instead of starting another, and its callback reports the result.
+        def run():
+            self.scan(stats=stats)
+            if callback:
+                callback(self)
+        with self.lock:
+            if self.scan_thread is not None and self.scan_thread.is_alive():
+                return self.scan_thread
+            self.scan_thread = threading.Thread(target=run, daemon=True)
+            self.scan_thread.start()
+            return self.scan_thread
+
+    def steps(self):
+        return sorted(self.entries)
+
+    def step_of(self, filename):
+        step = parse_step(filename)
+        return step if step in self.entries else None
+
+    def path(self, step):
+        entry = self.entries.get(step)
+        return os.path.join(self.directory, entry['file']) if entry else None
+
+    def next_step(self, step):
+        later = [s for s in self.entries if s > step]
+        return min(later) if later else None
+
+    def prev_step(self, step):
+        earlier = [s for s in self.entries if s < step]
+        return max(earlier) if earlier else None
+
+    def neighbours(self, filename, radius):
+        '''
+        Snapshots within `radius` catalog entries of the given one, nearest first
+        '''
+        steps = self.steps()
+        step = self.step_of(filename)
+        if step is None:
+            return []
+        i = steps.index(step)
+        files = []
+        for k in range(1, radius + 1):
+            for j in (i - k, i + k):
+                if 0 <= j < len(steps):
+                    files.append(self.path(steps[j]))
+        return files
+
+    def global_range(self, array_name):
+        # Min/max of an array over all snapshots with stats, None if none of them has been scanned yet
+        ranges = [entry['ranges'][array_name] for entry in self.entries.values()
+                  if array_name in entry.get('ranges', {})]
+        if not ranges:
+            return None
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+    @staticmethod
+    def format_step(step):
+        return str(step).zfill(3)
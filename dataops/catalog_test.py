@@ -0,0 +1,48 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import config
+from dataops.catalog import Catalog
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = config.CacheDir
+        config.CacheDir = os.path.join(self.tmp.name, 'cache')
+        for i in range(3):
+            open(os.path.join(self.tmp.name, f'Full.cosmo.{i:03}.vtp'), 'w').close()
+
+    def tearDown(self):
+        config.CacheDir = self.saved
+        self.tmp.cleanup()
+
+    def test_background_scan_swaps_entries(self):
+        catalog = Catalog(self.tmp.name)
+        catalog.scan()
+        before = catalog.entries
+        release = threading.Event()
+
+        def snapshot_stats(filename):
+            release.wait(5)
+            return {'ranges': {'rho': [float(os.path.basename(filename)[11:14]), 10.]}}
+
+        with mock.patch('dataops.catalog.snapshot_stats', snapshot_stats):
+            done = []
+            thread = catalog.scan_async(callback=done.append)
+            # A second request joins the running scan instead of reading the snapshots again
+            self.assertIs(catalog.scan_async(callback=done.append), thread)
+            self.assertIsNone(catalog.global_range('rho'))
+            release.set()
+            thread.join(5)
+        self.assertEqual(done, [catalog])
+        self.assertEqual(catalog.global_range('rho'), (0., 10.))
+        self.assertTrue(all('ranges' not in entry for entry in before.values()))
+        self.assertEqual(Catalog(self.tmp.name).global_range('rho'), (0., 10.))
+
+
+if __name__ == '__main__':
+    unittest.main()
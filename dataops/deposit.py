@@ -0,0 +1,241 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import config
+
+KERNELS = ['cic', 'tsc', 'sph', 'gaussian']
+REDUCTIONS = ['mean', 'sum', 'weighted_mean', 'count']
+CHUNK_CONTRIBUTIONS = 1 << 20  # particle-grid point pairs evaluated at once, bounds the temporary arrays
+TILES_PER_WORKER = 4
+
+
+def cubic_spline(q):
+    # Monaghan M4 kernel shape with compact support q < 2, unnormalized as every particle is normalized on the grid
+    return np.where(q < 1., 1. + q ** 2 * (0.75 * q - 1.5), 0.25 * np.maximum(2. - q, 0.) ** 3)
+
+
+def smoothing_length(hh, spacing):
+    # Particles smaller than the grid are widened to half a cell, so that every particle reaches a grid point
+    return np.maximum(np.asarray(hh, dtype=np.float64), 0.5 * spacing.max())
+
+
+def nearest_image(points, center, box):
+    # Positions of the periodic images of the points nearest to center
+    offset = np.asarray(points, dtype=np.float64) - center
+    return center + offset - box * np.round(offset / box)
+
+
+class Deposit:
+    '''
+    Deposits particle quantities onto a periodic grid of resolution points per axis covering the box, grid point i
+    sitting at i * box / resolution. Every particle spreads a unit weight over the grid points near it:
+
+    cic: cloud in cell, the 8 surrounding grid points by trilinear weights
+    tsc: triangular shaped cloud, the 27 nearest grid points by quadratic weights
+    sph: cubic spline kernel with support radius 2 * hh, renormalized over the grid points it reaches
+    gaussian: exp(-(sharpness * r / radius)^2) within a fixed radius as vtkGaussianKernel, not renormalized, so
+              that depositing values and ones and dividing interpolates like vtkPointInterpolator
+
+    The box is cut into slabs along z that are deposited in parallel, each into its own buffer covering the slab and
+    the reach of its particles, and then added into the grid with periodic wrap.
+
+    box: size of the periodic box, one for all axes or one per axis
+    region: (xmin, xmax, ymin, ymax, zmin, zmax) of a part of the box, e.g. a region of interest, to deposit onto
+            instead. Its corner grid points lie on the region as in gridding.grid_geometry and nothing wraps: what
+            particles deposit past the region is dropped. A region reaching past the box edge finds the particles
+            of its periodic images.
+    '''
+
+    def __init__(self, resolution, box=None, kernel='cic', workers=None, radius=3., sharpness=10., region=None):
+        if kernel not in KERNELS:
+            raise ValueError(f'Unknown kernel {kernel!r}, expected one of {", ".join(KERNELS)}')
+        self.resolution = np.array(resolution, dtype=np.int64)
+        self.box = np.asarray(config.CoordMax if box is None else box, dtype=np.float64)
+        self.region = None if region is None else np.asarray(region, dtype=np.float64)
+        if self.region is None:
+            self.spacing = self.box / self.resolution
+        else:
+            extent = self.region[1::2] - self.region[0::2]
+            self.spacing = np.where(extent > 0, extent / np.maximum(self.resolution - 1, 1), 1.)
+        self.kernel = kernel
+        self.radius = float(radius)  # support and sharpness of the gaussian kernel
+        self.sharpness = float(sharpness)
+        self.workers = workers or config.DepositWorkers or os.cpu_count() or 1
+
+    @property
+    def size(self):
+        return int(np.prod(self.resolution))
+
+    def bounds(self):
+        # Bounds of the grid points, e.g. for gridding.to_image_data
+        if self.region is not None:
+            return tuple(float(v) for v in self.region)
+        last = self.spacing * (self.resolution - 1)
+        return 0., last[0], 0., last[1], 0., last[2]
+
+    def stencils(self, points, hh):
+        '''
+        returns: first grid point (n, 3) along every axis before wrapping, and the number of grid points (n, 3) each
+        particle reaches from there along every axis
+        '''
+        u = points / self.spacing
+        if self.kernel == 'cic':
+            return np.floor(u).astype(np.int64), np.full((len(points), 3), 2)
+        if self.kernel == 'tsc':
+            return np.floor(u + 0.5).astype(np.int64) - 1, np.full((len(points), 3), 3)
+        # Grid points within the support along every axis, more than the whole axis would visit points twice
+        support = self.support(points, hh)
+        first = np.ceil((points - support[:, None]) / self.spacing).astype(np.int64)
+        width = np.minimum(np.floor(2. * support[:, None] / self.spacing).astype(np.int64) + 1, self.resolution)
+        return first, width
+
+    def support(self, points, hh):
+        # Radius around every particle within which its kernel is nonzero
+        if self.kernel == 'gaussian':
+            return np.full(len(points), self.radius)
+        return 2. * smoothing_length(hh, self.spacing)
+
+    def deposit(self, points, quantities, hh=None):
+        '''
+        points: (n, 3) positions inside the box
+        quantities: list of arrays with one value per particle, each deposited as value times particle weight
+        hh: smoothing length per particle, needed by the sph kernel
+        returns: one float64 grid of length size per quantity, x fastest as in vtkImageData
+        '''
+        if self.kernel == 'sph' and hh is None:
+            raise ValueError('The sph kernel needs the smoothing length hh of every particle')
+        if self.region is not None:
+            return self.deposit_region(points, quantities, hh)
+        points = np.asarray(points, dtype=np.float64) % self.box
+        quantities = [np.asarray(q, dtype=np.float64) for q in quantities]
+        hh = None if hh is None else np.asarray(hh, dtype=np.float64)
+        first, width = self.stencils(points, hh)
+        first_z = first[:, 2] % self.resolution[2]
+        num_tiles = int(min(self.resolution[2], self.workers * TILES_PER_WORKER))
+        edges = np.linspace(0, self.resolution[2], num_tiles + 1).astype(np.int64)
+        order = np.argsort(first_z, kind='stable')
+        splits = np.searchsorted(first_z[order], edges)
+
+        def run(tile):
+            ids = order[splits[tile]:splits[tile + 1]]
+            return self.deposit_tile(edges[tile], edges[tile + 1], points[ids], first[ids], width[ids],
+                                     [q[ids] for q in quantities], None if hh is None else hh[ids])
+
+        grids = [np.zeros(self.size) for _ in quantities]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for result in executor.map(run, range(num_tiles)):
+                if result is not None:
+                    self.fold(grids, *result)
+        return grids
+
+    def deposit_region(self, points, quantities, hh):
+        # Deposit onto a periodic grid padded by the reach of the kernel on every side, so that nothing wraps into
+        # the region, and cut the region out of it
+        origin = self.region[0::2]
+        extent = self.spacing * (self.resolution - 1)
+        points = np.asarray(points, dtype=np.float64)
+        hh = None if hh is None else np.asarray(hh, dtype=np.float64)
+        local = nearest_image(points, origin + 0.5 * extent, self.box) - origin
+        # Grid points a particle outside the region can still reach, at most the size of the region
+        if self.kernel in ('cic', 'tsc'):
+            pad = np.full(3, 2 if self.kernel == 'cic' else 3)
+        else:
+            reach = np.max(self.support(points, hh), initial=0.)
+            pad = np.minimum(np.ceil(reach / self.spacing).astype(np.int64) + 1, self.resolution)
+        keep = np.all((local >= -pad * self.spacing) & (local <= extent + pad * self.spacing), axis=1)
+        padded = self.resolution + 2 * pad
+        engine = Deposit(padded, padded * self.spacing, self.kernel, self.workers, self.radius, self.sharpness)
+        grids = engine.deposit(local[keep] + pad * self.spacing, [np.asarray(q, dtype=np.float64)[keep]
+                                                                 for q in quantities],
+                               None if hh is None else hh[keep])
+        (nx, ny, nz), (px, py, pz) = self.resolution, pad
+        return [grid.reshape(padded[::-1])[pz:pz + nz, py:py + ny, px:px + nx].ravel() for grid in grids]
+
+    def fold(self, grids, z_start, buffers):
+        # Add slab buffers into the grids, layers past the end of the box wrap around
+        layer = int(self.resolution[0] * self.resolution[1])
+        layers = (z_start + np.arange(len(buffers[0]) // layer)) % self.resolution[2]
+        for grid, buffer in zip(grids, buffers):
+            np.add.at(grid.reshape(-1, layer), layers, buffer.reshape(-1, layer))
+
+    def deposit_tile(self, z0, z1, points, first, width, quantities, hh):
+        if len(points) == 0:
+            return None
+        # The slab buffer covers the z layers the particles of this tile can reach
+        depth = int(z1 - z0 + width[:, 2].max() - 1)
+        buffers = [np.zeros(depth * int(self.resolution[0] * self.resolution[1])) for _ in quantities]
+        # Particles with the same stencil shape are evaluated together
+        shapes, shape_ids = np.unique(width, axis=0, return_inverse=True)
+        order = np.argsort(shape_ids.ravel(), kind='stable')
+        groups = np.r_[0, np.cumsum(np.bincount(shape_ids.ravel(), minlength=len(shapes)))]
+        for shape, group_start, group_end in zip(shapes, groups[:-1], groups[1:]):
+            shape = tuple(int(w) for w in shape)
+            chunk = max(1, CHUNK_CONTRIBUTIONS // int(np.prod(shape)))
+            for start in range(group_start, group_end, chunk):
+                ids = order[start:min(start + chunk, group_end)]
+                index, weights, owner = self.stencil(points[ids], first[ids], shape,
+                                                     None if hh is None else hh[ids], z0)
+                for buffer, q in zip(buffers, quantities):
+                    buffer += np.bincount(index, weights=weights * q[ids][owner], minlength=len(buffer))
+        return z0, buffers
+
+    def stencil(self, points, first, width, hh, z_start):
+        '''
+        width: number of grid points (x, y, z) every particle reaches
+        returns: flat slab buffer index, weight and particle of every particle-grid point pair with nonzero weight
+        '''
+        n = len(points)
+        cx, cy, cz = (first[:, a, None] + np.arange(width[a]) for a in range(3))  # (particles, width along axis)
+        # z is not wrapped: the slab buffer extends past the box and is folded back afterwards
+        ix = cx % self.resolution[0]
+        iy = cy % self.resolution[1]
+        iz = cz - (first[:, 2, None] - first[:, 2, None] % self.resolution[2]) - z_start
+        index = ix[:, None, None, :] + self.resolution[0] * (iy[:, None, :, None] + self.resolution[1] * iz[:, :, None, None])
+        dx, dy, dz = (c * self.spacing[a] - points[:, a, None] for a, c in enumerate((cx, cy, cz)))
+        if self.kernel in ('sph', 'gaussian'):
+            support = self.support(points, hh)
+            r2 = dx[:, None, None, :] ** 2 + dy[:, None, :, None] ** 2 + dz[:, :, None, None] ** 2
+            # Only the pairs inside the support, about half of the stencil cube
+            inside = r2.reshape(n, -1) <= support[:, None] ** 2
+            owner = np.repeat(np.arange(n), inside.sum(axis=1))
+            r2 = r2.reshape(n, -1)[inside]
+            if self.kernel == 'gaussian':
+                weights = np.exp(-(self.sharpness / self.radius) ** 2 * r2) if self.radius > 0 else np.ones(len(r2))
+                return index.reshape(n, -1)[inside], weights, owner
+            weights = cubic_spline(np.sqrt(r2) / (0.5 * support[owner]))
+            weights /= np.bincount(owner, weights=weights, minlength=n)[owner]
+            return index.reshape(n, -1)[inside], weights, owner
+        wx, wy, wz = (self.weights(np.abs(d / self.spacing[a])) for a, d in enumerate((dx, dy, dz)))
+        weights = wz[:, :, None, None] * wy[:, None, :, None] * wx[:, None, None, :]
+        return index.ravel(), weights.ravel(), np.repeat(np.arange(n), int(np.prod(width)))
+
+    def weights(self, f):
+        # cic or tsc weight at distance f in grid units
+        return 1. - f if self.kernel == 'cic' else np.where(f < 0.5, 0.75 - f ** 2, 0.5 * (1.5 - f) ** 2)
+
+
+def deposit_values(points, values, resolution, reduction='mean', kernel='cic', hh=None, mass=None, box=None,
+                   workers=None, region=None):
+    '''
+    Kernel-smoothed field of values on a periodic grid, or on the grid of a region of the box, see Deposit
+
+    reduction: 'mean' kernel-weighted average, 'weighted_mean' additionally weighted by mass, 'sum' of kernel times
+               value, 'count' the kernel weight alone, i.e. the number of particles per grid point
+    returns: (float32 grid of length prod(resolution), Deposit)
+    '''
+    if reduction not in REDUCTIONS:
+        raise ValueError(f'Reduction {reduction!r} cannot be deposited with a kernel, expected one of '
+                         f'{", ".join(REDUCTIONS)}')
+    engine = Deposit(resolution, box, kernel, workers, region=region)
+    ones = np.ones(len(points))
+    if reduction == 'count':
+        grid, = engine.deposit(points, [ones], hh)
+        return grid.astype(np.float32), engine
+    if reduction == 'sum':
+        grid, = engine.deposit(points, [values], hh)
+        return grid.astype(np.float32), engine
+    weights = ones if reduction == 'mean' else np.asarray(mass, dtype=np.float64)
+    total, norm = engine.deposit(points, [np.asarray(values, dtype=np.float64) * weights, weights], hh)
+    return np.divide(total, norm, out=np.zeros(engine.size), where=norm != 0).astype(np.float32), engine
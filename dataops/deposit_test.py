@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+
+from dataops.deposit import Deposit, deposit_values, cubic_spline
+
+
+class TestDeposit(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.box = 64.
+        self.points = rng.random((3000, 3)) * self.box
+        self.hh = rng.random(3000) * 6. + 0.5
+        self.values = rng.random(3000)
+
+    def test_conserves_weight(self):
+        for kernel in ('cic', 'tsc', 'sph'):
+            grid, = Deposit((16, 12, 20), self.box, kernel).deposit(self.points, [self.values], self.hh)
+            self.assertAlmostEqual(grid.sum(), self.values.sum(), delta=1e-9 * len(grid), msg=kernel)
+
+    def test_periodic_wrap(self):
+        # Halfway between the last grid point and the first one across the boundary
+        grid, = Deposit((8, 8, 8), 8., 'cic').deposit(np.array([[7.5, 0., 0.]]), [np.ones(1)])
+        self.assertAlmostEqual(grid[7], 0.5)
+        self.assertAlmostEqual(grid[0], 0.5)
+        grid, = Deposit((8, 8, 8), 8., 'tsc').deposit(np.array([[0., 0., 0.]]), [np.ones(1)])
+        np.testing.assert_allclose(grid[[0, 1, 7]], [0.75 ** 3, 0.125 * 0.75 ** 2, 0.125 * 0.75 ** 2])
+
+    def test_tiles_match_brute_force(self):
+        resolution = np.array([10, 8, 12])
+        spacing = self.box / resolution
+        z, y, x = np.meshgrid(*(np.arange(n) * s for n, s in zip(resolution[::-1], spacing[::-1])), indexing='ij')
+        grid_points = np.stack([x.ravel(), y.ravel(), z.ravel()], axis=1)  # x fastest
+        expected = np.zeros(len(grid_points))
+        for point, h, value in zip(self.points[:200], self.hh[:200], self.values[:200]):
+            d = grid_points - point
+            d -= self.box * np.round(d / self.box)
+            w = cubic_spline(np.linalg.norm(d, axis=1) / max(h, spacing.max() / 2))
+            expected += value * w / w.sum()
+        for workers in (1, 4):
+            grid, = Deposit(resolution, self.box, 'sph', workers).deposit(self.points[:200], [self.values[:200]],
+                                                                          self.hh[:200])
+            np.testing.assert_allclose(grid, expected, atol=1e-12)
+
+    def test_mean(self):
+        # A constant field stays constant wherever particles reach
+        grid, _ = deposit_values(self.points, np.full(3000, 2.5), (8, 8, 8), 'mean', 'tsc', box=self.box)
+        np.testing.assert_allclose(grid, 2.5, rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
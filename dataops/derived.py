@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+from vtkmodules.util.numpy_support import vtk_to_numpy
+
+import config
+from dataops import snapshot
+from dataops.catalog import parse_step, redshift
+
+
+class DerivedField:
+    def __init__(self, name, inputs, compute, description):
+        self.name = name
+        self.inputs = inputs  # names of the stored arrays it is computed from
+        self.compute = compute  # (columns, z) -> numpy array
+        self.description = description
+
+
+FIELDS = {}  # name -> DerivedField
+
+
+def derived(name, inputs, description):
+    # Register a derived field, computed from the given arrays and the redshift of the snapshot
+    def register(compute):
+        FIELDS[name] = DerivedField(name, inputs, compute, description)
+        return compute
+    return register
+
+
+@derived('T', ['uu'], 'temperature in Kelvin, T = 4.8e5 * uu / (1+z)^3, see data_description.txt')
+def temperature(columns, z):
+    return columns['uu'] * np.float32(4.8e5 / (1. + z) ** 3)
+
+
+@derived('|v|', ['vx', 'vy', 'vz'], 'speed in km/s')
+def speed(columns, z):
+    return np.sqrt(columns['vx'] ** 2 + columns['vy'] ** 2 + columns['vz'] ** 2)
+
+
+@derived('log_rho', ['rho'], 'log10 of the density')
+def log_rho(columns, z):
+    with np.errstate(divide='ignore'):
+        return np.log10(columns['rho'])
+
+
+@derived('kinetic_energy', ['mass', 'vx', 'vy', 'vz'], 'kinetic energy, mass * (km/s)^2')
+def kinetic_energy(columns, z):
+    return 0.5 * columns['mass'] * speed(columns, z) ** 2
+
+
+@derived('specific_energy', ['uu', 'vx', 'vy', 'vz'], 'kinetic plus internal energy per mass in (km/s)^2')
+def specific_energy(columns, z):
+    return 0.5 * speed(columns, z) ** 2 + columns['uu']
+
+
+def is_derived(name):
+    return name in FIELDS
+
+
+def inputs(names):
+    # Stored arrays needed to compute the derived fields among the given names
+    return sorted({name for field in names if field in FIELDS for name in FIELDS[field].inputs})
+
+
+def snapshot_redshift(filename):
+    step = parse_step(filename)
+    return redshift(step) if step is not None else 0.
+
+
+def derived_path(filename, name):
+    # The cache layout version is part of the name: a stored field is in the row order of the cache that wrote it
+    return snapshot.column_path(snapshot.cache_dir(filename), f'derived.v{snapshot.CACHE_VERSION}.{name}')
+
+
+def compute(filename, name, column):
+    '''
+    Compute a derived field of a snapshot
+
+    column: callable returning a stored array of the snapshot by name
+    '''
+    field = FIELDS[name]
+    values = field.compute({key: column(key) for key in field.inputs}, snapshot_redshift(filename))
+    return np.ascontiguousarray(values, dtype=np.float32)
+
+
+def load_column(filename, name, column, cached=False):
+    '''
+    Like compute, but with config.CacheDerivedFields the result is kept next to the columnar cache of the snapshot,
+    so the next session maps it from disk. The cache is rebuilt and the field dropped whenever the snapshot changes.
+
+    cached: the inputs come from the columnar cache, so the result is in its row order. Inputs read from the .vtp
+            are in file order and are never stored or replaced by a stored field.
+    '''
+    if not (cached and config.CacheDerivedFields and snapshot.read_manifest(filename)):
+        return compute(filename, name, column)
+    path = derived_path(filename, name)
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='c')
+    values = compute(filename, name, column)
+    tmp = path + '.tmp.npy'
+    np.save(tmp, values)
+    os.replace(tmp, path)
+    return values
+
+
+def add_arrays(polydata, filename, names, cached=False):
+    '''
+    Add the derived fields among the given names to a polydata that already has their inputs
+
+    cached: the polydata was loaded from the columnar cache with snapshot.load_polydata, see load_column
+    '''
+    point_data = polydata.GetPointData()
+    for name in names:
+        if name in FIELDS and not point_data.HasArray(name):
+            values = load_column(filename, name, lambda key: vtk_to_numpy(point_data.GetArray(key)), cached)
+            point_data.AddArray(snapshot.to_vtk_array(values, name))
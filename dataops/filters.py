@@ -4,9 +4,10 @@ from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 from vtk import VTK_DOUBLE
 import vtk
 import numpy as np
-from vtkmodules.vtkFiltersGeometry import vtkGeometryFilter
 
 import config
+from dataops import particletype
+from dataops.query import QueryEngine
 
 
 def mask_points(polydata: vtkPolyData, array_name: str = None, particle_type: str = None):
@@ -17,61 +18,44 @@ def mask_points(polydata: vtkPolyData, array_name: str = None, particle_type: st
     array_name: name of the array to mask based on
     particle_type: particle type, e.g. 'dm' (for dark matter), 'baryon', 'star', 'wind', 'gas', 'agn'
     '''
-    if not particle_type or particle_type == 'None':
+    if particle_type not in particletype.TYPE_CODES:
         return polydata
-    test = vtkGeometryFilter()
-    mask_array = vtk_to_numpy(polydata.GetPointData().GetArray('mask')).astype(np.int32)
     data_array = None
     if array_name:
         data_array = vtk_to_numpy(polydata.GetPointData().GetArray(array_name))
     points_array = vtk_to_numpy(polydata.GetPoints().GetData())
+    particle_mask = particletype.get_labels(polydata) == particletype.TYPE_CODES[particle_type]
 
-    is_dm = ((mask_array & 0b000000010) == 0) & ~((mask_array & 0b100000000) != 0)
-    is_star = ((mask_array & 0b000100000) != 0) & ~is_dm
-    is_wind = ((mask_array & 0b001000000) != 0) & ~is_dm
-    is_gas = ((mask_array & 0b010000000) != 0) & ~is_dm
-    is_agn = ((mask_array & 0b100000000) != 0) & ~is_star & ~is_wind & ~is_gas
-    is_baryon = ~is_dm & ~is_star & ~is_wind & ~is_gas & ~is_agn
-
-    particle_mask = None
-    if particle_type == 'dm':
-        particle_mask = is_dm
-    elif particle_type == 'baryon':
-        particle_mask = is_baryon
-    elif particle_type == 'star':
-        particle_mask = is_star
-    elif particle_type == 'wind':
-        particle_mask = is_wind
-    elif particle_type == 'gas':
-        particle_mask = is_gas
-    elif particle_type == 'agn':
-        particle_mask = is_agn
-
-    if particle_mask is not None:
-        masked_points = points_array[particle_mask]
-
-        vtk_masked_points = vtkPoints()
-        masked_polydata = vtkPolyData()
-
-        vtk_masked_points.SetData(numpy_to_vtk(masked_points))
-        masked_polydata.SetPoints(vtk_masked_points)
-        if array_name:
-            masked_scalars = data_array[particle_mask]
-            masked_polydata.GetPointData().SetScalars(numpy_to_vtk(masked_scalars, deep=True, array_type=VTK_DOUBLE))
-        return masked_polydata
-    else:
-        return polydata
+    masked_points = points_array[particle_mask]
 
-def threshold_points(polydata: vtkPolyData):
-    '''
-    Threshold points in the polydata based on the current array_name in the configuration
+    vtk_masked_points = vtkPoints()
+    masked_polydata = vtkPolyData()
 
-    polydata: input polydata (point data)
+    vtk_masked_points.SetData(numpy_to_vtk(masked_points))
+    masked_polydata.SetPoints(vtk_masked_points)
+    if array_name:
+        masked_scalars = data_array[particle_mask]
+        masked_polydata.GetPointData().SetScalars(numpy_to_vtk(masked_scalars, deep=True, array_type=VTK_DOUBLE))
+    return masked_polydata
+
+def threshold_range():
+    '''
+    Current (min, max) threshold, defaulting to the full range of the current array
     '''
     if config.ThresholdMin == None:
         config.ThresholdMin = config.RangeMin
     if config.ThresholdMax == None:
         config.ThresholdMax = config.RangeMax
+    return config.ThresholdMin, config.ThresholdMax
+
+
+def threshold_points(polydata: vtkPolyData):
+    '''
+    Threshold points in the polydata based on the current array_name in the configuration
+
+    polydata: input polydata (point data)
+    '''
+    threshold_range()
     polydata.GetPointData().SetActiveScalars(config.ArrayName)
     threshold_filter = vtk.vtkThresholdPoints()
     threshold_filter.SetInputData(polydata)
@@ -80,3 +64,32 @@ def threshold_points(polydata: vtkPolyData):
     threshold_filter.Update()
     return threshold_filter.GetOutput()
 
+
+
+def extract_points(polydata: vtkPolyData, ids):
+    '''
+    New polydata with the given points of the input and all their point arrays
+    '''
+    out = vtkPolyData()
+    points = vtkPoints()
+    points.SetData(numpy_to_vtk(vtk_to_numpy(polydata.GetPoints().GetData())[ids]))
+    out.SetPoints(points)
+    point_data = polydata.GetPointData()
+    for i in range(point_data.GetNumberOfArrays()):
+        arr = point_data.GetArray(i)
+        selected = numpy_to_vtk(vtk_to_numpy(arr)[ids], array_type=arr.GetDataType())
+        selected.SetName(arr.GetName())
+        out.GetPointData().AddArray(selected)
+    if point_data.GetScalars():
+        out.GetPointData().SetActiveScalars(point_data.GetScalars().GetName())
+    return out
+
+
+def query_points(polydata: vtkPolyData, expression: str):
+    '''
+    Points in the polydata matching a query expression, see dataops.query
+
+    polydata: input polydata (point data)
+    expression: e.g. 'rho > 1e10 & type in (gas, star) & hh < 0.2'
+    '''
+    return extract_points(polydata, QueryEngine.for_polydata(polydata).select(expression))
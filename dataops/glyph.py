@@ -3,16 +3,24 @@ import config
 import numpy as np
 from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 
+from dataops.filters import extract_points
+from dataops.sampling import sample_mask, sample_keys
 
-# Create a glyph filter that aligns arrows with vectors
-def get_glyphs(input_port: int, scale_factor=1.0):
-    # Source for the glyph filter
+
+def get_arrow():
+    # Source for the glyphs
     arrow = vtk.vtkArrowSource()
     arrow.SetTipResolution(3)
     arrow.SetTipLength(0.3)
     arrow.SetTipRadius(0.2)
     arrow.SetShaftResolution(3)
     arrow.SetShaftRadius(0.05)
+    return arrow
+
+
+# Create a glyph filter that aligns arrows with vectors
+def get_glyphs(input_port: int, scale_factor=1.0):
+    arrow = get_arrow()
 
     glyph = vtk.vtkGlyph3D()
     glyph.SetSourceConnection(arrow.GetOutputPort())
@@ -26,18 +34,27 @@ def get_glyphs(input_port: int, scale_factor=1.0):
     return glyph
 
 
-def set_vectors_by_velocity(src: vtk.vtkPointData, min_scale=1.0, max_scale=2.0):
-    # Get the velocity vector
-    vx = vtk_to_numpy(src.GetArray('vx'))
-    vy = vtk_to_numpy(src.GetArray('vy'))
-    vz = vtk_to_numpy(src.GetArray('vz'))
-    velocities = np.stack((vx, vy, vz), axis=-1)
-    magnitudes = np.linalg.norm(velocities, axis=-1)
-    velocities /= magnitudes[:, None]  # normalize
-    max_magnitude = np.max(magnitudes)
-    min_magnitude = np.min(magnitudes)
-    # map the velocity magnitude to the given range
-    velocities *= (magnitudes[:, None] - min_magnitude) / (max_magnitude - min_magnitude) * (max_scale - min_scale) + min_scale
+def speeds(src: vtk.vtkPointData):
+    # Velocity vectors and their magnitudes of the points
+    velocities = np.stack([vtk_to_numpy(src.GetArray(name)) for name in ('vx', 'vy', 'vz')], axis=-1)
+    if src.HasArray('|v|'):
+        return velocities, vtk_to_numpy(src.GetArray('|v|'))  # derived field, computed once per snapshot
+    return velocities, np.linalg.norm(velocities, axis=-1)
+
+
+def scale_by_magnitude(magnitudes, min_scale, max_scale, magnitude_range=None):
+    # Map magnitudes from magnitude_range, their own range by default, linearly to [min_scale, max_scale]
+    low, high = (np.min(magnitudes), np.max(magnitudes)) if magnitude_range is None else magnitude_range
+    t = np.clip((magnitudes - low) / (high - low), 0., 1.) if high > low else np.zeros(len(magnitudes))
+    return min_scale + t * (max_scale - min_scale)
+
+
+def set_vectors_by_velocity(src: vtk.vtkPointData, min_scale=1.0, max_scale=2.0, magnitude_range=None):
+    velocities, magnitudes = speeds(src)
+    # Unit vectors scaled by the velocity magnitude mapped to the given range
+    velocities = np.divide(velocities, magnitudes[:, None], out=np.zeros(velocities.shape),
+                           where=magnitudes[:, None] > 0)
+    velocities *= scale_by_magnitude(magnitudes, min_scale, max_scale, magnitude_range)[:, None]
 
     # Set the velocity vector as the active vector
     velocity_vtk = numpy_to_vtk(velocities)
@@ -46,24 +63,80 @@ def set_vectors_by_velocity(src: vtk.vtkPointData, min_scale=1.0, max_scale=2.0)
     src.SetActiveVectors('velocity')
 
 
+def get_instanced_glyphs(input_port: int, scale_factor=1.0):
+    # One arrow drawn once per point on the GPU, oriented and scaled by the arrays of set_instance_arrays
+    arrow = get_arrow()
+
+    mapper = vtk.vtkGlyph3DMapper()
+    mapper.SetSourceConnection(arrow.GetOutputPort())
+    mapper.SetInputConnection(input_port)
+    mapper.SetOrientationArray('direction')
+    mapper.SetOrientationModeToDirection()
+    mapper.SetScaleArray('glyph_scale')
+    mapper.SetScaleModeToScaleByMagnitude()
+    mapper.SetScaleFactor(scale_factor)
+    return mapper
+
+
+def set_instance_arrays(src: vtk.vtkPointData, min_scale=1.0, max_scale=2.0, magnitude_range=None):
+    # Unit velocity direction and the velocity magnitude mapped from magnitude_range to [min_scale, max_scale]
+    velocities, magnitudes = speeds(src)
+    directions = np.divide(velocities, magnitudes[:, None], out=np.zeros(velocities.shape),
+                           where=magnitudes[:, None] > 0)
+    scales = scale_by_magnitude(magnitudes, min_scale, max_scale, magnitude_range)
+    for name, values in (('direction', directions), ('glyph_scale', scales)):
+        array = numpy_to_vtk(values.astype(np.float32), deep=True)
+        array.SetName(name)
+        src.AddArray(array)
+
+
 # This class encapsulates the glyph filter to visualize the velocity field
 class Glyph:
-    def __init__(self, polydata: vtk.vtkPolyData):
+    '''
+    With config.GlyphInstancing the arrows are instances of a single arrow drawn by vtkGlyph3DMapper, so no mesh
+    is built per glyph: the density slider only resamples the points with their direction and scale arrays, and
+    the scale slider only changes the scale factor of the mapper. Otherwise vtkGlyph3D builds the arrow mesh of
+    every glyph.
+
+    magnitude_range: (min, max) speed mapped to the smallest and largest arrow, e.g. from the snapshot statistics
+                     of |v|, by default that of all points of polydata. Sampled arrows are sized by it rather than
+                     by the range of the sample, so that an arrow keeps its size when the density changes.
+    '''
+    def __init__(self, polydata: vtk.vtkPolyData, keys=None, instanced=None, magnitude_range=None):
         self.polydata = polydata
-        set_vectors_by_velocity(polydata.GetPointData())
-
-        # Choose a random subset of points
+        if magnitude_range is None:
+            magnitudes = speeds(polydata.GetPointData())[1]
+            magnitude_range = (np.min(magnitudes), np.max(magnitudes)) if len(magnitudes) else (0., 0.)
+        self.magnitude_range = magnitude_range
+        self.instanced = config.GlyphInstancing if instanced is None else instanced
+        if self.instanced and keys is None:
+            keys = sample_keys(np.arange(polydata.GetNumberOfPoints()))
+        self.keys = keys  # sample keys of the points (dataops.sampling), without them every n-th point is taken
         self.ratio = 0.05  # ratio of points to keep
-        self.mask_points = vtk.vtkMaskPoints()
-        self.mask_points.SetInputData(polydata)
-        self.mask_points.SetOnRatio(int(1 / self.ratio))
-        # self.mask_points.RandomModeOn()
+        self.scale_bounds = (1.0, 2.0)
+        self.scale_shape = (1.0, 2.0)  # instance scales relative to the mapper's scale factor, see set_velocity_bounds
+
+        if keys is None:
+            set_vectors_by_velocity(polydata.GetPointData(), *self.scale_bounds, self.magnitude_range)
+            self.mask_points = vtk.vtkMaskPoints()
+            self.mask_points.SetInputData(polydata)
+            self.mask_points.SetOnRatio(int(1 / self.ratio))
+            source = self.mask_points.GetOutputPort()
+        else:
+            # A prefix of the random permutation is an unbiased sample, and only it needs velocity vectors
+            self.mask_points = None
+            self.sample = vtk.vtkTrivialProducer()
+            self.update_sample()
+            source = self.sample.GetOutputPort()
 
         # Create a glyph filter, mapper, and actor
-        self.glyph = get_glyphs(self.mask_points.GetOutputPort(), scale_factor=1.0)
-
-        self.mapper = vtk.vtkPolyDataMapper()
-        self.mapper.SetInputConnection(self.glyph.GetOutputPort())
+        if self.instanced:
+            self.glyph = None
+            self.mapper = get_instanced_glyphs(source, scale_factor=1.0)
+        else:
+            self.glyph = get_glyphs(source, scale_factor=1.0)
+            self.mapper = vtk.vtkPolyDataMapper()
+            self.mapper.SetInputConnection(self.glyph.GetOutputPort())
         self.mapper.SetScalarModeToUsePointFieldData()
         self.mapper.SelectColorArray(config.ArrayName)
         self.mapper.ScalarVisibilityOff()
@@ -87,8 +160,30 @@ class Glyph:
             self.mapper.ScalarVisibilityOff()
         self.mapper.Update()
     
+    def update_sample(self):
+        sample = extract_points(self.polydata, np.flatnonzero(sample_mask(self.keys, self.ratio)))
+        if sample.GetNumberOfPoints():
+            if self.instanced:
+                set_instance_arrays(sample.GetPointData(), *self.scale_shape, self.magnitude_range)
+            else:
+                set_vectors_by_velocity(sample.GetPointData(), *self.scale_bounds, self.magnitude_range)
+        self.sample.SetOutput(sample)
+
     def set_velocity_bounds(self, min_scale, max_scale):
-        set_vectors_by_velocity(self.polydata.GetPointData(), min_scale, max_scale)
+        self.scale_bounds = (min_scale, max_scale)
+        if self.instanced:
+            # Bounds with the same ratio, as set by set_scale, only change the scale factor of the instances
+            unit = min_scale if min_scale > 0 else 1.0
+            shape = (min_scale / unit, max_scale / unit)
+            if shape != self.scale_shape:
+                self.scale_shape = shape
+                self.update_sample()
+            self.mapper.SetScaleFactor(unit)
+            return
+        if self.mask_points:
+            set_vectors_by_velocity(self.polydata.GetPointData(), min_scale, max_scale, self.magnitude_range)
+        else:
+            self.update_sample()
         self.glyph.Update()
 
     def set_scale(self, scale_factor):
@@ -98,5 +193,9 @@ class Glyph:
 
     def set_ratio(self, ratio):
         self.ratio = max(0.001, ratio)
-        self.mask_points.SetOnRatio(int(1 / self.ratio))
-        self.glyph.Update()
+        if self.mask_points:
+            self.mask_points.SetOnRatio(int(1 / self.ratio))
+        else:
+            self.update_sample()
+        if self.glyph:
+            self.glyph.Update()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+from dataops.glyph import Glyph
+from dataops.sampling import sample_keys, sample_mask
+
+
+class TestGlyph(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 20000
+        points = vtkPoints()
+        points.SetData(numpy_to_vtk(rng.random((n, 3)) * 64., deep=True))
+        self.polydata = vtkPolyData()
+        self.polydata.SetPoints(points)
+        self.velocities = rng.normal(size=(n, 3)) * 100.
+        self.velocities[0] = (3000., 0., 0.)  # far out in a tail that small samples miss
+        columns = dict(zip(('vx', 'vy', 'vz'), self.velocities.T))
+        columns['id'] = np.arange(n, dtype=np.float64)
+        for name, values in columns.items():
+            array = numpy_to_vtk(values, deep=True)
+            array.SetName(name)
+            self.polydata.GetPointData().AddArray(array)
+        self.keys = sample_keys(np.arange(n))
+
+    def sample(self, glyph):
+        point_data = glyph.sample.GetOutputDataObject(0).GetPointData()
+        return (vtk_to_numpy(point_data.GetArray('id')).astype(np.int64),
+                vtk_to_numpy(point_data.GetArray('direction')), vtk_to_numpy(point_data.GetArray('glyph_scale')))
+
+    def test_instance_arrays(self):
+        glyph = Glyph(self.polydata, self.keys, instanced=True)
+        speed = np.linalg.norm(self.velocities, axis=1)
+        scales = {}
+        for ratio in (0.01, 0.2, 1.):
+            glyph.set_ratio(ratio)
+            ids, directions, glyph_scale = self.sample(glyph)
+            np.testing.assert_array_equal(ids, np.flatnonzero(sample_mask(self.keys, ratio)))
+            np.testing.assert_allclose(directions, self.velocities[ids] / speed[ids, None], rtol=1e-5)
+            # Sized over the speeds of all points, so an arrow keeps its size whatever else is sampled
+            expected = 1. + (speed[ids] - speed.min()) / (speed.max() - speed.min())
+            np.testing.assert_allclose(glyph_scale, expected, rtol=1e-5)
+            scales[ratio] = dict(zip(ids, glyph_scale))
+        self.assertTrue(all(scales[1.][i] == scale for i, scale in scales[0.01].items()))
+
+        glyph.set_scale(4.)
+        ids, _, glyph_scale = self.sample(glyph)
+        self.assertEqual(glyph.mapper.GetScaleFactor(), 2.)
+        np.testing.assert_allclose(glyph_scale, 1. + 2. * (speed[ids] - speed.min()) / (speed.max() - speed.min()),
+                                   rtol=1e-5)
+        # Same bounds ratio: only the scale factor changes, the sample stays
+        sample = glyph.sample.GetOutputDataObject(0)
+        glyph.set_scale(8.)
+        self.assertEqual(glyph.mapper.GetScaleFactor(), 4.)
+        self.assertIs(glyph.sample.GetOutputDataObject(0), sample)
+
+
+if __name__ == '__main__':
+    unittest.main()
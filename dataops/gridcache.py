@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from vtkmodules.util.numpy_support import vtk_to_numpy
+
+import config
+from dataops import snapshot, derived, gridding
+
+GRIDS = 'grids'  # directory of the grid cache inside the cache root, shared by all snapshots of a run
+
+
+def grid_key(filename, array_name, resolution, reduction, kernel, bounds=None, roi=None):
+    '''
+    Everything a stored grid depends on. A rewritten snapshot has a new size or mtime and so gets a new key.
+
+    bounds: extent of the particles or the region of interest, nearest grid point binning spans them
+    roi: region of interest the particles were cropped to, None for the whole snapshot
+    '''
+    stat = os.stat(filename)
+    return {
+        'file': os.path.abspath(filename),
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime,
+        'array': array_name,
+        'resolution': [int(n) for n in resolution],
+        'reduction': reduction,
+        'kernel': kernel,
+        'box': config.CoordMax,
+        'bounds': [float(v) for v in bounds] if kernel == 'ngp' else None,
+        'roi': None if roi is None else [float(v) for v in roi],
+    }
+
+
+def grid_bounds(grid):
+    origin, spacing, dimensions = grid.GetOrigin(), grid.GetSpacing(), grid.GetDimensions()
+    return [v for axis in range(3)
+            for v in (origin[axis], origin[axis] + spacing[axis] * (dimensions[axis] - 1))]
+
+
+def gridding_arrays(array_name, reduction, kernel):
+    # Point arrays gridding array_name reads, derived fields are replaced by their inputs
+    arrays = [array_name] if reduction != 'count' else []
+    if reduction == 'weighted_mean':
+        arrays.append('mass')
+    if kernel == 'sph':
+        arrays.append('hh')
+    return arrays
+
+
+def load_for_gridding(filename, array_name, reduction, kernel):
+    # Fresh polydata of a snapshot with just the arrays gridding needs
+    arrays = gridding_arrays(array_name, reduction, kernel)
+    stored = [name for name in arrays + derived.inputs(arrays) if not derived.is_derived(name)]
+    if config.UseSnapshotCache:
+        polydata = snapshot.load_polydata(filename, stored)
+    else:
+        polydata = snapshot.read_polydata(filename, stored)
+    # Fields derived from a .vtp read are in file order and must not end up in the snapshot cache
+    derived.add_arrays(polydata, filename, arrays, cached=config.UseSnapshotCache)
+    return polydata
+
+
+class GridCache:
+    '''
+    Volume grids on disk, one float32 .npy per grid plus a json with its key and bounds, so that revisiting a
+    snapshot or an array in Volume View loads the grid instead of gridding the particles again. The least recently
+    used grids are deleted when the directory grows past config.GridCacheBytes; file modification times record the
+    last use. Grids of neighbouring snapshots can be computed ahead of time in the background.
+    '''
+
+    def __init__(self, quota=None, workers=1):
+        self.quota = config.GridCacheBytes if quota is None else quota
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = set()  # names of grids being computed in the background
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def paths(filename, key):
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(filename))[0]
+        base = os.path.join(snapshot.cache_root(filename), GRIDS, f'{name}.{digest}')
+        return base + '.npy', base + '.json'
+
+    def get(self, filename, key):
+        '''
+        returns: vtkImageData of a stored grid, or None
+        '''
+        values_path, meta_path = self.paths(filename, key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['key'] != key:
+                return None  # digest collision
+            bounds, dimensions = meta['bounds'], meta['dimensions']
+            values = np.load(values_path, mmap_mode='r')
+            os.utime(values_path)  # mark as recently used
+        except (OSError, ValueError, KeyError):
+            return None
+        return gridding.to_image_data(values, bounds, dimensions, key['array'])
+
+    def put(self, filename, key, grid):
+        values_path, meta_path = self.paths(filename, key)
+        os.makedirs(os.path.dirname(values_path), exist_ok=True)
+        values = vtk_to_numpy(grid.GetPointData().GetScalars()).astype(np.float32, copy=False)
+        # The json is written last, so a grid is only found once both files are complete
+        tmp = values_path + '.tmp.npy'
+        np.save(tmp, values)
+        os.replace(tmp, values_path)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'key': key, 'bounds': grid_bounds(grid), 'dimensions': list(grid.GetDimensions())}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self.evict(os.path.dirname(values_path))
+
+    def evict(self, directory):
+        with self.lock:
+            try:
+                entries = [entry for entry in os.scandir(directory) if entry.name.endswith('.npy')
+                           and not entry.name.endswith('.tmp.npy')]
+            except OSError:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            total = sum(entry.stat().st_size for entry in entries)
+            # Always keep the newest grid, even if it alone is over the quota
+            for entry in entries[:-1]:
+                if total <= self.quota:
+                    break
+                total -= entry.stat().st_size
+                for path in (entry.path, entry.path[:-len('.npy')] + '.json'):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def grid(self, filename, polydata, array_name, resolution, reduction, kernel, roi=None):
+        '''
+        Grid of polydata, the particles of the snapshot filename, loaded from the cache or computed and stored. It
+        spans roi, the region of interest polydata was cropped to, or the extent of the particles without one.
+        '''
+        bounds = gridding.region_bounds(polydata, roi)
+        key = grid_key(filename, array_name, resolution, reduction, kernel, bounds, roi)
+        grid = self.get(filename, key)
+        if grid is None:
+            grid = gridding.grid_polydata(polydata, array_name, bounds, resolution, reduction, kernel=kernel)
+            self.put(filename, key, grid)
+        return grid
+
+    def pyramid(self, filename, polydata, array_name, resolution, reduction, kernel, roi=None, min_resolution=32):
+        '''
+        Mip pyramid of the grid of polydata, finest first, see gridding.build_pyramid. The coarse levels are stored
+        like grids, so revisits load them instead of downsampling again.
+        '''
+        grid = self.grid(filename, polydata, array_name, resolution, reduction, kernel, roi)
+        bounds = gridding.region_bounds(polydata, roi)
+        key = grid_key(filename, array_name, resolution, reduction, kernel, bounds, roi)
+        levels = [grid]
+        for level in range(1, gridding.pyramid_size(resolution, min_resolution)):
+            coarse = self.get(filename, dict(key, level=level))
+            if coarse is None:
+                break
+            levels.append(coarse)
+        else:
+            return levels
+        levels = gridding.build_pyramid(grid, min_resolution, reduction)
+        for level, coarse in enumerate(levels[1:], 1):
+            self.put(filename, dict(key, level=level), coarse)
+        return levels
+
+    def prefetch(self, filenames, array_name, resolution, reduction, kernel):
+        # Grid whole snapshots in the background, so that stepping through time in Volume View finds them stored
+        for filename in filenames:
+            name = (filename, array_name, tuple(resolution), reduction, kernel)
+            with self.lock:
+                if name in self.pending:
+                    continue
+                self.pending.add(name)
+            self.executor.submit(self._prefetch, name)
+
+    def _prefetch(self, name):
+        filename, array_name, resolution, reduction, kernel = name
+        try:
+            # Nearest grid point binning needs the bounds of the particles for the key, so load them first
+            polydata = load_for_gridding(filename, array_name, reduction, kernel)
+            self.grid(filename, polydata, array_name, resolution, reduction, kernel)
+        except Exception as e:
+            print(f'Gridding {filename} in the background failed: {e}')
+        finally:
+            with self.lock:
+                self.pending.discard(name)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+import config
+from dataops.gridcache import GridCache, grid_key
+
+
+class TestGridCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = config.CacheDir
+        config.CacheDir = self.tmp.name
+        self.snapshots = []
+        for i in range(3):
+            path = os.path.join(self.tmp.name, f'Full.cosmo.{i:03}.vtp')
+            open(path, 'w').close()
+            self.snapshots.append(path)
+        rng = np.random.default_rng(0)
+        self.polydata = vtk.vtkPolyData()
+        points = vtk.vtkPoints()
+        points.SetData(numpy_to_vtk(rng.random((500, 3)) * config.CoordMax, deep=True))
+        self.polydata.SetPoints(points)
+        rho = numpy_to_vtk(rng.random(500), deep=True)
+        rho.SetName('rho')
+        self.polydata.GetPointData().AddArray(rho)
+
+    def tearDown(self):
+        config.CacheDir = self.saved
+        self.tmp.cleanup()
+
+    def test_stored_grid_is_reused(self):
+        cache = GridCache()
+        grid = cache.grid(self.snapshots[0], self.polydata, 'rho', (8, 8, 8), 'mean', 'cic')
+        key = grid_key(self.snapshots[0], 'rho', (8, 8, 8), 'mean', 'cic', self.polydata.GetBounds())
+        stored = cache.get(self.snapshots[0], key)
+        np.testing.assert_array_equal(vtk_to_numpy(stored.GetPointData().GetScalars()),
+                                      vtk_to_numpy(grid.GetPointData().GetScalars()))
+        self.assertEqual(stored.GetBounds(), grid.GetBounds())
+        self.assertIsNone(cache.get(self.snapshots[0], dict(key, kernel='tsc')))
+
+    def test_stored_pyramid_is_reused(self):
+        cache = GridCache()
+        levels = cache.pyramid(self.snapshots[0], self.polydata, 'rho', (16, 16, 16), 'mean', 'cic', min_resolution=4)
+        stored = cache.pyramid(self.snapshots[0], self.polydata, 'rho', (16, 16, 16), 'mean', 'cic', min_resolution=4)
+        self.assertEqual([level.GetDimensions() for level in stored], [(16, 16, 16), (8, 8, 8), (4, 4, 4)])
+        for level, again in zip(levels, stored):
+            self.assertEqual(level.GetBounds(), again.GetBounds())
+            np.testing.assert_array_equal(vtk_to_numpy(level.GetPointData().GetScalars()),
+                                          vtk_to_numpy(again.GetPointData().GetScalars()))
+
+    def test_pyramid_spans_region_of_interest(self):
+        cache = GridCache()
+        roi = (0.1 * config.CoordMax, 0.4 * config.CoordMax, 0.2 * config.CoordMax, 0.6 * config.CoordMax,
+               0.5 * config.CoordMax, 0.7 * config.CoordMax)
+        for kernel in ('ngp', 'cic'):
+            whole = cache.pyramid(self.snapshots[0], self.polydata, 'rho', (16, 16, 16), 'mean', kernel,
+                                  min_resolution=4)
+            for _ in range(2):  # computed, then loaded
+                levels = cache.pyramid(self.snapshots[0], self.polydata, 'rho', (16, 16, 16), 'mean', kernel, roi,
+                                       min_resolution=4)
+                np.testing.assert_allclose(levels[0].GetBounds(), roi, err_msg=kernel)
+                for level in levels[1:]:
+                    bounds = level.GetBounds()
+                    self.assertTrue(all(roi[2 * a] <= bounds[2 * a] < bounds[2 * a + 1] <= roi[2 * a + 1]
+                                        for a in range(3)), kernel)
+            self.assertFalse(np.allclose(whole[0].GetBounds(), roi))
+
+    def test_evicts_least_recently_used(self):
+        cache = GridCache(quota=2 * 8 ** 3 * 4 + 1024)
+        keys = []
+        for i, filename in enumerate(self.snapshots):
+            cache.grid(filename, self.polydata, 'rho', (8, 8, 8), 'mean', 'cic')
+            keys.append(grid_key(filename, 'rho', (8, 8, 8), 'mean', 'cic', self.polydata.GetBounds()))
+            for path in cache.paths(filename, keys[-1]):
+                os.utime(path, (i, i))  # distinct ages regardless of the file system's timestamp resolution
+            if i == 1:
+                cache.get(self.snapshots[0], keys[0])  # use the first again, so the second is the oldest
+        cache.evict(os.path.dirname(cache.paths(self.snapshots[0], keys[0])[0]))
+        self.assertIsNotNone(cache.get(self.snapshots[0], keys[0]))
+        self.assertIsNone(cache.get(self.snapshots[1], keys[1]))
+        self.assertIsNotNone(cache.get(self.snapshots[2], keys[2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+
+import config
+from dataops.deposit import deposit_values, nearest_image, REDUCTIONS as DEPOSIT_REDUCTIONS
+
+REDUCTIONS = ['mean', 'sum', 'weighted_mean', 'max', 'count']
+
+
+def grid_geometry(bounds, resolution):
+    '''
+    Origin and spacing of a grid with `resolution` points per axis whose corner points lie on the bounds
+    '''
+    origin = np.array([bounds[0], bounds[2], bounds[4]], dtype=np.float64)
+    extent = np.array([bounds[1] - bounds[0], bounds[3] - bounds[2], bounds[5] - bounds[4]], dtype=np.float64)
+    spacing = extent / (np.asarray(resolution) - 1)
+    spacing[spacing == 0] = 1.  # flat bounds, every point falls on the first layer
+    return origin, spacing
+
+
+def grid_indices(points, origin, spacing, resolution):
+    '''
+    Flat index (x fastest, as in vtkImageData) of the grid point nearest to every point, -1 outside the grid.
+    Same assignment as vtkImageData.FindPoint.
+    '''
+    ijk = np.floor((np.asarray(points, dtype=np.float64) - origin) / spacing + 0.5).astype(np.int64)
+    resolution = np.asarray(resolution)
+    inside = np.all((ijk >= 0) & (ijk < resolution), axis=1)
+    flat = ijk[:, 0] + resolution[0] * (ijk[:, 1] + resolution[1] * ijk[:, 2])
+    flat[~inside] = -1
+    return flat
+
+
+def bin_values(indices, values, size, reduction='mean', weights=None):
+    '''
+    Reduce the values of the points falling on each grid point with np.bincount. Grid points without any
+    particle are 0.
+
+    indices: flat grid index per point as from grid_indices, negative indices are skipped
+    reduction: one of REDUCTIONS; 'weighted_mean' needs weights, e.g. the particle masses
+    returns: float32 array of length size
+    '''
+    inside = indices >= 0
+    indices = indices[inside]
+    count = np.bincount(indices, minlength=size)
+    if reduction == 'count':
+        return count.astype(np.float32)
+    values = np.asarray(values, dtype=np.float64)[inside]
+    if reduction == 'sum':
+        return np.bincount(indices, weights=values, minlength=size).astype(np.float32)
+    if reduction == 'mean':
+        total = np.bincount(indices, weights=values, minlength=size)
+        return np.divide(total, count, out=np.zeros(size), where=count > 0).astype(np.float32)
+    if reduction == 'weighted_mean':
+        weights = np.asarray(weights, dtype=np.float64)[inside]
+        total = np.bincount(indices, weights=values * weights, minlength=size)
+        norm = np.bincount(indices, weights=weights, minlength=size)
+        return np.divide(total, norm, out=np.zeros(size), where=norm != 0).astype(np.float32)
+    if reduction == 'max':
+        out = np.zeros(size, dtype=np.float32)
+        if len(indices) == 0:
+            return out
+        order = np.argsort(indices, kind='stable')
+        sorted_indices = indices[order]
+        starts = np.flatnonzero(np.r_[True, sorted_indices[1:] != sorted_indices[:-1]])
+        out[sorted_indices[starts]] = np.maximum.reduceat(values[order], starts)
+        return out
+    raise ValueError(f'Unknown reduction {reduction!r}, expected one of {", ".join(REDUCTIONS)}')
+
+
+def to_image_data(values, bounds, resolution, name):
+    origin, spacing = grid_geometry(bounds, resolution)
+    grid = vtk.vtkImageData()
+    grid.SetDimensions(*(int(n) for n in resolution))
+    grid.SetOrigin(*origin)
+    grid.SetSpacing(*spacing)
+    scalars = numpy_to_vtk(np.ascontiguousarray(values, dtype=np.float32), deep=True)
+    scalars.SetName(name)
+    grid.GetPointData().SetScalars(scalars)
+    return grid
+
+
+def downsample(values, resolution, reduction='mean'):
+    '''
+    Halve a grid along every axis by combining blocks of 2x2x2 grid points, odd last layers are dropped. Blocks
+    are averaged even for sums and counts, so that all levels of a pyramid share one color range.
+
+    returns: (values, resolution) of the coarser grid
+    '''
+    nx, ny, nz = (int(n) for n in resolution)
+    blocks = np.asarray(values).reshape(nz, ny, nx)[:nz // 2 * 2, :ny // 2 * 2, :nx // 2 * 2]
+    blocks = blocks.reshape(nz // 2, 2, ny // 2, 2, nx // 2, 2)
+    coarse = blocks.max(axis=(1, 3, 5)) if reduction == 'max' else blocks.mean(axis=(1, 3, 5))
+    return coarse.astype(np.float32).ravel(), (nx // 2, ny // 2, nz // 2)
+
+
+def pyramid_size(resolution, min_resolution=32):
+    # Number of levels build_pyramid makes of a grid of this resolution
+    size, n = 1, min(int(v) for v in resolution)
+    while n // 2 >= min_resolution:
+        size, n = size + 1, n // 2
+    return size
+
+
+def build_pyramid(grid, min_resolution=32, reduction='mean'):
+    '''
+    Mip pyramid of a grid for drawing volumes at a lower resolution while the camera moves
+
+    returns: list of vtkImageData, the grid itself first, then each one half the resolution of the one before while
+             that still has at least min_resolution grid points along every axis
+    '''
+    levels = [grid]
+    values = vtk_to_numpy(grid.GetPointData().GetScalars())
+    name = grid.GetPointData().GetScalars().GetName()
+    resolution = grid.GetDimensions()
+    origin, spacing = np.array(grid.GetOrigin()), np.array(grid.GetSpacing())
+    while min(resolution) // 2 >= min_resolution:
+        values, resolution = downsample(values, resolution, reduction)
+        # A coarse grid point sits at the center of the block it combines
+        origin, spacing = origin + 0.5 * spacing, 2. * spacing
+        last = origin + spacing * (np.array(resolution) - 1)
+        levels.append(to_image_data(values, [v for axis in range(3) for v in (origin[axis], last[axis])], resolution,
+                                    name))
+    return levels
+
+
+def grid_kernel(reduction, kernel):
+    # Kernel actually used: reductions no kernel can deposit, like max, bin to the nearest grid point instead
+    return kernel if reduction in DEPOSIT_REDUCTIONS else 'ngp'
+
+
+def covers_box(bounds, resolution, box=None):
+    # Whether bounds reach over the whole periodic box, up to a cell of the periodic grid at every end
+    box = config.CoordMax if box is None else box
+    cell = box / np.asarray(resolution, dtype=np.float64)
+    return bool(np.all((np.asarray(bounds[0::2]) <= cell) & (np.asarray(bounds[1::2]) >= box - cell)))
+
+
+def region_bounds(polydata, roi=None):
+    # Bounds to grid polydata over: the region of interest it was cropped to, else the extent of its points
+    return polydata.GetBounds() if roi is None else tuple(roi)
+
+
+def grid_polydata(polydata, array_name, bounds, resolution, reduction='mean', weight_array='mass', kernel='ngp'):
+    '''
+    Bin the points of a polydata onto a vtkImageData, reducing the values of array_name per grid point
+
+    kernel: 'ngp' assigns every point to its nearest grid point within bounds, 'cic', 'tsc' and 'sph' deposit the
+            points onto a grid over bounds, with periodic wrap when bounds cover the whole box, see deposit.Deposit.
+            'max' always uses 'ngp'.
+    '''
+    points = vtk_to_numpy(polydata.GetPoints().GetData())
+    point_data = polydata.GetPointData()
+    values = vtk_to_numpy(point_data.GetArray(array_name)) if reduction != 'count' else None
+    weights = vtk_to_numpy(point_data.GetArray(weight_array)) if reduction == 'weighted_mean' else None
+    kernel = grid_kernel(reduction, kernel)
+    region = None if covers_box(bounds, resolution) else bounds
+    if kernel != 'ngp':
+        hh = vtk_to_numpy(point_data.GetArray('hh')) if kernel == 'sph' else None
+        values, engine = deposit_values(points, values, resolution, reduction, kernel, hh, weights, region=region)
+        return to_image_data(values, engine.bounds(), resolution, array_name)
+    origin, spacing = grid_geometry(bounds, resolution)
+    if region is not None:
+        # Bounds reaching past the box edge, like a region of interest, hold the periodic images of the points
+        points = nearest_image(points, origin + 0.5 * (np.asarray(bounds[1::2]) - origin), config.CoordMax)
+    indices = grid_indices(points, origin, spacing, resolution)
+    values = bin_values(indices, values, int(np.prod(resolution)), reduction, weights)
+    return to_image_data(values, bounds, resolution, array_name)
@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+import config
+from dataops.gridding import grid_geometry, grid_indices, bin_values, to_image_data, build_pyramid, grid_kernel, \
+    grid_polydata
+
+
+class TestGridding(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.points = rng.random((5000, 3)) * 64.
+        self.values = rng.random(5000)
+        self.mass = rng.random(5000) + 0.5
+        self.resolution = (9, 7, 5)
+        self.size = int(np.prod(self.resolution))
+        origin, spacing = grid_geometry((0, 64, 0, 64, 0, 64), self.resolution)
+        self.indices = grid_indices(self.points, origin, spacing, self.resolution)
+
+    def test_nearest_grid_point(self):
+        # Point on a grid point, and one just past the midpoint of the first cell along y
+        origin, spacing = grid_geometry((0, 8, 0, 6, 0, 4), (9, 7, 5))
+        np.testing.assert_array_equal(grid_indices(np.array([(2., 3., 1.), (0., 0.51, 0.), (9., 0., 0.)]),
+                                                   origin, spacing, (9, 7, 5)), [2 + 9 * (3 + 7 * 1), 9, -1])
+
+    def test_reductions(self):
+        expected = {name: np.zeros(self.size) for name in ('sum', 'count', 'max', 'weighted')}
+        norm = np.zeros(self.size)
+        for i, value, mass in zip(self.indices, self.values, self.mass):
+            expected['sum'][i] += value
+            expected['count'][i] += 1
+            expected['max'][i] = max(expected['max'][i], value)
+            expected['weighted'][i] += value * mass
+            norm[i] += mass
+        mean = np.divide(expected['sum'], expected['count'], out=np.zeros(self.size), where=expected['count'] > 0)
+        weighted = np.divide(expected['weighted'], norm, out=np.zeros(self.size), where=norm > 0)
+        for reduction, result in (('sum', expected['sum']), ('count', expected['count']), ('max', expected['max']),
+                                  ('mean', mean), ('weighted_mean', weighted)):
+            np.testing.assert_allclose(bin_values(self.indices, self.values, self.size, reduction, self.mass), result,
+                                       rtol=1e-6, err_msg=reduction)
+
+    def test_unknown_reduction(self):
+        with self.assertRaises(ValueError):
+            bin_values(self.indices, self.values, self.size, 'median')
+
+    def test_max_falls_back_to_ngp(self):
+        self.assertEqual(grid_kernel('max', 'sph'), 'ngp')
+        self.assertEqual(grid_kernel('mean', 'sph'), 'sph')
+
+    def test_pyramid(self):
+        values = np.arange(8 * 6 * 4, dtype=np.float32)
+        levels = build_pyramid(to_image_data(values, (0, 7, 0, 5, 0, 3), (8, 6, 4), 'rho'), min_resolution=2)
+        self.assertEqual([level.GetDimensions() for level in levels], [(8, 6, 4), (4, 3, 2)])
+        # The first coarse grid point averages x 0-1, y 0-1, z 0-1 and sits at their center
+        self.assertAlmostEqual(levels[1].GetPointData().GetScalars().GetValue(0),
+                               values.reshape(4, 6, 8)[:2, :2, :2].mean())
+        self.assertEqual(levels[1].GetOrigin(), (0.5, 0.5, 0.5))
+        self.assertEqual(levels[1].GetSpacing(), (2., 2., 2.))
+
+    def test_deposit_onto_region(self):
+        points = vtkPoints()
+        points.SetData(numpy_to_vtk(self.points * config.CoordMax / 64., deep=True))
+        polydata = vtkPolyData()
+        polydata.SetPoints(points)
+        array = numpy_to_vtk(self.values, deep=True)
+        array.SetName('rho')
+        polydata.GetPointData().AddArray(array)
+        box = 0., config.CoordMax, 0., config.CoordMax, 0., config.CoordMax
+        whole = grid_polydata(polydata, 'rho', box, (16, 16, 16), 'mean', kernel='cic')
+        last = config.CoordMax * 15 / 16
+        np.testing.assert_allclose(whole.GetBounds(), (0., last, 0., last, 0., last))
+        # A region reaching past the box edge takes the periodic images of the particles
+        roi = tuple(np.array([-0.1, 0.3, 0.2, 0.5, 0.4, 0.6]) * config.CoordMax)
+        for kernel in ('cic', 'tsc'):
+            np.testing.assert_allclose(grid_polydata(polydata, 'rho', roi, (9, 7, 5), 'count', kernel=kernel)
+                                       .GetBounds(), roi)
+        image = grid_polydata(polydata, 'rho', roi, (9, 7, 5), 'count', kernel='cic')
+        # Trilinear weight of every particle at every grid point of the region, by the nearest periodic image
+        origin, spacing = grid_geometry(roi, (9, 7, 5))
+        grid = np.stack(np.meshgrid(*(origin[a] + spacing[a] * np.arange(n) for a, n in enumerate((9, 7, 5))),
+                                    indexing='ij'), axis=-1).transpose(2, 1, 0, 3).reshape(-1, 3)
+        delta = self.points[:, None] * config.CoordMax / 64. - grid
+        delta -= config.CoordMax * np.round(delta / config.CoordMax)
+        expected = np.prod(np.maximum(1. - np.abs(delta) / spacing, 0.), axis=2).sum(axis=0)
+        np.testing.assert_allclose(vtk_to_numpy(image.GetPointData().GetScalars()), expected, rtol=1e-5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,89 +1,249 @@
+import threading
+from collections import OrderedDict
+
 from vtkmodules.vtkFiltersSources import vtkPlaneSource
 from vtkmodules.vtkCommonDataModel import vtkPolyData
-from vtkmodules.vtkFiltersPoints import (
-    vtkGaussianKernel,
-    vtkPointInterpolator
-)
+from vtkmodules.vtkFiltersCore import vtkProbeFilter
 from vtkmodules.vtkRenderingCore import (
     vtkActor,
     vtkPolyDataMapper,
 )
 
+import numpy as np
+from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+
 import config
+from dataops.deposit import deposit_values
+from dataops.gridding import to_image_data
+from dataops.spatialindex import SpatialIndex
+
+
+def place_plane(plane_source, axis, val):
+    if axis == 'x':
+        plane_source.SetOrigin(val, 0, 0)
+        plane_source.SetPoint1(val, config.CoordMax, 0)
+        plane_source.SetPoint2(val, 0, config.CoordMax)
+    elif axis == 'y':
+        plane_source.SetOrigin(0, val, 0)
+        plane_source.SetPoint1(config.CoordMax, val, 0)
+        plane_source.SetPoint2(0, val, config.CoordMax)
+    elif axis == 'z':
+        plane_source.SetOrigin(0, 0, val)
+        plane_source.SetPoint1(config.CoordMax, 0, val)
+        plane_source.SetPoint2(0, config.CoordMax, val)
+    else:
+        print('Error: invalid axis')
+        exit(1)
+
+
+class PlaneWeights:
+    '''
+    Gaussian kernel weights of the particles around every point of a plane, in CSR layout: the particles around
+    plane point i are ids[indptr[i]:indptr[i + 1]]. Interpolated arrays are kept along, so that switching back to a
+    metric does not even need the weights again.
+    '''
+
+    def __init__(self, indptr, ids, weights):
+        self.indptr = indptr
+        self.ids = ids
+        self.weights = weights  # float32, normalized per plane point, as vtkGaussianKernel does
+        self.arrays = {}  # array name -> interpolated values
+
+    @property
+    def nbytes(self):
+        return (self.indptr.nbytes + self.ids.nbytes + self.weights.nbytes +
+                sum(values.nbytes for values in list(self.arrays.values())))
+
+    def rows(self):
+        # Plane point of every weight
+        return np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int32), np.diff(self.indptr))
+
+    @classmethod
+    def compute(cls, index, plane_points, sharpness, radius):
+        indptr, ids, dist = index.query_radius_many(plane_points, radius)
+        weights = np.exp(-(sharpness / radius) ** 2 * dist ** 2) if radius > 0 else np.ones(len(ids))
+        rows = np.repeat(np.arange(len(plane_points)), np.diff(indptr))
+        norm = np.bincount(rows, weights=weights, minlength=len(plane_points))[rows]
+        weights = np.divide(weights, norm, out=np.zeros(len(weights)), where=norm > 0)
+        # int32 ids and float32 weights halve the memory of a cached plane
+        ids = ids.astype(np.int32) if len(ids) == 0 or ids.max() <= np.iinfo(np.int32).max else ids
+        return cls(indptr, ids, weights.astype(np.float32))
+
+    def apply(self, name, values):
+        # Plane points without any particle in reach get 0, like vtkPointInterpolator's null value
+        if name not in self.arrays:
+            self.arrays[name] = np.bincount(self.rows(), weights=np.asarray(values, dtype=np.float64)[self.ids] *
+                                            self.weights, minlength=len(self.indptr) - 1).astype(np.float32)
+        return self.arrays[name]
+
+
+class PlaneCache:
+    '''
+    LRU of PlaneWeights keyed by (snapshot, axis, position, resolution, sharpness, radius) and bounded by a byte
+    budget, shared by all interpolators, so that going back to a recent plane position or snapshot does not search
+    neighbours again
+    '''
+
+    def __init__(self, budget=None):
+        self.budget = config.PlaneCacheBytes if budget is None else budget
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        # Summed on demand, entries grow by the arrays interpolated with them
+        return sum(weights.nbytes for weights in self.entries.values())
+
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        weights = compute()
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = weights
+            # The newest entry stays even if it alone is over the budget
+            nbytes = self.nbytes
+            while len(self.entries) > 1 and nbytes > self.budget:
+                nbytes -= self.entries.popitem(last=False)[1].nbytes
+        return weights
+
+
+plane_cache = PlaneCache()
+
 
 class Interpolator:
-    def __init__(self, polydata: vtkPolyData):
+    '''
+    Scan plane colored by the particle data around it.
+
+    mode: 'kernel' interpolates the particles onto the plane with a Gaussian kernel, computing the weights once per
+          plane position and applying them to every array shown there, 'grid' deposits the array once onto a
+          periodic 3D grid with config.ScanPlaneGridKernel and resamples that trilinearly along the plane, ignoring
+          the Gaussian kernel's sharpness and radius
+    source: hashable name of the particles, e.g. (snapshot file, region of interest), under which plane weights
+            are shared with other interpolators through plane_cache; None shares nothing
+    index: SpatialIndex of the particles, or a callable loading it, 'kernel' mode builds it otherwise
+
+    Nothing is computed until the first plane is interpolated, which can happen on a worker thread.
+    '''
+    def __init__(self, polydata: vtkPolyData, mode=None, source=None, index=None):
         self.polydata = polydata
-        
-        self.plane_source = vtkPlaneSource()
-        self.plane_source.SetOrigin(0, 0, config.CoordMax / 2)
-        self.plane_source.SetPoint1(config.CoordMax, 0, config.CoordMax / 2)
-        self.plane_source.SetPoint2(0, config.CoordMax, config.CoordMax / 2)
-        self.plane_source.SetResolution(config.CellRes, config.CellRes)
-        self.plane_source.Update()
-
-        # Interpolate from the point data to the cell data on the plane
-        self.gaussian_kernel = vtkGaussianKernel()
-        self.gaussian_kernel.SetSharpness(10)
-        self.gaussian_kernel.SetRadius(3)
-
-        interpolator = vtkPointInterpolator()
-        interpolator.SetInputConnection(self.plane_source.GetOutputPort())
-        interpolator.SetSourceData(self.polydata)
-        interpolator.SetKernel(self.gaussian_kernel)
-        interpolator.Update()
-
-        # Debug print of interpolated data
-        # data: vtkPolyData = interpolator.GetOutput()
-        # print('Interpolated data:')
-        # print('Number of points:', data.GetNumberOfPoints())
-        # print('Number of cells:', data.GetNumberOfCells())
-        # print('Number of point data arrays:', data.GetPointData().GetNumberOfArrays())
-        # print('Number of cell data arrays:', data.GetCellData().GetNumberOfArrays())
-        # arr = np.array(data.GetPointData().GetScalars())
-        # print(arr, arr.shape, arr.mean())
+        self.mode = config.ScanPlaneMode if mode is None else mode
+        self.source = object() if source is None else source
+        self.array_name = config.ArrayName
+        self.sharpness = 10.
+        self.radius = 3.
+        self.fields = {}  # array name -> deposited vtkImageData in 'grid' mode
+        self.index = index
+        self.lock = threading.Lock()
 
         plane_mapper = vtkPolyDataMapper()
-        plane_mapper.SetInputConnection(interpolator.GetOutputPort())
+        plane_mapper.SetInputData(vtkPolyData())
         plane_mapper.SetScalarRange(config.RangeMin, config.RangeMax)
         plane_mapper.SetLookupTable(config.Lut)
+        self.plane_mapper = plane_mapper
 
         self.plane_actor = vtkActor()
         self.plane_actor.SetMapper(plane_mapper)
 
+    def particle_data(self, array_name=None):
+        '''
+        Points, values of array_name and smoothing lengths (None without hh) of the particles as numpy arrays. Take
+        them on the thread that owns the polydata and pass them to interpolate, which then never touches the
+        polydata while arrays are added to it.
+        '''
+        array_name = self.array_name if array_name is None else array_name
+        point_data = self.polydata.GetPointData()
+        hh = point_data.GetArray('hh')
+        return (vtk_to_numpy(self.polydata.GetPoints().GetData()), vtk_to_numpy(point_data.GetArray(array_name)),
+                None if hh is None else vtk_to_numpy(hh))
+
+    def spatial_index(self, points):
+        with self.lock:
+            if self.index is None:
+                self.index = SpatialIndex.build(points, config.CoordMax)
+            elif not isinstance(self.index, SpatialIndex):
+                self.index = self.index()
+            return self.index
+
+    def deposit_field(self, array_name, data=None):
+        '''
+        Field of an array deposited with config.ScanPlaneGridKernel on config.CellRes grid points per axis. The
+        first layer is repeated past the last one, so that the grid covers the whole periodic box up to CoordMax.
+
+        data: particle_data of the array, read from the polydata by default
+        '''
+        with self.lock:
+            if array_name not in self.fields:
+                n = config.CellRes
+                kernel = config.ScanPlaneGridKernel
+                points, values, hh = self.particle_data(array_name) if data is None else data
+                values, _ = deposit_values(points, values, (n, n, n), 'mean', kernel, hh if kernel == 'sph' else None)
+                values = np.pad(values.reshape(n, n, n), ((0, 1), (0, 1), (0, 1)), mode='wrap')
+                self.fields[array_name] = to_image_data(values.ravel(), (0, config.CoordMax) * 3, (n + 1, n + 1, n + 1),
+                                                        array_name)
+            return self.fields[array_name]
+
+    def interpolate(self, axis, val, resolution=None, sharpness=None, radius=None, array_name=None, data=None,
+                    cache=True):
+        '''
+        Plane at val along axis as a standalone polydata, so that it can be computed on another thread than the one
+        drawing. Show it with show_plane.
+
+        resolution: cells per side, config.CellRes by default
+        data: particle_data of array_name, needed when not called on the thread that owns the polydata
+        cache: keep the kernel weights in plane_cache, off for passing positions such as a coarse drag
+        '''
+        resolution = config.CellRes if resolution is None else resolution
+        sharpness = self.sharpness if sharpness is None else sharpness
+        radius = self.radius if radius is None else radius
+        array_name = self.array_name if array_name is None else array_name
+        data = self.particle_data(array_name) if data is None else data
+        plane_source = vtkPlaneSource()
+        place_plane(plane_source, axis, val)
+        plane_source.SetResolution(resolution, resolution)
+        plane_source.Update()
+        if self.mode == 'grid':
+            probe = vtkProbeFilter()
+            probe.SetSourceData(self.deposit_field(array_name, data))
+            probe.SetInputData(plane_source.GetOutput())
+            probe.Update()
+            plane = vtkPolyData()
+            plane.ShallowCopy(probe.GetOutput())
+            return plane
+        plane = vtkPolyData()
+        plane.ShallowCopy(plane_source.GetOutput())
+        plane_points = vtk_to_numpy(plane.GetPoints().GetData())
+        compute = lambda: PlaneWeights.compute(self.spatial_index(data[0]), plane_points, sharpness, radius)
+        weights = compute() if not cache else plane_cache.get(
+            (self.source, axis, float(val), resolution, float(sharpness), float(radius)), compute)
+        values = numpy_to_vtk(weights.apply(array_name, data[1]), deep=True)
+        values.SetName(array_name)
+        plane.GetPointData().SetScalars(values)
+        return plane
+
+    def show_plane(self, plane):
+        self.plane_mapper.SetInputData(plane)
+
     def get_plane_actor(self):
         return self.plane_actor
-    
+
     def set_plane_z(self, z):
         # Move the plane in the z direction, z: [0, CoordMax] float
-        self.plane_source.SetOrigin(0, 0, z)
-        self.plane_source.SetPoint1(config.CoordMax, 0, z)
-        self.plane_source.SetPoint2(0, config.CoordMax, z)
-        self.plane_source.Update()
+        self.set_plane('z', z)
 
     def set_plane(self, axis, val):
-        if axis == 'x':
-            self.plane_source.SetOrigin(val, 0, 0)
-            self.plane_source.SetPoint1(val, config.CoordMax, 0)
-            self.plane_source.SetPoint2(val, 0, config.CoordMax)
-        elif axis == 'y':
-            self.plane_source.SetOrigin(0, val, 0)
-            self.plane_source.SetPoint1(config.CoordMax, val, 0)
-            self.plane_source.SetPoint2(0, val, config.CoordMax)
-        elif axis == 'z':
-            self.plane_source.SetOrigin(0, 0, val)
-            self.plane_source.SetPoint1(config.CoordMax, 0, val)
-            self.plane_source.SetPoint2(0, config.CoordMax, val)
-        else:
-            print('Error: invalid axis')
-            exit(1)
-        self.plane_source.Update()
+        self.show_plane(self.interpolate(axis, val))
 
+    def set_array(self, array_name):
+        # Show another array on the same plane, reusing the kernel weights of the plane position
+        self.array_name = array_name
+        self.plane_mapper.SetScalarRange(config.RangeMin, config.RangeMax)
+        self.plane_mapper.SetLookupTable(config.Lut)
 
     def set_kernel_sharpness(self, sharpness):
-        self.gaussian_kernel.SetSharpness(sharpness)
-        self.gaussian_kernel.Modified()
-    
+        self.sharpness = sharpness
+
     def set_kernel_radius(self, radius):
-        self.gaussian_kernel.SetRadius(radius)
-        self.gaussian_kernel.Modified()
+        self.radius = radius
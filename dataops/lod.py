@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+
+import config
+from dataops import snapshot, particletype
+from dataops.spatialindex import SpatialIndex
+
+LOD_ARRAY = 'lod'
+POINTS_PER_NODE = 8  # representatives kept per octree node and particle type
+MAX_LEVEL = 10  # finest octree level, points not picked up to there get MAX_LEVEL + 1
+
+
+def build_levels(points, labels, box=None, seed=0):
+    '''
+    Level of detail of every point: the octree level from which on it is drawn. At level L the box is split into
+    2^L cells per axis and every cell keeps up to POINTS_PER_NODE random representatives of each particle type,
+    so drawing the points with level <= L gives an even subsample that still shows rare types.
+    '''
+    box = config.CoordMax if box is None else box
+    n = len(points)
+    levels = np.full(n, MAX_LEVEL + 1, dtype=np.uint8)
+    # Random priority decides which points of a cell represent it, and the same ones on every level
+    priority = np.random.default_rng(seed).permutation(n).astype(np.int64)
+    labels = labels.astype(np.int64)
+    for level in range(MAX_LEVEL + 1):
+        codes = SpatialIndex.point_codes(points, box, 1 << level) * len(particletype.TYPE_CODES) + labels
+        order = np.argsort(codes * n + priority)
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        rank = np.arange(n) - np.repeat(starts, sizes)
+        picked = order[rank < POINTS_PER_NODE]
+        levels[picked] = np.minimum(levels[picked], level)
+        if sizes.max(initial=0) <= POINTS_PER_NODE:
+            break  # every point is a representative of its cell from here on
+    return levels
+
+
+def choose_level(levels, max_points):
+    '''
+    returns: the finest level whose subsample has at most max_points points, None if all points fit
+    '''
+    counts = np.cumsum(np.bincount(levels, minlength=MAX_LEVEL + 2))
+    if counts[-1] <= max_points:
+        return None
+    fitting = np.flatnonzero(counts <= max_points)
+    return int(fitting[-1]) if len(fitting) else 0
+
+
+def snapshot_levels(filename, points, labels):
+    # Levels of detail of a loaded snapshot, stored in its cache if it came from there
+    if config.UseSnapshotCache:
+        return load_levels(filename, points, labels)
+    return build_levels(points, labels)
+
+
+def load_levels(filename, points, labels):
+    '''
+    Levels of detail of a cached snapshot, built on first use and stored next to its columns
+    '''
+    path = snapshot.column_path(snapshot.cache_dir(filename), LOD_ARRAY)
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='r')
+    levels = build_levels(points, labels)
+    tmp = path + '.tmp.npy'
+    np.save(tmp, levels)
+    os.replace(tmp, path)
+    return levels
@@ -0,0 +1,86 @@
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+
+import config
+
+TYPE_ARRAY = 'type'  # name of the uint8 label column
+OFFSETS_ARRAY = 'type_offsets'  # field data of polydata whose points are grouped by type
+TYPE_CODES = {name: code for code, name in enumerate(config.FilterList)}  # 'dm' -> 0, 'baryon' -> 1, ...
+
+
+def label_particles(mask):
+    '''
+    Decode the mask bitfield into one uint8 type label per particle, see data_description.txt:
+    2nd bit baryon, 6th star, 7th wind, 8th star-forming gas, 9th AGN (dark matter only).
+    Plain baryons and dark matter are the ones without any further flag.
+    '''
+    mask = np.asarray(mask).astype(np.int32, copy=False)
+    labels = np.full(len(mask), TYPE_CODES['dm'], dtype=np.uint8)
+    baryon = mask & (1 << 1) != 0
+    labels[baryon] = TYPE_CODES['baryon']
+    # Later assignments win, so a particle flagged e.g. both star and gas is a star
+    labels[baryon & (mask & (1 << 7) != 0)] = TYPE_CODES['gas']
+    labels[baryon & (mask & (1 << 6) != 0)] = TYPE_CODES['wind']
+    labels[baryon & (mask & (1 << 5) != 0)] = TYPE_CODES['star']
+    labels[~baryon & (mask & (1 << 8) != 0)] = TYPE_CODES['agn']
+    return labels
+
+
+def get_labels(polydata):
+    # Type labels of a polydata, decoded from the mask if it has no label column
+    point_data = polydata.GetPointData()
+    if point_data.HasArray(TYPE_ARRAY):
+        return vtk_to_numpy(point_data.GetArray(TYPE_ARRAY)).astype(np.uint8, copy=False)
+    return label_particles(vtk_to_numpy(point_data.GetArray('mask')))
+
+
+def add_labels(polydata):
+    if polydata.GetPointData().HasArray(TYPE_ARRAY):
+        return
+    labels = numpy_to_vtk(get_labels(polydata), deep=True)
+    labels.SetName(TYPE_ARRAY)
+    polydata.GetPointData().AddArray(labels)
+
+
+def type_counts(labels):
+    counts = np.bincount(labels, minlength=len(TYPE_CODES))
+    return {name: int(counts[code]) for name, code in TYPE_CODES.items()}
+
+
+def sort_by_type(labels, keys=None):
+    '''
+    Permutation that groups particles by type. Within a type, particles are ordered by keys if given and keep
+    their relative order otherwise.
+
+    returns: (permutation, offsets) where type code t occupies [offsets[t], offsets[t + 1]) after permuting
+    '''
+    order = np.argsort(labels, kind='stable') if keys is None else np.lexsort((keys, labels))
+    offsets = np.searchsorted(labels[order], np.arange(len(TYPE_CODES) + 1))
+    return order, offsets
+
+
+def type_ids(polydata):
+    # Point ids of every type, as a list indexed by type code
+    offsets = get_offsets(polydata)
+    if offsets is not None:
+        return [np.arange(a, b) for a, b in zip(offsets[:-1], offsets[1:])]
+    labels = get_labels(polydata)
+    return [np.flatnonzero(labels == code) for code in TYPE_CODES.values()]
+
+
+def set_offsets(polydata, offsets):
+    arr = numpy_to_vtk(np.asarray(offsets, dtype=np.int64), deep=True, array_type=vtk.VTK_ID_TYPE)
+    arr.SetName(OFFSETS_ARRAY)
+    polydata.GetFieldData().AddArray(arr)
+
+
+def get_offsets(polydata):
+    # Per-type offsets if the points of the polydata are grouped by type, None otherwise
+    arr = polydata.GetFieldData().GetAbstractArray(OFFSETS_ARRAY)
+    if arr is None:
+        return None
+    offsets = vtk_to_numpy(arr)
+    if offsets[-1] != polydata.GetNumberOfPoints():
+        return None  # a filtered subset that inherited the field data of its input
+    return offsets
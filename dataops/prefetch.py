@@ -0,0 +1,134 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+
+def available_memory():
+    # Bytes of memory the OS can still hand out without swapping, None if unknown
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def polydata_nbytes(polydata):
+    return polydata.GetActualMemorySize() * 1024
+
+
+class SnapshotCache:
+    '''
+    LRU cache of loaded snapshots, bounded by a byte budget. Least recently used snapshots are dropped first when
+    the budget is exceeded or the system runs low on memory. Snapshots are measured when they are put, and again
+    with resize when arrays are loaded into them later.
+    '''
+
+    def __init__(self, budget=None, min_free=None):
+        self.budget = config.SnapshotCacheBytes if budget is None else budget
+        self.min_free = config.SnapshotCacheMinFreeBytes if min_free is None else min_free
+        self.entries = OrderedDict()  # filename -> (polydata, nbytes)
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, filename):
+        with self.lock:
+            return filename in self.entries
+
+    def get(self, filename):
+        with self.lock:
+            if filename not in self.entries:
+                return None
+            self.entries.move_to_end(filename)
+            return self.entries[filename][0]
+
+    def put(self, filename, polydata):
+        nbytes = polydata_nbytes(polydata)
+        with self.lock:
+            if filename in self.entries:
+                self.nbytes -= self.entries.pop(filename)[1]
+            self.entries[filename] = (polydata, nbytes)
+            self.nbytes += nbytes
+            self._evict(keep=filename)
+
+    def resize(self, filename):
+        # Measure a cached snapshot again after arrays were added to it, e.g. by snapshot.add_arrays
+        with self.lock:
+            if filename not in self.entries:
+                return
+            polydata, nbytes = self.entries[filename]
+            self.entries[filename] = (polydata, polydata_nbytes(polydata))
+            self.nbytes += self.entries[filename][1] - nbytes
+            self._evict(keep=filename)
+
+    def _evict(self, keep):
+        while len(self.entries) > 1 and (self.nbytes > self.budget or self._memory_low()):
+            filename = next(iter(self.entries))
+            if filename == keep:
+                self.entries.move_to_end(filename)
+                filename = next(iter(self.entries))
+            self.nbytes -= self.entries.pop(filename)[1]
+
+    def _memory_low(self):
+        free = available_memory()
+        return free is not None and free < self.min_free
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+class Prefetcher:
+    '''
+    Loads snapshots on a worker pool into a SnapshotCache, so that stepping through time does not block on reading
+    '''
+
+    def __init__(self, cache: SnapshotCache, loader, workers=None):
+        self.cache = cache
+        self.loader = loader  # filename -> vtkPolyData
+        self.executor = ThreadPoolExecutor(max_workers=workers or config.PrefetchWorkers)
+        self.pending = {}  # filename -> Future
+        self.lock = threading.Lock()
+
+    def prefetch(self, filenames):
+        with self.lock:
+            for filename in filenames:
+                if filename in self.pending or filename in self.cache:
+                    continue
+                self.pending[filename] = self.executor.submit(self._load, filename)
+
+    def _load(self, filename):
+        try:
+            polydata = self.loader(filename)
+            self.cache.put(filename, polydata)
+            return polydata
+        finally:
+            with self.lock:
+                self.pending.pop(filename, None)
+
+    def get(self, filename):
+        # Cached snapshot, or wait for it if it is currently being prefetched. None if neither.
+        polydata = self.cache.get(filename)
+        if polydata is not None:
+            return polydata
+        with self.lock:
+            future = self.pending.get(filename)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            print(f'Prefetching {filename} failed: {e}')
+            return None
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import numpy_to_vtk
+
+from dataops.prefetch import SnapshotCache, polydata_nbytes
+
+
+def make_polydata(n):
+    polydata = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_to_vtk(np.zeros((n, 3)), deep=True))
+    polydata.SetPoints(points)
+    return polydata
+
+
+def add_array(polydata, name):
+    arr = numpy_to_vtk(np.zeros(polydata.GetNumberOfPoints()), deep=True)
+    arr.SetName(name)
+    polydata.GetPointData().AddArray(arr)
+
+
+class TestSnapshotCache(unittest.TestCase):
+    def test_arrays_added_later_count(self):
+        first, second = make_polydata(100000), make_polydata(100000)
+        cache = SnapshotCache(budget=3 * polydata_nbytes(first), min_free=0)
+        cache.put('a', first)
+        cache.put('b', second)
+        self.assertEqual(cache.nbytes, polydata_nbytes(first) + polydata_nbytes(second))
+        for name in ('rho', 'phi', 'hh'):
+            add_array(second, name)
+        cache.resize('b')
+        # b has grown past the budget together with a, so the older a is dropped
+        self.assertNotIn('a', cache)
+        self.assertIs(cache.get('b'), second)
+        self.assertEqual(cache.nbytes, polydata_nbytes(second))
+        cache.resize('a')
+        self.assertEqual(cache.nbytes, polydata_nbytes(second))
+
+
+if __name__ == '__main__':
+    unittest.main()
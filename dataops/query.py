@@ -0,0 +1,242 @@
+import operator
+import re
+from collections import OrderedDict
+
+import numpy as np
+from vtkmodules.util.numpy_support import vtk_to_numpy
+
+from dataops import particletype
+
+CHUNK_SIZE = 1 << 20  # points per evaluation chunk, a multiple of 8 so chunks pack into whole bytes
+MAX_CACHED_CLAUSES = 32
+
+COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+               '==': operator.eq, '!=': operator.ne}
+MIRRORED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}  # 1 < rho is rho > 1
+
+TOKEN_PATTERN = re.compile(r'''
+    \s*(?:
+      (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    | (?P<op><=|>=|==|!=|<|>|&|\||~|\(|\)|,)
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    | `(?P<quoted>[^`]+)`
+    )''', re.VERBOSE)
+
+
+class QueryError(ValueError):
+    pass
+
+
+def tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = TOKEN_PATTERN.match(expression, pos)
+        if not match or match.end() == pos:
+            raise QueryError(f'Unexpected character at position {pos}: {expression[pos:]!r}')
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'quoted':
+            kind = 'name'
+        elif kind == 'name' and value in ('in', 'not'):
+            kind = 'op'
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class Parser:
+    '''
+    Recursive descent parser for query expressions, e.g. rho > 1e10 & type in (gas, star) & hh < 0.2
+
+        expression := term ('|' term)*
+        term       := factor ('&' factor)*
+        factor     := '~' factor | '(' expression ')' | clause
+        clause     := name op number | number op name | number op name op number
+                    | name ['not'] 'in' '(' value (',' value)* ')'
+
+    Array names containing other characters can be written in backticks. The result is a tree of tuples:
+    ('or', a, b), ('and', a, b), ('not', a), ('cmp', name, op, value) and ('in', name, values).
+    '''
+
+    def __init__(self, expression):
+        self.tokens = tokenize(expression)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise QueryError('Unexpected end of query')
+        self.pos += 1
+        return token
+
+    def expect(self, kind, value=None):
+        token = self.next()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise QueryError(f'Expected {value or kind}, got {token[1]!r}')
+        return token[1]
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError('Empty query')
+        node = self.expression()
+        if self.pos != len(self.tokens):
+            raise QueryError(f'Unexpected {self.peek()[1]!r}')
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.peek() == ('op', '|'):
+            self.next()
+            node = ('or', node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() == ('op', '&'):
+            self.next()
+            node = ('and', node, self.factor())
+        return node
+
+    def factor(self):
+        token = self.peek()
+        if token == ('op', '~'):
+            self.next()
+            return ('not', self.factor())
+        if token == ('op', '('):
+            self.next()
+            node = self.expression()
+            self.expect('op', ')')
+            return node
+        return self.clause()
+
+    def comparison(self):
+        op = self.expect('op')
+        if op not in COMPARISONS:
+            raise QueryError(f'Expected a comparison, got {op!r}')
+        return op
+
+    def clause(self):
+        kind, value = self.next()
+        if kind == 'number':
+            # number op name [op number]
+            lo, op = float(value), self.comparison()
+            name = self.expect('name')
+            node = ('cmp', name, MIRRORED[op], lo)
+            if self.peek()[0] == 'op' and self.peek()[1] in COMPARISONS:
+                op = self.comparison()
+                node = ('and', node, ('cmp', name, op, float(self.expect('number'))))
+            return node
+        if kind != 'name':
+            raise QueryError(f'Expected an array name, got {value!r}')
+        name = value
+        if self.peek() in (('op', 'in'), ('op', 'not')):
+            negate = self.next()[1] == 'not'
+            if negate:
+                self.expect('op', 'in')
+            self.expect('op', '(')
+            values = [self.next()[1]]
+            while self.peek() == ('op', ','):
+                self.next()
+                values.append(self.next()[1])
+            self.expect('op', ')')
+            node = ('in', name, tuple(values))
+            return ('not', node) if negate else node
+        op = self.comparison()
+        return ('cmp', name, op, float(self.expect('number')))
+
+
+def parse(expression):
+    return Parser(expression).parse()
+
+
+def clause_key(node):
+    # Canonical text of a clause, so that e.g. 'rho>1e10' and 'rho > 10000000000' share one cached mask
+    if node[0] == 'cmp':
+        return f'{node[1]} {node[2]} {node[3]!r}'
+    return f'{node[1]} in ({", ".join(node[2])})'
+
+
+class QueryEngine:
+    '''
+    Evaluates query expressions over the columns of one snapshot. Every clause is evaluated in chunks into a
+    packed bitmask (one bit per point) that is kept in a small LRU, and clauses are combined with bitwise
+    operations on the packed bytes. Editing one clause of a query therefore only evaluates that clause again.
+
+    column: callable returning the 1d numpy array of a column by name
+    '''
+
+    def __init__(self, column, num_points):
+        self.column = column
+        self.num_points = num_points
+        self.clauses = OrderedDict()  # clause key -> packed bitmask
+
+    @classmethod
+    def for_polydata(cls, polydata):
+        point_data = polydata.GetPointData()
+
+        def column(name):
+            if name == particletype.TYPE_ARRAY:
+                return particletype.get_labels(polydata)
+            if not point_data.HasArray(name):
+                raise QueryError(f'Unknown array {name!r}')
+            return vtk_to_numpy(point_data.GetArray(name))
+
+        return cls(column, polydata.GetNumberOfPoints())
+
+    def clause_mask(self, node):
+        key = clause_key(node)
+        if key in self.clauses:
+            self.clauses.move_to_end(key)
+            return self.clauses[key]
+        values = self.column(node[1])
+        if values.ndim != 1:
+            raise QueryError(f'{node[1]} is not a scalar array')
+        if node[0] == 'cmp':
+            compare, threshold = COMPARISONS[node[2]], node[3]
+            test = lambda chunk: compare(chunk, threshold)
+        else:
+            codes = np.asarray([self.type_code(value) if node[1] == particletype.TYPE_ARRAY else float(value)
+                                for value in node[2]])
+            test = lambda chunk: np.isin(chunk, codes)
+        packed = np.empty((self.num_points + 7) // 8, dtype=np.uint8)
+        for start in range(0, self.num_points, CHUNK_SIZE):
+            packed[start // 8:(start + CHUNK_SIZE + 7) // 8] = np.packbits(test(values[start:start + CHUNK_SIZE]))
+        self.clauses[key] = packed
+        if len(self.clauses) > MAX_CACHED_CLAUSES:
+            self.clauses.popitem(last=False)
+        return packed
+
+    @staticmethod
+    def type_code(value):
+        if value in particletype.TYPE_CODES:
+            return particletype.TYPE_CODES[value]
+        try:
+            return int(value)
+        except ValueError:
+            raise QueryError(f'Unknown particle type {value!r}, expected one of {", ".join(particletype.TYPE_CODES)}')
+
+    def evaluate(self, node):
+        if node[0] == 'and':
+            return np.bitwise_and(self.evaluate(node[1]), self.evaluate(node[2]))
+        if node[0] == 'or':
+            return np.bitwise_or(self.evaluate(node[1]), self.evaluate(node[2]))
+        if node[0] == 'not':
+            return np.invert(self.evaluate(node[1]))
+        return self.clause_mask(node)
+
+    def mask(self, expression):
+        '''
+        returns: boolean array, True for the points matching the expression
+        '''
+        return np.unpackbits(self.evaluate(parse(expression)), count=self.num_points).astype(bool)
+
+    def select(self, expression):
+        '''
+        returns: ids of the points matching the expression
+        '''
+        return np.flatnonzero(self.mask(expression))
@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+
+from dataops import particletype
+from dataops.query import QueryEngine, QueryError, parse
+
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 10001  # not a multiple of 8, so the packed masks have padding bits
+        self.columns = {'rho': rng.random(n) * 1e11, 'hh': rng.random(n).astype(np.float32),
+                        particletype.TYPE_ARRAY: rng.integers(0, len(particletype.TYPE_CODES), n).astype(np.uint8)}
+        self.reads = []
+
+        def column(name):
+            self.reads.append(name)
+            return self.columns[name]
+
+        self.engine = QueryEngine(column, n)
+
+    def test_compound(self):
+        rho, hh, labels = self.columns['rho'], self.columns['hh'], self.columns[particletype.TYPE_ARRAY]
+        codes = [particletype.TYPE_CODES['gas'], particletype.TYPE_CODES['star']]
+        expected = (rho > 1e10) & np.isin(labels, codes) & (hh < 0.2)
+        np.testing.assert_array_equal(self.engine.mask('rho > 1e10 & type in (gas, star) & hh < 0.2'), expected)
+        np.testing.assert_array_equal(self.engine.mask('~(rho <= 1e10 | hh >= 0.2) & type not in (dm)'),
+                                      (rho > 1e10) & (hh < 0.2) & (labels != particletype.TYPE_CODES['dm']))
+        np.testing.assert_array_equal(self.engine.select('0.1 < hh <= 0.5'),
+                                      np.flatnonzero((hh > 0.1) & (hh <= 0.5)))
+
+    def test_clause_cache(self):
+        self.engine.mask('rho > 1e10 & hh < 0.2')
+        self.engine.mask('rho>10000000000 & hh < 0.3')
+        self.assertEqual(self.reads, ['rho', 'hh', 'hh'])
+
+    def test_errors(self):
+        for expression in ['', 'rho >', 'rho > 1 &', '(rho > 1', 'rho = 1', 'type in (quark)']:
+            with self.assertRaises(QueryError, msg=expression):
+                self.engine.mask(expression)
+        self.assertEqual(parse('`|v|` > 2'), ('cmp', '|v|', '>', 2.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
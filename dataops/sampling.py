@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+
+from dataops import snapshot
+
+SAMPLE_ARRAY = 'sample'
+KEY_RANGE = 1 << 32
+
+
+def splitmix64(values):
+    # Well-mixed 64 bit hash, so consecutive particle ids get unrelated keys
+    with np.errstate(over='ignore'):
+        z = np.asarray(values).astype(np.uint64) + np.uint64(0x9e3779b97f4a7c15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return z ^ (z >> np.uint64(31))
+
+
+def sample_keys(ids):
+    '''
+    Random but fixed uint32 key of every particle, derived from its id. Ordering particles by key is a random
+    permutation, so the particles with key below fraction * 2^32 are an unbiased sample of that fraction. Because
+    the key follows the particle id, the same particles are picked in every snapshot.
+    '''
+    return (splitmix64(ids) >> np.uint64(32)).astype(np.uint32)
+
+
+def key_threshold(fraction):
+    # Keys below this belong to the first `fraction` of the permutation
+    return np.uint64(min(max(fraction, 0.), 1.) * KEY_RANGE)
+
+
+def sample_mask(keys, fraction):
+    if fraction >= 1.:
+        return np.ones(len(keys), dtype=bool)
+    return keys < key_threshold(fraction)
+
+
+def prefix_fractions(first, factor=4.):
+    '''
+    returns: growing sample fractions from first up to 1, e.g. 0.01, 0.04, 0.16, 0.64, 1
+    '''
+    fractions = [first]
+    while fractions[-1] < 1.:
+        fractions.append(min(fractions[-1] * factor, 1.))
+    return fractions
+
+
+def load_keys(filename, ids):
+    '''
+    Sample keys of a cached snapshot, computed on first use and stored next to its columns
+    '''
+    path = snapshot.column_path(snapshot.cache_dir(filename), SAMPLE_ARRAY)
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='r')
+    keys = sample_keys(ids)
+    tmp = path + '.tmp.npy'
+    np.save(tmp, keys)
+    os.replace(tmp, path)
+    return keys
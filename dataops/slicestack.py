@@ -0,0 +1,121 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkFiltersCore import vtkProbeFilter
+from vtkmodules.vtkIOImage import vtkPNGWriter
+from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+
+import config
+from dataops.deposit import Deposit
+
+AXES = 'xyz'
+PLANE_AXES = {'x': (1, 2), 'y': (0, 2), 'z': (0, 1)}  # in-plane axes (columns, rows) as in interpolator.place_plane
+
+
+def slice_positions(num_slices, box=None):
+    # Slices are evenly spaced through the periodic box, the one at box would repeat the one at 0
+    box = config.CoordMax if box is None else box
+    return np.arange(num_slices) * box / num_slices
+
+
+def sweep(interpolator, axis, num_slices, path, resolution=None, png_dir=None, workers=None, array_name=None,
+          data=None):
+    '''
+    Interpolate num_slices scan planes along axis at slice_positions in one pass and store them as a float32 .npy
+    of shape (num_slices, resolution + 1, resolution + 1), rows along the second in-plane axis, each slice laid out
+    like the points of Interpolator.interpolate at that position. The stack is written through a memory map, so it
+    can be larger than memory to read back with np.load(path, mmap_mode='r').
+
+    In 'kernel' mode the particles are deposited once with the Gaussian kernel onto the grid of all slices, which
+    finds the particles around every slice point in one go and spreads the slices over the deposit's slabs. In
+    'grid' mode the deposited field is probed at all slice points, a block of slices per worker.
+
+    png_dir: also write every slice colored by config.Lut over [RangeMin, RangeMax] to slice_<i>.png there
+    array_name: array to sweep, the interpolator's by default
+    data: Interpolator.particle_data of array_name, take it on the thread that owns the polydata to sweep on another
+    returns: the memory-mapped stack
+    '''
+    if axis not in PLANE_AXES:
+        raise ValueError(f'Invalid axis {axis!r}, expected one of x, y, z')
+    resolution = config.CellRes if resolution is None else resolution
+    workers = workers or config.DepositWorkers or os.cpu_count() or 1
+    array_name = interpolator.array_name if array_name is None else array_name
+    data = interpolator.particle_data(array_name) if data is None else data
+    stack = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                      shape=(num_slices, resolution + 1, resolution + 1))
+    if interpolator.mode == 'grid':
+        probe_stack(interpolator, axis, resolution, stack, workers, array_name, data)
+    else:
+        deposit_stack(interpolator, axis, resolution, stack, workers, data)
+    stack.flush()
+    if png_dir is not None:
+        write_pngs(stack, png_dir, workers)
+    return stack
+
+
+def deposit_stack(interpolator, axis, resolution, stack, workers, data):
+    num_slices = len(stack)
+    columns, rows = PLANE_AXES[axis]
+    points, values, _ = data
+    # Slices become the z layers of the deposit, so its slabs are blocks of slices
+    engine = Deposit((resolution, resolution, num_slices), config.CoordMax, 'gaussian', workers,
+                     radius=interpolator.radius, sharpness=interpolator.sharpness)
+    total, norm = engine.deposit(points[:, [columns, rows, AXES.index(axis)]], [values, np.ones(len(points))])
+    field = np.divide(total, norm, out=np.zeros(engine.size), where=norm > 0)
+    # The plane's last row and column lie on the box edge, the periodic image of the first
+    stack[:] = np.pad(field.reshape(num_slices, resolution, resolution), ((0, 0), (0, 1), (0, 1)), mode='wrap')
+
+
+def probe_stack(interpolator, axis, resolution, stack, workers, array_name, data):
+    num_slices = len(stack)
+    a = AXES.index(axis)
+    columns, rows = PLANE_AXES[axis]
+    field = interpolator.deposit_field(array_name, data)
+    positions = slice_positions(num_slices)
+
+    def probe(block):
+        dimensions = [resolution + 1] * 3
+        dimensions[a] = len(block)
+        origin = [0., 0., 0.]
+        origin[a] = positions[block[0]]
+        spacing = [config.CoordMax / resolution] * 3
+        spacing[a] = config.CoordMax / num_slices
+        points = vtkImageData()
+        points.SetDimensions(dimensions)
+        points.SetOrigin(origin)
+        points.SetSpacing(spacing)
+        probe_filter = vtkProbeFilter()
+        probe_filter.SetSourceData(field)
+        probe_filter.SetInputData(points)
+        probe_filter.Update()
+        values = vtk_to_numpy(probe_filter.GetOutput().GetPointData().GetArray(array_name))
+        # x fastest, so the array axes are z, y, x
+        stack[block[0]:block[-1] + 1] = values.reshape(dimensions[::-1]).transpose(2 - a, 2 - rows, 2 - columns)
+
+    blocks = [block for block in np.array_split(np.arange(num_slices), workers) if len(block)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(probe, blocks))
+
+
+def write_pngs(stack, png_dir, workers):
+    os.makedirs(png_dir, exist_ok=True)
+    table = vtk_to_numpy(config.Lut.GetTable())  # RGBA per entry
+    low = np.min(stack) if config.RangeMin is None else config.RangeMin
+    high = np.max(stack) if config.RangeMax is None else config.RangeMax
+    digits = len(str(len(stack) - 1))
+
+    def write(i):
+        scaled = (np.asarray(stack[i], dtype=np.float64) - low) / (high - low) if high > low else np.zeros(stack[i].shape)
+        colors = table[np.clip((scaled * len(table)).astype(np.int64), 0, len(table) - 1)]
+        image = vtkImageData()
+        image.SetDimensions(stack.shape[2], stack.shape[1], 1)
+        image.GetPointData().SetScalars(numpy_to_vtk(colors.reshape(-1, colors.shape[-1]), deep=True))
+        writer = vtkPNGWriter()
+        writer.SetFileName(os.path.join(png_dir, f'slice_{i:0{digits}d}.png'))
+        writer.SetInputData(image)
+        writer.Write()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(write, range(len(stack))))
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+import config
+from dataops.interpolator import Interpolator
+from dataops.slicestack import sweep, slice_positions
+
+
+class TestSliceStack(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        points = vtkPoints()
+        points.SetData(numpy_to_vtk(rng.random((3000, 3)) * config.CoordMax, deep=True))
+        self.polydata = vtkPolyData()
+        self.polydata.SetPoints(points)
+        for name, values in (('phi', rng.random(3000)), ('hh', np.ones(3000))):
+            array = numpy_to_vtk(values, deep=True)
+            array.SetName(name)
+            self.polydata.GetPointData().AddArray(array)
+        self.range = config.RangeMin, config.RangeMax
+        config.RangeMin, config.RangeMax = 0., 1.
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        config.RangeMin, config.RangeMax = self.range
+        self.directory.cleanup()
+
+    def test_matches_single_planes(self):
+        for mode in ('kernel', 'grid'):
+            interpolator = Interpolator(self.polydata, mode=mode)
+            interpolator.array_name = 'phi'
+            for axis in 'xyz':
+                stack = sweep(interpolator, axis, 6, os.path.join(self.directory.name, f'{mode}{axis}.npy'), 12,
+                              workers=2)
+                self.assertEqual(stack.shape, (6, 13, 13))
+                for i in (0, 4):
+                    plane = interpolator.interpolate(axis, slice_positions(6)[i], 12)
+                    np.testing.assert_allclose(stack[i], vtk_to_numpy(plane.GetPointData().GetArray('phi'))
+                                               .reshape(13, 13), atol=1e-5, err_msg=f'{mode} {axis} {i}')
+
+    def test_slices_coarser_and_finer_than_plane(self):
+        # The deposit grid is anisotropic then, every axis needs its own stencil width
+        interpolator = Interpolator(self.polydata, mode='kernel')
+        interpolator.array_name = 'phi'
+        for num_slices in (2, 100):
+            stack = sweep(interpolator, 'y', num_slices, os.path.join(self.directory.name, f'{num_slices}.npy'), 32,
+                          workers=2)
+            for i in (0, num_slices - 1):
+                plane = interpolator.interpolate('y', slice_positions(num_slices)[i], 32)
+                np.testing.assert_allclose(stack[i], vtk_to_numpy(plane.GetPointData().GetArray('phi'))
+                                           .reshape(33, 33), atol=1e-5, err_msg=f'{num_slices} {i}')
+
+
+if __name__ == '__main__':
+    unittest.main()
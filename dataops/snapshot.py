@@ -0,0 +1,220 @@
+import json
+import os
+import shutil
+import xml.etree.ElementTree as ET
+import threading
+from collections import defaultdict
+from urllib.parse import quote
+
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+
+import config
+from dataops import particletype
+from dataops.vtpreader import VTPReader
+
+# Bump whenever the on-disk layout changes, so that stale caches get rebuilt
+CACHE_VERSION = 4
+CHUNK_LEVEL = 4  # particles of a type are stored ordered by their cell in a 2^4 per axis grid
+MANIFEST = 'manifest.json'
+POINTS = 'points'
+
+_build_locks = defaultdict(threading.Lock)  # one per snapshot, so different snapshots convert in parallel
+_build_locks_lock = threading.Lock()
+
+
+def cache_root(filename):
+    # All caches of a simulation run live in one directory next to the snapshots, unless config.CacheDir is set
+    if config.CacheDir:
+        return config.CacheDir
+    return os.path.join(os.path.dirname(os.path.abspath(filename)), '.zwickypixies')
+
+
+def cache_dir(filename):
+    # Columnar cache of one snapshot, e.g. .zwickypixies/Full.cosmo.624/
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_root(filename), name)
+
+
+def column_path(directory, name):
+    # Array names like '|v|' are percent-encoded, plain names are kept as they are
+    return os.path.join(directory, f'{quote(name, safe="")}.npy')
+
+
+def read_manifest(filename):
+    '''
+    Return the manifest of the columnar cache of a snapshot, or None if there is no cache or it is outdated
+    '''
+    path = os.path.join(cache_dir(filename), MANIFEST)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(filename)
+    if manifest.get('version') != CACHE_VERSION or manifest.get('source_size') != stat.st_size \
+            or manifest.get('source_mtime') != stat.st_mtime:
+        return None
+    return manifest
+
+
+def write_manifest(filename, manifest):
+    # Write to a temporary file first, so a crash never leaves a half-written manifest behind
+    path = os.path.join(cache_dir(filename), MANIFEST)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, path)
+
+
+def native_reader(filename):
+    # Numpy reader for the snapshot if config.ReaderBackend asks for it and it can handle the file, None otherwise
+    if config.ReaderBackend != 'native':
+        return None
+    try:
+        return VTPReader(filename)
+    except (ValueError, KeyError, ET.ParseError) as e:
+        print(f'Native reader cannot read {filename} ({e}), falling back to VTK')
+        return None
+
+
+def read_polydata(filename, arrays=None):
+    '''
+    Decode a .vtp snapshot with the reader selected by config.ReaderBackend
+
+    arrays: names of the point arrays to decode, None for all of them. The type label column is derived from mask.
+    '''
+    with_labels = arrays is None or particletype.TYPE_ARRAY in arrays
+    if arrays is not None and with_labels:
+        arrays = list(arrays) + ['mask']
+    reader = native_reader(filename)
+    if reader:
+        polydata = reader.read_polydata(arrays)
+    else:
+        reader = vtk.vtkXMLPolyDataReader()
+        reader.SetFileName(filename)
+        if arrays is not None:
+            reader.UpdateInformation()
+            for i in range(reader.GetNumberOfPointArrays()):
+                name = reader.GetPointArrayName(i)
+                reader.SetPointArrayStatus(name, int(name in arrays))
+        reader.Update()
+        polydata = reader.GetOutput()
+    if with_labels:
+        particletype.add_labels(polydata)
+    return polydata
+
+
+def read_vtp(filename):
+    '''
+    Decode all arrays of a .vtp snapshot
+
+    returns: (points, {array name: numpy array})
+    '''
+    reader = native_reader(filename)
+    if reader:
+        return reader.read()
+    polydata = read_polydata(filename)
+    points = vtk_to_numpy(polydata.GetPoints().GetData())
+    point_data = polydata.GetPointData()
+    columns = {}
+    for i in range(point_data.GetNumberOfArrays()):
+        columns[point_data.GetArrayName(i)] = vtk_to_numpy(point_data.GetArray(i))
+    return points, columns
+
+
+def build_cache(filename):
+    '''
+    Convert a .vtp snapshot into its columnar cache: one raw .npy per array plus a manifest.
+    Particles are stored grouped by type, so each type is a contiguous slice of every column. Within a type they
+    are ordered by spatial cell, so reading the particles of a region only touches the pages of its cells.
+
+    returns: the manifest of the new cache
+    '''
+    with _build_locks_lock:
+        lock = _build_locks[os.path.abspath(filename)]
+    with lock:
+        manifest = read_manifest(filename)
+        if manifest is not None:
+            return manifest  # another thread converted it while we were waiting
+        print(f'Converting {filename} to columnar cache...')
+        directory = cache_dir(filename)
+        shutil.rmtree(directory, ignore_errors=True)  # drop outdated columns and indices
+        os.makedirs(directory)
+        points, columns = read_vtp(filename)
+        labels = particletype.label_particles(columns['mask'])
+        from dataops.spatialindex import SpatialIndex  # imports this module
+        cells = SpatialIndex.point_codes(points, config.CoordMax, 1 << CHUNK_LEVEL)
+        order, offsets = particletype.sort_by_type(labels, cells)
+        columns[particletype.TYPE_ARRAY] = labels
+        np.save(column_path(directory, POINTS), points[order])
+        arrays = {}
+        for name, values in columns.items():
+            values = values[order]
+            np.save(column_path(directory, name), values)
+            arrays[name] = {'dtype': values.dtype.str, 'components': 1 if values.ndim == 1 else values.shape[1]}
+        stat = os.stat(filename)
+        manifest = {
+            'version': CACHE_VERSION,
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'num_points': len(points),
+            'type_offsets': [int(offset) for offset in offsets],
+            'arrays': arrays,
+        }
+        write_manifest(filename, manifest)
+        return manifest
+
+
+def load_column(filename, name):
+    # Copy-on-write mapping: pages are read lazily and never written back to the cache
+    return np.load(column_path(cache_dir(filename), name), mmap_mode='c')
+
+
+def warm(filename):
+    # Ask the OS to start paging in the cached columns of a snapshot in the background
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    directory = cache_dir(filename)
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.npy'):
+            fd = os.open(entry.path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+
+
+def to_vtk_array(values, name):
+    arr = numpy_to_vtk(values, deep=False)  # keeps a reference to the mapping
+    arr.SetName(name)
+    return arr
+
+
+def load_polydata(filename, arrays=None):
+    '''
+    Load a snapshot as vtkPolyData whose arrays are zero-copy views of the memory-mapped columnar cache.
+    The cache is built on first access.
+
+    arrays: names of the point arrays to load, None for all of them. More can be added later with add_arrays.
+    '''
+    manifest = read_manifest(filename) or build_cache(filename)
+    polydata = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_to_vtk(load_column(filename, POINTS), deep=False))
+    polydata.SetPoints(points)
+    particletype.set_offsets(polydata, manifest['type_offsets'])
+    add_arrays(polydata, filename, manifest['arrays'] if arrays is None else arrays, manifest)
+    return polydata
+
+
+def add_arrays(polydata, filename, arrays, manifest=None):
+    '''
+    Add cached columns of a snapshot to a polydata loaded by load_polydata, skipping the ones it already has
+    '''
+    manifest = manifest or read_manifest(filename) or build_cache(filename)
+    point_data = polydata.GetPointData()
+    for name in arrays:
+        if name in manifest['arrays'] and not point_data.HasArray(name):
+            point_data.AddArray(to_vtk_array(load_column(filename, name), name))
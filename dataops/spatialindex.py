@@ -0,0 +1,207 @@
+import json
+import os
+
+import numpy as np
+
+import config
+from dataops import snapshot
+
+POINTS_PER_CELL = 16  # target average occupancy when choosing the resolution
+MAX_LEVEL = 8  # at most 256^3 cells
+CHUNK_CANDIDATES = 1 << 18  # center-point pairs tested at once by query_radius_many, bounds the temporary arrays
+
+
+def part1by2(v):
+    # Spread the lower 10 bits of v so that there are two zero bits between each of them
+    v = v.astype(np.int64) & 0x3ff
+    v = (v | (v << 16)) & 0x30000ff
+    v = (v | (v << 8)) & 0x300f00f
+    v = (v | (v << 4)) & 0x30c30c3
+    v = (v | (v << 2)) & 0x9249249
+    return v
+
+
+def morton(ix, iy, iz):
+    # Z-order code of integer cell coordinates, cells that are close in space are close in code
+    return part1by2(ix) << 2 | part1by2(iy) << 1 | part1by2(iz)
+
+
+def periodic_delta(a, b, box):
+    # Minimum image difference between positions in a periodic box
+    d = np.asarray(a) - b
+    return d - box * np.round(d / box)
+
+
+class SpatialIndex:
+    '''
+    Cell-linked list over the periodic simulation box. The box is split into 2^level cells per axis, and point ids
+    are sorted by the Morton code of their cell, so that the points of a cell are one contiguous run of `order`
+    starting at cell_start[code]. Queries gather the runs of the cells they overlap and then test exact
+    distances with the minimum image convention.
+    '''
+
+    def __init__(self, points, order, cell_start, box):
+        self.points = points
+        self.order = order
+        self.cell_start = cell_start  # len 8^level + 1
+        self.box = float(box)
+        self.resolution = int(round((len(cell_start) - 1) ** (1 / 3)))
+        self.cell_size = self.box / self.resolution
+
+    @staticmethod
+    def choose_level(num_points):
+        cells = max(num_points / POINTS_PER_CELL, 1)
+        return int(np.clip(np.round(np.log2(cells) / 3), 0, MAX_LEVEL))
+
+    @classmethod
+    def build(cls, points, box=None, level=None):
+        box = config.CoordMax if box is None else box
+        level = cls.choose_level(len(points)) if level is None else level
+        resolution = 1 << level
+        codes = cls.point_codes(points, box, resolution)
+        order = np.argsort(codes, kind='stable')
+        cell_start = np.zeros(resolution ** 3 + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=resolution ** 3), out=cell_start[1:])
+        return cls(points, order, cell_start, box)
+
+    @staticmethod
+    def point_codes(points, box, resolution):
+        cells = np.floor(np.asarray(points) / box * resolution).astype(np.int64) % resolution
+        return morton(cells[:, 0], cells[:, 1], cells[:, 2])
+
+    def cell_range(self, lo, hi):
+        # Cell coordinates along one axis overlapping [lo, hi], wrapped around the box
+        first, last = int(np.floor(lo / self.cell_size)), int(np.floor(hi / self.cell_size))
+        if last - first + 1 >= self.resolution:
+            return np.arange(self.resolution)
+        return np.unique(np.arange(first, last + 1) % self.resolution)
+
+    def gather(self, lo, hi):
+        # Ids of the points in all cells overlapping the box [lo, hi]
+        ranges = [self.cell_range(lo[axis], hi[axis]) for axis in range(3)]
+        ix, iy, iz = (c.ravel() for c in np.meshgrid(*ranges, indexing='ij'))
+        codes = np.sort(morton(ix, iy, iz))
+        starts = self.cell_start[codes]
+        return self.runs(starts, self.cell_start[codes + 1] - starts)
+
+    def runs(self, starts, lengths):
+        # Concatenate order[start:start + length] of every cell without a Python loop
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=self.order.dtype)
+        positions = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) + np.arange(total)
+        return self.order[positions]
+
+    def query_box(self, lo, hi):
+        '''
+        returns: sorted ids of the points with lo <= position <= hi, where a box reaching past the domain wraps
+        '''
+        lo, hi = np.asarray(lo, dtype=np.float64), np.asarray(hi, dtype=np.float64)
+        ids = self.gather(lo, hi)
+        offset = (self.points[ids] - lo) % self.box
+        return np.sort(ids[np.all(offset <= hi - lo, axis=1)])
+
+    def query_radius(self, center, radius, return_distance=False):
+        '''
+        returns: ids of the points within radius of center, sorted by distance, and optionally the distances
+        '''
+        center = np.asarray(center, dtype=np.float64)
+        ids = self.gather(center - radius, center + radius)
+        dist = np.linalg.norm(periodic_delta(self.points[ids], center, self.box), axis=1)
+        inside = dist <= radius
+        ids, dist = ids[inside], dist[inside]
+        order = np.argsort(dist, kind='stable')
+        return (ids[order], dist[order]) if return_distance else ids[order]
+
+    def query_radius_many(self, centers, radius):
+        '''
+        Radius query for many centers at once. The cells around every center are looked up together, and the
+        candidate points are tested in chunks of centers of about CHUNK_CANDIDATES pairs.
+
+        returns: (indptr, ids, distances) in CSR layout, the neighbours of centers[i] are ids[indptr[i]:indptr[i + 1]]
+        '''
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        n = len(centers)
+        # Cells per axis that an interval of length 2 * radius can overlap, all of them when that covers the box
+        width = int(np.ceil(2 * radius / self.cell_size)) + 1
+        wrap = width >= self.resolution
+        if wrap:
+            width = self.resolution
+            first = np.zeros((n, 3), dtype=np.int64)
+        else:
+            first = np.floor((centers - radius) / self.cell_size).astype(np.int64)
+        cells = first[:, :, None] + np.arange(width)  # (centers, axis, width) before wrapping
+        wrapped = cells % self.resolution
+        codes = morton(wrapped[:, 0, :, None, None], wrapped[:, 1, None, :, None],
+                       wrapped[:, 2, None, None, :]).reshape(n, -1)
+        starts = self.cell_start[codes]
+        lengths = self.cell_start[codes + 1] - starts
+        if not wrap:
+            # Skip the corner cells of the cube that the sphere does not reach
+            gap = np.maximum(np.maximum(cells * self.cell_size - centers[:, :, None],
+                                        centers[:, :, None] - (cells + 1) * self.cell_size), 0.) ** 2
+            reach = gap[:, 0, :, None, None] + gap[:, 1, None, :, None] + gap[:, 2, None, None, :]
+            lengths[reach.reshape(n, -1) > radius ** 2] = 0
+        candidates = lengths.sum(axis=1)
+        # Split the centers where the running number of candidates passes a multiple of the chunk size
+        bounds = np.unique(np.r_[0, np.searchsorted(np.cumsum(candidates), np.arange(
+            CHUNK_CANDIDATES, int(candidates.sum()), CHUNK_CANDIDATES)), n])
+        counts = np.zeros(n, dtype=np.int64)
+        all_ids, all_dist = [np.empty(0, dtype=np.int64)], [np.empty(0)]
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            ids = self.runs(starts[a:b].ravel(), lengths[a:b].ravel())
+            owner = np.repeat(np.arange(a, b), candidates[a:b])
+            delta = periodic_delta(self.points[ids], centers[owner], self.box)
+            dist2 = np.einsum('ij,ij->i', delta, delta)
+            inside = dist2 <= radius ** 2
+            counts[a:b] = np.bincount(owner[inside] - a, minlength=b - a)
+            all_ids.append(ids[inside])
+            all_dist.append(np.sqrt(dist2[inside]))
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return indptr, np.concatenate(all_ids), np.concatenate(all_dist)
+
+    def query_knn(self, center, k):
+        '''
+        returns: (ids, distances) of the k nearest points to center, nearest first
+        '''
+        k = min(k, len(self.points))
+        radius = self.cell_size
+        max_radius = self.box * np.sqrt(3) / 2
+        while True:
+            ids, dist = self.query_radius(center, radius, return_distance=True)
+            # Every point within radius is found, so once k of them are, they are the k nearest
+            if len(ids) >= k or radius >= max_radius:
+                return ids[:k], dist[:k]
+            radius *= 2
+
+
+def index_paths(filename):
+    directory = snapshot.cache_dir(filename)
+    return (snapshot.column_path(directory, 'spatial.order'), snapshot.column_path(directory, 'spatial.cells'),
+            os.path.join(directory, 'spatial.json'))
+
+
+def load_spatial_index(filename, points):
+    '''
+    Spatial index of a cached snapshot. It is built on first use and stored next to the columns; a stored index
+    built for a different box size is rebuilt.
+    '''
+    order_path, cells_path, meta_path = index_paths(filename)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['box'] == config.CoordMax:
+            return SpatialIndex(points, np.load(order_path, mmap_mode='r'), np.load(cells_path, mmap_mode='r'),
+                                meta['box'])
+    except (OSError, ValueError, KeyError):
+        pass
+    index = SpatialIndex.build(points, config.CoordMax)
+    for path, data in ((order_path, index.order), (cells_path, index.cell_start)):
+        tmp = path + '.tmp.npy'
+        np.save(tmp, data)
+        os.replace(tmp, path)
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump({'box': index.box, 'resolution': index.resolution}, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return index
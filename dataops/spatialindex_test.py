@@ -0,0 +1,48 @@
+import unittest
+
+import numpy as np
+
+from dataops.spatialindex import SpatialIndex, periodic_delta
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.box = 64.
+        self.points = (rng.random((20000, 3)) * self.box).astype(np.float32)
+        self.index = SpatialIndex.build(self.points, self.box)
+
+    def distances(self, center):
+        return np.linalg.norm(periodic_delta(self.points, center, self.box), axis=1)
+
+    def test_radius(self):
+        # Centers near the faces and corners check the periodic wrap
+        for center in [(32., 32., 32.), (0.5, 63.8, 10.), (0., 0., 0.)]:
+            for radius in [0.5, 3., 40.]:
+                expected = np.flatnonzero(self.distances(center) <= radius)
+                np.testing.assert_array_equal(np.sort(self.index.query_radius(center, radius)), expected)
+
+    def test_radius_many(self):
+        # A radius beyond half the box visits every cell, the one at the box edge wraps like 0
+        centers = np.array([(1., 2., 3.), (63., 63., 0.5), (64., 32., 64.)])
+        for radius in [0.5, 2.5, 40.]:
+            indptr, ids, dist = self.index.query_radius_many(centers, radius)
+            for i, center in enumerate(centers):
+                np.testing.assert_array_equal(np.sort(ids[indptr[i]:indptr[i + 1]]),
+                                              np.flatnonzero(self.distances(center) <= radius))
+            self.assertTrue(np.all(dist <= radius))
+
+    def test_box(self):
+        lo, hi = np.array([60., 10., -2.]), np.array([70., 20., 3.])  # wraps in x and z
+        offset = (self.points - lo) % self.box
+        expected = np.flatnonzero(np.all(offset <= hi - lo, axis=1))
+        np.testing.assert_array_equal(self.index.query_box(lo, hi), expected)
+
+    def test_knn(self):
+        center = (63.9, 0.1, 31.)
+        ids, dist = self.index.query_knn(center, 10)
+        np.testing.assert_allclose(dist, np.sort(self.distances(center))[:10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+
+import config
+from dataops import snapshot, derived
+
+STATISTICS = 'statistics.v2.npz'  # v2: quantiles are values of points, see ArrayStatistics.compute
+QUANTILES = np.linspace(0., 1., 1001)  # quantile table in steps of 0.1 percent
+HISTOGRAM_BINS = 256
+
+
+class ArrayStatistics:
+    '''
+    Summary of one array of a snapshot: quantile table plus fixed-bin histograms on a linear and a log scale.
+    Enough to suggest thresholds and estimate how many points they keep without touching the array again.
+    '''
+
+    def __init__(self, num_points, quantiles, hist, edges, log_hist, log_edges):
+        self.num_points = int(num_points)
+        self.quantiles = quantiles  # value at each of QUANTILES
+        self.hist = hist
+        self.edges = edges
+        self.log_hist = log_hist  # positive values only, empty if there are none
+        self.log_edges = log_edges
+
+    @classmethod
+    def compute(cls, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            empty = np.empty(0)
+            return cls(0, np.zeros(len(QUANTILES)), empty, empty, empty, empty)
+        # Values of the points themselves rather than midpoints, so that a value shared by many points keeps its share
+        quantiles = np.quantile(values, QUANTILES, method='inverted_cdf')
+        hist, edges = np.histogram(values, bins=HISTOGRAM_BINS, range=(quantiles[0], quantiles[-1]))
+        positive = values[values > 0]
+        if len(positive):
+            lo, hi = np.log10(positive.min()), np.log10(positive.max())
+            log_edges = np.logspace(lo, hi if hi > lo else lo + 1, HISTOGRAM_BINS + 1)
+            log_edges[0] = positive.min()  # 10 ** log10(x) is not always x, keep the extremes inside
+            log_edges[-1] = max(positive.max(), log_edges[-1])
+            log_hist, log_edges = np.histogram(positive, bins=log_edges)
+        else:
+            log_hist, log_edges = np.empty(0, dtype=np.int64), np.empty(0)
+        return cls(len(values), quantiles, hist, edges, log_hist, log_edges)
+
+    def range(self):
+        return float(self.quantiles[0]), float(self.quantiles[-1])
+
+    def percentile(self, p):
+        # Value below which p percent of the points lie, interpolated in the quantile table
+        return float(np.interp(p / 100., QUANTILES, self.quantiles))
+
+    def below(self, value, inclusive=False):
+        # Estimated fraction of the points below value, or at most value, interpolated within the bracket of the
+        # quantile table around it. Searching from the matching side keeps ties, e.g. half the points being 0, intact.
+        i = int(np.searchsorted(self.quantiles, value, side='right' if inclusive else 'left'))
+        if i == 0:
+            return 0.
+        if i == len(self.quantiles):
+            return 1.
+        lo, hi = self.quantiles[i - 1], self.quantiles[i]
+        t = (value - lo) / (hi - lo) if hi > lo else 0.
+        return float(QUANTILES[i - 1] + t * (QUANTILES[i] - QUANTILES[i - 1]))
+
+    def fraction(self, lo, hi):
+        # Estimated fraction of the points with lo <= value <= hi
+        if self.num_points == 0 or hi < lo:
+            return 0.
+        return max(self.below(hi, inclusive=True) - self.below(lo), 0.)
+
+    def count(self, lo, hi):
+        return int(round(self.fraction(lo, hi) * self.num_points))
+
+    def histogram(self, log=False):
+        return (self.log_hist, self.log_edges) if log else (self.hist, self.edges)
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}/num_points': np.asarray(self.num_points), f'{prefix}/quantiles': self.quantiles,
+                f'{prefix}/hist': self.hist, f'{prefix}/edges': self.edges,
+                f'{prefix}/log_hist': self.log_hist, f'{prefix}/log_edges': self.log_edges}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(arrays[f'{prefix}/num_points'], arrays[f'{prefix}/quantiles'], arrays[f'{prefix}/hist'],
+                   arrays[f'{prefix}/edges'], arrays[f'{prefix}/log_hist'], arrays[f'{prefix}/log_edges'])
+
+
+def compute_statistics(columns):
+    '''
+    returns: {array name: ArrayStatistics} for the scalar arrays among the given numpy columns
+    '''
+    return {name: ArrayStatistics.compute(values) for name, values in columns.items() if values.ndim == 1}
+
+
+def statistics_path(filename):
+    return os.path.join(snapshot.cache_dir(filename), STATISTICS)
+
+
+def save_statistics(filename, statistics):
+    # Statistics of other arrays stored before are kept
+    path = statistics_path(filename)
+    arrays = {}
+    if os.path.exists(path):
+        with np.load(path) as stored:
+            arrays.update(stored)
+    for name, stats in statistics.items():
+        arrays.update(stats.to_arrays(name))
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def load_statistics(filename, name):
+    '''
+    Statistics of one array of a cached snapshot, None if the snapshot has no such scalar array. They are computed
+    from the columnar cache on first use and stored next to it, which also drops them whenever the cache is rebuilt.
+    '''
+    manifest = snapshot.read_manifest(filename) or snapshot.build_cache(filename)
+    if name not in manifest['arrays'] and not (derived.is_derived(name) and
+                                               all(key in manifest['arrays'] for key in derived.FIELDS[name].inputs)):
+        return None
+    path = statistics_path(filename)
+    if os.path.exists(path):
+        with np.load(path) as arrays:
+            if f'{name}/quantiles' in arrays:
+                return ArrayStatistics.from_arrays(arrays, name)
+    column = lambda key: snapshot.load_column(filename, key)
+    values = derived.load_column(filename, name, column, cached=True) if derived.is_derived(name) else column(name)
+    statistics = compute_statistics({name: values})
+    if statistics:
+        save_statistics(filename, statistics)
+    return statistics.get(name)
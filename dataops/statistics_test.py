@@ -0,0 +1,25 @@
+import unittest
+
+import numpy as np
+
+from dataops.statistics import ArrayStatistics
+
+
+class TestArrayStatistics(unittest.TestCase):
+    def test_ties(self):
+        # Half of the points are 0, as for uu of the dark matter
+        values = np.concatenate([np.zeros(500000), np.random.default_rng(0).random(500000) + 1.])
+        stats = ArrayStatistics.compute(values)
+        self.assertEqual(stats.count(0., 0.), 500000)
+        self.assertEqual(stats.count(0., 2.), 1000000)
+        self.assertAlmostEqual(stats.count(1., 1.5), 250000, delta=2000)
+
+    def test_constant(self):
+        stats = ArrayStatistics.compute(np.full(1000, 3.))
+        self.assertEqual(stats.count(3., 3.), 1000)
+        self.assertEqual(stats.count(0., 2.), 0)
+        self.assertEqual(stats.count(4., 5.), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
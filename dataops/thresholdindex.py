@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+from dataops import snapshot
+
+
+class ThresholdIndex:
+    '''
+    Sorted index of one array of a snapshot. Within every type segment (see particletype.sort_by_type), point ids
+    are ordered by value, so selecting lo <= value <= hi is two binary searches per type plus a slice: O(log n + k).
+    '''
+
+    def __init__(self, order, sorted_values, offsets):
+        self.order = order  # point ids, sorted by value within each segment
+        self.sorted_values = sorted_values  # values[order]
+        self.offsets = offsets  # segment boundaries, one segment per type
+
+    @classmethod
+    def build(cls, values, offsets=None):
+        offsets = np.asarray([0, len(values)] if offsets is None else offsets)
+        order = np.empty(len(values), dtype=np.int64)
+        for a, b in zip(offsets[:-1], offsets[1:]):
+            order[a:b] = a + np.argsort(values[a:b], kind='stable')
+        return cls(order, values[order], offsets)
+
+    def ranges(self, lo, hi):
+        # [start, end) of the selected part of the order array, per segment
+        for a, b in zip(self.offsets[:-1], self.offsets[1:]):
+            segment = self.sorted_values[a:b]
+            yield a + np.searchsorted(segment, lo, side='left'), a + np.searchsorted(segment, hi, side='right')
+
+    def select(self, lo, hi):
+        '''
+        returns: list with the ids of the points with lo <= value <= hi, one array per segment
+        '''
+        return [self.order[start:end] for start, end in self.ranges(lo, hi)]
+
+    def count(self, lo, hi):
+        return sum(int(end - start) for start, end in self.ranges(lo, hi))
+
+
+def index_paths(filename, array_name):
+    directory = snapshot.cache_dir(filename)
+    return snapshot.column_path(directory, f'{array_name}.order'), snapshot.column_path(directory, f'{array_name}.sorted')
+
+
+def load_index(filename, array_name, values, offsets=None):
+    '''
+    Threshold index of an array of a cached snapshot. It is built on first use and stored next to the columns,
+    so later sessions only map it from disk.
+    '''
+    order_path, sorted_path = index_paths(filename, array_name)
+    if os.path.exists(order_path) and os.path.exists(sorted_path):
+        return ThresholdIndex(np.load(order_path, mmap_mode='r'), np.load(sorted_path, mmap_mode='r'),
+                              np.asarray([0, len(values)] if offsets is None else offsets))
+    index = ThresholdIndex.build(values, offsets)
+    for path, data in ((order_path, index.order), (sorted_path, index.sorted_values)):
+        tmp = path + '.tmp.npy'
+        np.save(tmp, data)
+        os.replace(tmp, path)
+    return index
@@ -0,0 +1,138 @@
+import lzma
+import mmap
+import os
+import re
+import zlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import numpy_to_vtk
+
+# VTK XML type names -> numpy dtypes
+DTYPES = {
+    'Int8': 'i1', 'UInt8': 'u1', 'Int16': 'i2', 'UInt16': 'u2', 'Int32': 'i4', 'UInt32': 'u4',
+    'Int64': 'i8', 'UInt64': 'u8', 'Float32': 'f4', 'Float64': 'f8',
+}
+# VTK XML type names -> VTK array types, matching what vtkXMLPolyDataReader creates
+VTK_TYPES = {
+    'Int8': vtk.VTK_SIGNED_CHAR, 'UInt8': vtk.VTK_UNSIGNED_CHAR, 'Int16': vtk.VTK_SHORT,
+    'UInt16': vtk.VTK_UNSIGNED_SHORT, 'Int32': vtk.VTK_INT, 'UInt32': vtk.VTK_UNSIGNED_INT,
+    'Int64': vtk.VTK_LONG_LONG, 'UInt64': vtk.VTK_UNSIGNED_LONG_LONG, 'Float32': vtk.VTK_FLOAT,
+    'Float64': vtk.VTK_DOUBLE,
+}
+DECOMPRESSORS = {
+    'vtkZLibDataCompressor': zlib.decompress,
+    'vtkLZMADataCompressor': lzma.decompress,
+}
+APPENDED_PATTERN = re.compile(rb'<AppendedData\s+encoding="raw"\s*>\s*_')
+
+
+class VTPReader:
+    '''
+    Reader for VTK XML PolyData files with raw appended data, which is how the snapshots are written.
+    The XML header is parsed once and every DataArray is mapped straight from its byte range with numpy:
+    uncompressed arrays are memory-mapped without copying, compressed ones are decompressed block by block.
+
+    Raises ValueError for layouts it does not handle (inline/base64/ascii data, unknown compressors), so callers
+    can fall back to vtkXMLPolyDataReader.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        match = APPENDED_PATTERN.search(self.mm)
+        if not match:
+            raise ValueError(f'{filename}: no raw appended data section')
+        self.data_start = match.end()
+        header = self.mm[:match.start()].decode('utf-8') + '</VTKFile>'
+        root = ET.fromstring(header)
+        if root.get('type') != 'PolyData':
+            raise ValueError(f'{filename}: not a PolyData file')
+        self.byte_order = '<' if root.get('byte_order', 'LittleEndian') == 'LittleEndian' else '>'
+        self.header_dtype = np.dtype(self.byte_order + DTYPES[root.get('header_type', 'UInt32')])
+        compressor = root.get('compressor')
+        if compressor and compressor not in DECOMPRESSORS:
+            raise ValueError(f'{filename}: unsupported compressor {compressor}')
+        self.decompress = DECOMPRESSORS.get(compressor)
+
+        piece = root.find('PolyData/Piece')
+        self.num_points = int(piece.get('NumberOfPoints'))
+        self.num_verts = int(piece.get('NumberOfVerts', 0))
+        self.points = piece.find('Points/DataArray')
+        self.point_arrays = {e.get('Name'): e for e in piece.findall('PointData/DataArray')}
+        self.verts = {e.get('Name'): e for e in piece.findall('Verts/DataArray')}
+
+    def array_names(self):
+        return list(self.point_arrays)
+
+    def read_array(self, element):
+        if element.get('format') != 'appended':
+            raise ValueError(f'{self.filename}: only appended DataArrays are supported')
+        dtype = np.dtype(self.byte_order + DTYPES[element.get('type')])
+        components = int(element.get('NumberOfComponents', 1))
+        pos = self.data_start + int(element.get('offset'))
+        if self.decompress is None:
+            nbytes = int(np.frombuffer(self.mm, self.header_dtype, 1, pos)[0])
+            values = np.memmap(self.filename, dtype, mode='c', offset=pos + self.header_dtype.itemsize,
+                               shape=(nbytes // dtype.itemsize,))
+            if not values.flags.aligned:
+                values = np.array(values)
+        else:
+            values = np.frombuffer(self.read_compressed(pos), dtype)
+        if not dtype.isnative:
+            values = values.astype(dtype.newbyteorder('='))
+        return values.reshape(-1, components) if components > 1 else values
+
+    def read_compressed(self, pos):
+        # Header: number of blocks, uncompressed block size, size of the last block, compressed size of each block
+        hsize = self.header_dtype.itemsize
+        num_blocks, block_size, last_size = (int(v) for v in np.frombuffer(self.mm, self.header_dtype, 3, pos))
+        sizes = np.frombuffer(self.mm, self.header_dtype, num_blocks, pos + 3 * hsize).astype(np.int64)
+        out = bytearray(block_size * (num_blocks - 1) + (last_size or block_size) if num_blocks else 0)
+        starts = pos + (3 + num_blocks) * hsize + np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+        def decompress_block(i):
+            # zlib/lzma release the GIL, so blocks are decompressed in parallel
+            start = int(starts[i])
+            out[i * block_size:(i + 1) * block_size] = self.decompress(self.mm[start:start + int(sizes[i])])
+
+        with ThreadPoolExecutor(max_workers=min(num_blocks, os.cpu_count() or 1) or 1) as executor:
+            list(executor.map(decompress_block, range(num_blocks)))
+        return out
+
+    def read_points(self):
+        return self.read_array(self.points)
+
+    def read(self, arrays=None):
+        '''
+        returns: (points, {array name: numpy array}) for the given array names, or all of them if None
+        '''
+        names = self.array_names() if arrays is None else [name for name in arrays if name in self.point_arrays]
+        return self.read_points(), {name: self.read_array(self.point_arrays[name]) for name in names}
+
+    def read_polydata(self, arrays=None):
+        '''
+        Same vtkPolyData as vtkXMLPolyDataReader, with arrays wrapping the decoded numpy data without a copy
+        '''
+        points, columns = self.read(arrays)
+        polydata = vtk.vtkPolyData()
+        vtk_points = vtk.vtkPoints()
+        vtk_points.SetData(numpy_to_vtk(points, deep=False, array_type=VTK_TYPES[self.points.get('type')]))
+        polydata.SetPoints(vtk_points)
+        for name, values in columns.items():
+            arr = numpy_to_vtk(values, deep=False, array_type=VTK_TYPES[self.point_arrays[name].get('type')])
+            arr.SetName(name)
+            polydata.GetPointData().AddArray(arr)
+        if self.num_verts:
+            offsets = np.concatenate([[0], self.read_array(self.verts['offsets'])]).astype(np.int64)
+            connectivity = np.ascontiguousarray(self.read_array(self.verts['connectivity']), dtype=np.int64)
+            cells = vtk.vtkCellArray()
+            cells.SetData(numpy_to_vtk(offsets, deep=True), numpy_to_vtk(connectivity, deep=True))
+            polydata.SetVerts(cells)
+        return polydata
+
+    def close(self):
+        self.mm.close()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+
+from dataops.vtpreader import VTPReader
+
+
+def write_snapshot(filename, compress, n=5000):
+    rng = np.random.default_rng(0)
+    polydata = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_to_vtk(rng.random((n, 3)).astype(np.float32) * 64, deep=True))
+    polydata.SetPoints(points)
+    columns = {'mask': rng.integers(0, 512, n).astype(np.int16), 'id': np.arange(n, dtype=np.int64),
+               'rho': rng.random(n).astype(np.float32), 'phi': rng.random(n)}
+    for name, values in columns.items():
+        arr = numpy_to_vtk(values, deep=True)
+        arr.SetName(name)
+        polydata.GetPointData().AddArray(arr)
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(filename)
+    writer.SetInputData(polydata)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    if not compress:
+        writer.SetCompressorTypeToNone()
+    writer.Write()
+
+
+class TestVTPReader(unittest.TestCase):
+    def check_same_as_vtk(self, compress):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'Full.cosmo.000.vtp')
+            write_snapshot(filename, compress)
+            reader = vtk.vtkXMLPolyDataReader()
+            reader.SetFileName(filename)
+            reader.Update()
+            expected = reader.GetOutput()
+            actual = VTPReader(filename).read_polydata()
+            self.assertEqual(expected.GetNumberOfPoints(), actual.GetNumberOfPoints())
+            np.testing.assert_array_equal(vtk_to_numpy(expected.GetPoints().GetData()),
+                                          vtk_to_numpy(actual.GetPoints().GetData()))
+            for name in ['mask', 'id', 'rho', 'phi']:
+                a = expected.GetPointData().GetArray(name)
+                b = actual.GetPointData().GetArray(name)
+                self.assertEqual(a.GetDataType(), b.GetDataType())
+                np.testing.assert_array_equal(vtk_to_numpy(a), vtk_to_numpy(b))
+
+    def test_uncompressed(self):
+        self.check_same_as_vtk(compress=False)
+
+    def test_zlib(self):
+        self.check_same_as_vtk(compress=True)
+
+    def test_array_selection(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'Full.cosmo.000.vtp')
+            write_snapshot(filename, compress=False)
+            _, columns = VTPReader(filename).read(['rho', 'missing'])
+            self.assertEqual(list(columns), ['rho'])
+
+
+if __name__ == '__main__':
+    unittest.main()
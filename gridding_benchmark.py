@@ -0,0 +1,71 @@
+import argparse
+import time
+
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import vtk_to_numpy
+
+from dataops import gridding
+from dataops.filters import extract_points
+from dataops.vtpreader import VTPReader
+
+
+def grid_loop(polydata, array_name, bounds, resolution):
+    # The former Volume View implementation: one FindPoint per particle, averaged per grid point
+    grid = vtk.vtkImageData()
+    grid.SetDimensions(resolution)
+    grid.SetOrigin(bounds[0], bounds[2], bounds[4])
+    grid.SetSpacing(*((bounds[2 * i + 1] - bounds[2 * i]) / (resolution[i] - 1) for i in range(3)))
+    total = np.zeros(grid.GetNumberOfPoints())
+    count = np.zeros(grid.GetNumberOfPoints())
+    values = polydata.GetPointData().GetArray(array_name)
+    for i in range(polydata.GetNumberOfPoints()):
+        grid_point_id = grid.FindPoint(polydata.GetPoint(i))
+        if grid_point_id >= 0:
+            total[grid_point_id] += values.GetValue(i)
+            count[grid_point_id] += 1
+    return np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+
+
+def grid_vectorized(polydata, array_name, bounds, resolution):
+    grid = gridding.grid_polydata(polydata, array_name, bounds, resolution, 'mean')
+    return vtk_to_numpy(grid.GetPointData().GetScalars())
+
+
+def timeit(func, polydata, array_name, bounds, resolution, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(polydata, array_name, bounds, resolution)
+        times.append(time.perf_counter() - start)
+    return min(times), np.mean(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the per-particle Volume View gridding loop with np.bincount.')
+    parser.add_argument('filename', help='path to Full.cosmo.xxx.vtp')
+    parser.add_argument('--array', default='rho')
+    parser.add_argument('--resolution', type=int, default=100, help='grid points per axis')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-points', type=int, default=None,
+                        help='only grid the first particles, the loop takes minutes on a full snapshot')
+    args = parser.parse_args()
+
+    polydata = VTPReader(args.filename).read_polydata()
+    if args.max_points is not None and args.max_points < polydata.GetNumberOfPoints():
+        polydata = extract_points(polydata, np.arange(args.max_points))
+    bounds = polydata.GetBounds()
+    resolution = (args.resolution,) * 3
+    print(f'{polydata.GetNumberOfPoints()} particles onto {args.resolution}^3 grid points')
+
+    results = []
+    for name, func in (('loop', grid_loop), ('bincount', grid_vectorized)):
+        best, mean, result = timeit(func, polydata, args.array, bounds, resolution, args.repeat)
+        results.append(result)
+        print(f'{name:8} best {best * 1000:9.1f} ms   mean {mean * 1000:9.1f} ms')
+    assert np.allclose(results[0], results[1], rtol=1e-5, atol=1e-6 * np.abs(results[0]).max())
+    print('Grids are identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import time
+
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import vtk_to_numpy
+
+from dataops.vtpreader import VTPReader
+
+
+def read_vtk(filename):
+    reader = vtk.vtkXMLPolyDataReader()
+    reader.SetFileName(filename)
+    reader.Update()
+    return reader.GetOutput()
+
+
+def read_native(filename):
+    return VTPReader(filename).read_polydata()
+
+
+def touch(polydata):
+    # Make sure lazily mapped pages are actually read, otherwise the native reader gets timed for free
+    total = float(vtk_to_numpy(polydata.GetPoints().GetData()).sum())
+    for i in range(polydata.GetPointData().GetNumberOfArrays()):
+        total += float(vtk_to_numpy(polydata.GetPointData().GetArray(i)).sum())
+    return total
+
+
+def timeit(func, filename, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        touch(func(filename))
+        times.append(time.perf_counter() - start)
+    return min(times), np.mean(times)
+
+
+def check_equal(filename):
+    expected = read_vtk(filename)
+    actual = read_native(filename)
+    assert np.array_equal(vtk_to_numpy(expected.GetPoints().GetData()), vtk_to_numpy(actual.GetPoints().GetData()))
+    for i in range(expected.GetPointData().GetNumberOfArrays()):
+        name = expected.GetPointData().GetArrayName(i)
+        assert np.array_equal(vtk_to_numpy(expected.GetPointData().GetArray(name)),
+                              vtk_to_numpy(actual.GetPointData().GetArray(name))), name
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare vtkXMLPolyDataReader with the numpy VTP reader.')
+    parser.add_argument('filename', help='path to Full.cosmo.xxx.vtp')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    check_equal(args.filename)
+    print('Outputs are identical')
+    for name, func in (('vtk', read_vtk), ('native', read_native)):
+        best, mean = timeit(func, args.filename, args.repeat)
+        print(f'{name:8} best {best * 1000:9.1f} ms   mean {mean * 1000:9.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
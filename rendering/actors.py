@@ -1,41 +1,325 @@
 from vtkmodules.vtkRenderingCore import vtkPointGaussianMapper
-from rendering.viewactors.dataviewactors import create_data_view_actors
+from rendering.viewactors.dataviewactors import (create_data_view_actors, update_data_view_actors,
+                                                 select_data_view_points)
 import rendering.core as core
 import config
 import vtk
-from rendering.viewactors.typeexploreractors import create_type_explorer_actors
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+from dataops.filters import extract_points
+from dataops import snapshot, particletype, statistics, derived, gridding
+from dataops.catalog import Catalog
+from dataops.thresholdindex import ThresholdIndex, load_index
+from dataops.query import QueryEngine
+from dataops.spatialindex import SpatialIndex, load_spatial_index
+from dataops.lod import snapshot_levels
+from dataops.sampling import sample_keys, load_keys, key_threshold
+from dataops.prefetch import SnapshotCache, Prefetcher
+from dataops.gridcache import GridCache
+from rendering.viewactors.typeexploreractors import (create_type_explorer_actors, update_type_explorer_actors,
+                                                     select_type_explorer_points)
 from rendering.viewactors.volumeviewactors import create_volume_view_actors
+from rendering.lod import LODController
 
 
 class Actors:
 
     def __init__(self, parent):
-        from rendering.window import Window
-        self.parent: Window = parent
+        self.parent = parent  # rendering.window.Window, not imported so that Actors works without Qt
         self.property_map = core.create_property_map()
         self.actors = {}
         self.mapper = vtkPointGaussianMapper()
-        self.polydata = None
-        self.polycopy = None
+        self.polydata = None  # working set: the snapshot, or its particles inside config.ROI
+        self.polycopy = None  # the whole snapshot
+        self.roi_ids = None  # ids in polycopy of the points of polydata, None without ROI
+        self.threshold_indices = {}  # array name -> ThresholdIndex of the working set
+        self.radius = None  # Data View point radius of the working set
+        self.array_statistics = None  # array name -> ArrayStatistics of the current snapshot
+        self.query_engine = None  # QueryEngine of the working set, keeps clause masks across query edits
+        self.spatial = None  # SpatialIndex of the current snapshot
+        self.levels = None  # level of detail of every point of the current snapshot
+        self.levels_future = None  # levels of the current snapshot being built in the background
+        self.levels_executor = ThreadPoolExecutor(max_workers=1)
+        self.keys = None  # random sample key of every point of the current snapshot
+        self.volume = None  # (grid parameters, Volume View mip pyramid) of the working set
+        self.display_fraction = 1.  # share of the particles drawn, below 1 while a snapshot fills in progressively
+        self.display_version = 0  # bumped whenever the Qt thread selects the points to draw anew
+        self.lod_controller = LODController(parent)
+        self.lod_controller.refresh = self.refresh_levels
+        self.num_selected = 0  # number of points shown in Data View
+        self.snapshots = SnapshotCache()
+        self.prefetcher = Prefetcher(self.snapshots,
+                                     lambda filename: self.read_polytope(filename, self.required_arrays(), warm=True))
+        self.grid_cache = GridCache()
+
+    def read_polytope(self, filename, arrays=None, warm=False) -> vtk.vtkPolyData:
+        if config.UseSnapshotCache:
+            polydata = snapshot.load_polydata(filename, arrays)
+            if warm:
+                snapshot.warm(filename)
+                if config.LOD:
+                    # Stored in the cache, so opening the snapshot only maps them
+                    snapshot_levels(filename, vtk_to_numpy(polydata.GetPoints().GetData()),
+                                    particletype.get_labels(polydata))
+            return polydata
+        return snapshot.read_polydata(filename, arrays)
+
+    def required_arrays(self):
+        # Point arrays the current view reads, everything else stays on disk until it is asked for. The current
+        # array is the active scalars of every view, split_particles and the color range need it.
+        arrays = [particletype.TYPE_ARRAY, 'hh', config.ArrayName]
+        if config.CurrentView == 'Data View':
+            if config.ShowGlyph:
+                arrays += ['vx', 'vy', 'vz']
+        elif config.CurrentView == 'Volume View':
+            if config.VolumeReduction == 'weighted_mean':
+                arrays.append('mass')
+        return arrays
+
+    def require_arrays(self, arrays):
+        # Lazily load the given point arrays into the snapshot, computing derived fields from their inputs
+        point_data = self.polycopy.GetPointData()
+        fields = [name for name in arrays if derived.is_derived(name) and not point_data.HasArray(name)]
+        missing = [name for name in arrays + derived.inputs(fields)
+                   if not derived.is_derived(name) and not point_data.HasArray(name)]
+        if missing:
+            self.load_arrays(missing)
+        derived.add_arrays(self.polycopy, config.File, fields, cached=config.UseSnapshotCache)
+        if missing or fields:
+            self.snapshots.resize(config.File)
+        if self.roi_ids is not None:
+            # Copy the new arrays into the cropped working set, reading only the pages of its points
+            cropped = self.polydata.GetPointData()
+            for name in arrays:
+                if point_data.HasArray(name) and not cropped.HasArray(name):
+                    arr = numpy_to_vtk(vtk_to_numpy(point_data.GetArray(name))[self.roi_ids],
+                                       array_type=point_data.GetArray(name).GetDataType())
+                    arr.SetName(name)
+                    cropped.AddArray(arr)
+
+    def load_arrays(self, missing):
+        point_data = self.polycopy.GetPointData()
+        if config.UseSnapshotCache:
+            snapshot.add_arrays(self.polycopy, config.File, missing)
+        else:
+            extra = snapshot.read_polydata(config.File, missing).GetPointData()
+            for name in missing:
+                if extra.HasArray(name):
+                    point_data.AddArray(extra.GetArray(name))
 
     def load_polytope(self, filename):
         if config.File != filename:
             config.File = filename
-            print(f'Reading {filename}...')
-            reader = vtk.vtkXMLPolyDataReader()
-            reader.SetFileName(filename)
-            reader.Update()
-            self.polydata: vtk.vtkPolyData = reader.GetOutput()
-            self.polycopy = self.polydata
+            self.polycopy: vtk.vtkPolyData = self.prefetcher.get(filename)
+            if self.polycopy is None:
+                print(f'Reading {filename}...')
+                self.polycopy = self.read_polytope(filename, self.required_arrays())
+                self.snapshots.put(filename, self.polycopy)
+            self.array_statistics = None
+            self.spatial = None
+            self.levels = None
+            self.levels_future = None
+            self.keys = None
+            self.crop()
+            self.require_arrays(self.required_arrays())
             self.update_scalars()
+            self.prefetcher.prefetch(Catalog.for_file(filename).neighbours(filename, config.PrefetchRadius))
+
+    def crop(self):
+        '''
+        Make the working set the particles of the snapshot inside config.ROI, or the whole snapshot without ROI.
+        The box wraps around the periodic domain. Cropped points keep their grouping by type.
+        '''
+        self.polydata = self.polycopy
+        self.roi_ids = None
+        if config.ROI is not None:
+            self.roi_ids = self.spatial_index().query_box(config.ROI[0::2], config.ROI[1::2])
+            self.polydata = extract_points(self.polycopy, self.roi_ids)
+            offsets = particletype.get_offsets(self.polycopy)
+            if offsets is not None:
+                particletype.set_offsets(self.polydata, np.searchsorted(self.roi_ids, offsets))
+        self.threshold_indices = {}
+        self.radius = None
+        self.query_engine = None
+        self.volume = None
+        self.display_version += 1
+
+    def set_roi(self, roi):
+        # roi: (xmin, xmax, ymin, ymax, zmin, zmax) or None for the whole box
+        config.ROI = None if roi is None else tuple(float(v) for v in roi)
+        self.crop()
+        self.update_scalars()
+
+    def threshold_index(self, array_name, polydata=None) -> ThresholdIndex:
+        '''
+        Sorted index for thresholding an array, persisted in the snapshot cache when the snapshot comes from there
+
+        polydata: shallow copy of the working set with the array loaded, see fill_source, to build the index on a
+        worker thread
+        '''
+        # Taken first: a snapshot or region opened meanwhile gets new ones, an index of the old one does not go there
+        indices, roi_ids, filename = self.threshold_indices, self.roi_ids, config.File
+        if array_name not in indices:
+            if polydata is None:
+                self.require_arrays([array_name])
+                polydata = self.polydata
+            values = vtk_to_numpy(polydata.GetPointData().GetArray(array_name))
+            offsets = particletype.get_offsets(polydata)
+            if offsets is None:
+                # Not grouped by type: segment by label instead
+                labels = particletype.get_labels(polydata)
+                order, offsets = particletype.sort_by_type(labels)
+                index = ThresholdIndex.build(values[order], offsets)
+                index.order = order[index.order]
+            elif roi_ids is not None:
+                index = ThresholdIndex.build(values, offsets)  # small, and only valid for this ROI
+            else:
+                index = load_index(filename, array_name, values, offsets)
+            indices[array_name] = index
+        return indices[array_name]
+
+    def threshold_selection(self, array_name, lo, hi, fraction=1., polydata=None):
+        '''
+        Point ids per type with lo <= value <= hi. The first frame of a progressive fill does not wait for the sorted
+        index: it compares the values of the sample only, and the fill builds the index on its worker thread.
+        '''
+        if polydata is None and fraction < 1. and array_name not in self.threshold_indices:
+            self.require_arrays([array_name])
+            values = vtk_to_numpy(self.polydata.GetPointData().GetArray(array_name))
+            sample = self.sample_selection(particletype.type_ids(self.polydata), fraction)
+            return [ids[(values[ids] >= lo) & (values[ids] <= hi)] for ids in sample]
+        return self.threshold_index(array_name, polydata).select(lo, hi)
+
+    def spatial_index(self) -> SpatialIndex:
+        # Periodic cell list over the points of the whole snapshot, persisted in the snapshot cache
+        if self.spatial is None:
+            points = vtk_to_numpy(self.polycopy.GetPoints().GetData())
+            if config.UseSnapshotCache:
+                self.spatial = load_spatial_index(config.File, points)
+            else:
+                self.spatial = SpatialIndex.build(points)
+        return self.spatial
+
+    def lod_levels(self):
+        '''
+        Level of detail of the points of the working set, persisted in the snapshot cache. They are built on a
+        background thread, so this is None until they are ready, and always without config.LOD.
+        '''
+        if not config.LOD:
+            return None
+        if self.levels is None:
+            if self.levels_future is None:
+                # The worker gets numpy arrays, the polydata may get new arrays on this thread meanwhile
+                self.levels_future = self.levels_executor.submit(
+                    snapshot_levels, config.File, vtk_to_numpy(self.polycopy.GetPoints().GetData()),
+                    particletype.get_labels(self.polycopy))
+            if not self.levels_future.done():
+                return None
+            try:
+                self.levels = self.levels_future.result()
+            except Exception as e:
+                print(f'Building the levels of detail failed: {e}')
+                return None
+        return self.levels if self.roi_ids is None else self.levels[self.roi_ids]
+
+    def refresh_levels(self):
+        # The camera starts moving and the actors were made before the levels of detail were ready: add them now
+        if self.lod_levels() is None or config.CurrentView not in ('Data View', 'Type Explorer'):
+            return False
+        self.update_display()
+        return True
+
+    def sample_keys(self):
+        # Sample keys of the points of the working set, see dataops.sampling
+        if self.keys is None:
+            self.require_arrays(['id'])
+            point_data = self.polycopy.GetPointData()
+            if point_data.HasArray('id'):
+                ids = vtk_to_numpy(point_data.GetArray('id'))
+            else:
+                ids = np.arange(self.polycopy.GetNumberOfPoints())
+            self.keys = load_keys(config.File, ids) if config.UseSnapshotCache else sample_keys(ids)
+        return self.keys if self.roi_ids is None else self.keys[self.roi_ids]
+
+    def sample_selection(self, selection, fraction=None):
+        # Reduce a list of point id arrays to fraction of their points, display_fraction by default
+        fraction = self.display_fraction if fraction is None else fraction
+        if fraction >= 1.:
+            return selection
+        keys = self.sample_keys()
+        threshold = key_threshold(fraction)
+        return [ids[keys[ids] < threshold] for ids in selection]
+
+    def query_mask(self, expression):
+        # Boolean mask of the points of the current snapshot matching a query, arrays are loaded as needed
+        if self.query_engine is None:
+            def column(name):
+                if name != particletype.TYPE_ARRAY:
+                    self.require_arrays([name])
+                return QueryEngine.for_polydata(self.polydata).column(name)
+            self.query_engine = QueryEngine(column, self.polydata.GetNumberOfPoints())
+        return self.query_engine.mask(expression)
+
+    def statistics(self, array_name):
+        # Histograms and quantiles of an array of the current snapshot, None if it has none. Only the arrays asked
+        # for are summarized, so opening a snapshot does not read or derive every array.
+        if self.array_statistics is None:
+            self.array_statistics = {}
+        if array_name not in self.array_statistics:
+            if config.UseSnapshotCache:
+                stats = statistics.load_statistics(config.File, array_name)
+            else:
+                self.require_arrays([array_name])
+                point_data = self.polycopy.GetPointData()
+                stats = statistics.compute_statistics(
+                    {array_name: vtk_to_numpy(point_data.GetArray(array_name))}
+                    if point_data.HasArray(array_name) else {}).get(array_name)
+            self.array_statistics[array_name] = stats
+        return self.array_statistics[array_name]
+
+    def volume_levels(self):
+        '''
+        Volume View mip pyramid of the working set, finest first. It is kept until the working set or the grid
+        parameters change, stored in the grid cache, and the neighbouring snapshots are gridded ahead.
+        '''
+        kernel = gridding.grid_kernel(config.VolumeReduction, config.VolumeKernel)
+        params = (config.ArrayName, config.VolumeResolution, config.VolumeReduction, kernel)
+        if self.volume is not None and self.volume[0] == (params, config.VolumeMinResolution):
+            return self.volume[1]
+        if not config.GridCache:
+            grid = core.map_point_cloud_to_grid(self.polydata, gridding.region_bounds(self.polydata, config.ROI),
+                                                config.VolumeResolution)
+            levels = gridding.build_pyramid(grid, config.VolumeMinResolution, config.VolumeReduction)
+        else:
+            levels = self.grid_cache.pyramid(config.File, self.polydata, *params, roi=config.ROI,
+                                             min_resolution=config.VolumeMinResolution)
+            if config.ROI is None:
+                self.grid_cache.prefetch(Catalog.for_file(config.File).neighbours(config.File, config.PrefetchRadius),
+                                         *params)
+        self.volume = ((params, config.VolumeMinResolution), levels)
+        return levels
+
+    def scalar_range(self, array_name):
+        # Range of an array over the snapshot for coloring. The first frame of a progressive fill takes it from a
+        # min/max pass rather than waiting for histograms and quantiles.
+        if self.display_fraction < 1. and array_name not in (self.array_statistics or {}) \
+                and self.polycopy.GetPointData().HasArray(array_name):
+            return self.polycopy.GetPointData().GetArray(array_name).GetRange()
+        stats = self.statistics(array_name)
+        return stats.range() if stats else self.polydata.GetPointData().GetScalars().GetRange()
 
     def update_scalars(self):
         self.polydata.GetPointData().SetActiveScalars(config.ArrayName)
 
     def update_actors(self):
         self.remove_actors()
+        self.require_arrays(self.required_arrays())
         self.polydata.GetPointData().SetActiveScalars(config.ArrayName)
-        range = self.polydata.GetPointData().GetScalars().GetRange()
+        self.display_version += 1
+        range = self.scalar_range(config.ArrayName)
+        if config.GlobalColorRange:
+            range = Catalog.for_file(config.File).global_range(config.ArrayName) or range
         config.RangeMin = range[0]
         config.RangeMax = range[1]
         if config.CurrentView == 'Type Explorer':
@@ -45,7 +329,45 @@ class Actors:
         elif config.CurrentView == 'Volume View':
             create_volume_view_actors(self)
 
+    def update_threshold(self):
+        # Cheap path for threshold edits: Data View keeps its actors, everything else is rebuilt
+        self.display_version += 1
+        if config.CurrentView == 'Data View' and set(self.actors) == set(self.property_map):
+            update_data_view_actors(self)
+        else:
+            self.update_actors()
+
+    def update_display(self, split_polydata=None):
+        # Swap the inputs of the point actors after display_fraction changed, to split_polydata from select_points
+        # if given
+        if set(self.actors) != set(self.property_map):
+            return
+        if split_polydata is None:
+            self.display_version += 1
+        if config.CurrentView == 'Data View':
+            update_data_view_actors(self, split_polydata)
+        elif config.CurrentView == 'Type Explorer':
+            update_type_explorer_actors(self, split_polydata)
+
+    def fill_source(self):
+        '''
+        What a progressive fill step reads from the working set: a shallow copy of it, which keeps its arrays when
+        arrays are added to the working set, and the query mask. Take it on the Qt thread and pass it to
+        select_points on the worker.
+        '''
+        polydata = vtk.vtkPolyData()
+        polydata.ShallowCopy(self.polydata)
+        mask = self.query_mask(config.Query) if config.CurrentView == 'Data View' and config.Query else None
+        return polydata, mask
+
+    def select_points(self, fraction, source):
+        # Polydata per type of the points to draw at fraction, for update_display; runs on the fill worker
+        if config.CurrentView == 'Data View':
+            return select_data_view_points(self, fraction, source)
+        return select_type_explorer_points(self, fraction, source)
+
     def remove_actors(self):
+        self.lod_controller.clear()
         for name, actor in self.actors.items():
             if name == 'grid':
                 self.parent.ren.RemoveVolume(actor)
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import vtk
+from vtkmodules.util.numpy_support import numpy_to_vtk
+
+import config
+from rendering.actors import Actors
+
+
+def write_snapshot(filename, n=3000):
+    rng = np.random.default_rng(0)
+    polydata = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_to_vtk(rng.random((n, 3)).astype(np.float32) * config.CoordMax, deep=True))
+    polydata.SetPoints(points)
+    columns = {'mask': rng.integers(0, 512, n).astype(np.int16), 'id': np.arange(n, dtype=np.int64),
+               'hh': rng.random(n).astype(np.float32) + 0.1, 'rho': rng.random(n).astype(np.float32),
+               'phi': rng.random(n).astype(np.float32)}
+    for name, values in columns.items():
+        arr = numpy_to_vtk(values, deep=True)
+        arr.SetName(name)
+        polydata.GetPointData().AddArray(arr)
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(filename)
+    writer.SetInputData(polydata)
+    writer.Write()
+
+
+class Window:
+    # The parts of rendering.window.Window the actors use, without Qt
+    def __init__(self):
+        self.ren = vtk.vtkRenderer()
+        self.iren = vtk.vtkRenderWindowInteractor()
+        self.iren.SetInteractorStyle(vtk.vtkInteractorStyleTrackballCamera())
+
+    def render(self):
+        pass
+
+
+class TestActors(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'Full.cosmo.000.vtp')
+        write_snapshot(self.filename)
+        self.config = {name: getattr(config, name) for name in
+                       ('File', 'CurrentView', 'ArrayName', 'CacheDir', 'UseSnapshotCache', 'LOD', 'ROI')}
+        config.File, config.ArrayName, config.LOD, config.ROI = None, 'phi', False, None
+        config.CacheDir = os.path.join(self.directory.name, 'cache')
+
+    def tearDown(self):
+        for name, value in self.config.items():
+            setattr(config, name, value)
+        self.directory.cleanup()
+
+    def test_open_in_every_view(self):
+        for cached in (True, False):
+            for view in ('Type Explorer', 'Data View'):
+                config.UseSnapshotCache, config.CurrentView, config.File = cached, view, None
+                actors = Actors(Window())
+                actors.load_polytope(self.filename)
+                actors.update_actors()
+                actors.prefetcher.shutdown()
+                self.assertEqual(actors.polydata.GetPointData().GetScalars().GetName(), 'phi', f'{view} {cached}')
+                self.assertEqual(sum(actor.GetMapper().GetInput().GetNumberOfPoints()
+                                     for actor in actors.actors.values()), 3000, f'{view} {cached}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -46,8 +46,8 @@ class BottomBar:
     def updateBottomBarText(self):
         self.bottomBarFileLabel.setText(" File: " + config.File)
 
-    def updateBottomBarProgress(self, current):
-        percent = 100/624*current
+    def updateBottomBarProgress(self, current, total=624):
+        percent = 100/total*current
         self.bottomBarProgressLabel.setText("Rendering: [{}] {}%".format(self.getloadingbar(percent), int(percent)))
 
     def clearBottomBarProgress(self):
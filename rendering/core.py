@@ -2,24 +2,24 @@ import vtk
 import config
 import numpy as np
 from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+from dataops import particletype, gridding
 
-def split_particles(polydata: vtk.vtkPolyData, pretty_print=False):
+def split_particles(polydata: vtk.vtkPolyData, pretty_print=False, selection=None, arrays=None):
+    '''
+    Split the points of a polydata into one polydata per particle type
+
+    selection: optional list of point id arrays per type code, e.g. from ThresholdIndex.select, to split only those
+    arrays: optional {name: numpy array with one value per point} to split along with the points
+    '''
     pts_np = vtk_to_numpy(polydata.GetPoints().GetData())
-    mask_np = vtk_to_numpy(polydata.GetPointData().GetArray('mask')).astype(np.int32)
     active_scalar_name = polydata.GetPointData().GetScalars().GetName()
     scalar_np = vtk_to_numpy(polydata.GetPointData().GetScalars())
     hh_np = vtk_to_numpy(polydata.GetPointData().GetArray('hh'))
+    extra_np = arrays or {}
 
-    type_mask = {'dm': mask_np & (1 << 1) == 0}
-    type_mask['baryon'] = ~type_mask['dm']
-    type_mask['star'] = type_mask['baryon'] & (mask_np & (1 << 5) != 0)
-    type_mask['wind'] = type_mask['baryon'] & (mask_np & (1 << 6) != 0)
-    type_mask['gas'] = type_mask['baryon'] & (mask_np & (1 << 7) != 0)
-    type_mask['agn'] = type_mask['dm'] & (mask_np & (1 << 8) != 0)
-    type_mask['dm'] = type_mask['dm'] & ~type_mask['agn']
-    type_mask['baryon'] = type_mask['baryon'] & ~type_mask['star'] & ~type_mask['wind'] & ~type_mask['gas']
+    offsets = particletype.get_offsets(polydata)
 
-    def make_polydata(pts, scalars, hh):
+    def make_polydata(pts, scalars, hh, extra=None):
         out = vtk.vtkPolyData()
         point_data = vtk.vtkPoints()
         point_data.SetData(numpy_to_vtk(pts))
@@ -33,10 +33,31 @@ def split_particles(polydata: vtk.vtkPolyData, pretty_print=False):
         hh_arr.SetName('hh')
         out.GetPointData().AddArray(hh_arr)
 
+        for name, values in (extra or {}).items():
+            arr = numpy_to_vtk(values)
+            arr.SetName(name)
+            out.GetPointData().AddArray(arr)
+
         out.GetPointData().SetActiveScalars(active_scalar_name)
         return out
 
-    type_polydata = {name: make_polydata(pts_np[mask], scalar_np[mask], hh_np[mask]) for name, mask in type_mask.items()}
+    if selection is not None:
+        type_polydata = {name: make_polydata(pts_np[selection[code]], scalar_np[selection[code]], hh_np[selection[code]],
+                                             {key: values[selection[code]] for key, values in extra_np.items()})
+                         for name, code in particletype.TYPE_CODES.items()}
+    elif offsets is not None:
+        # Points are grouped by type, so every type is a zero-copy slice
+        type_polydata = {name: make_polydata(pts_np[offsets[code]:offsets[code + 1]],
+                                             scalar_np[offsets[code]:offsets[code + 1]],
+                                             hh_np[offsets[code]:offsets[code + 1]],
+                                             {key: values[offsets[code]:offsets[code + 1]]
+                                              for key, values in extra_np.items()})
+                         for name, code in particletype.TYPE_CODES.items()}
+    else:
+        labels = particletype.get_labels(polydata)
+        type_polydata = {name: make_polydata(pts_np[labels == code], scalar_np[labels == code], hh_np[labels == code],
+                                             {key: values[labels == code] for key, values in extra_np.items()})
+                         for name, code in particletype.TYPE_CODES.items()}
 
     # pretty print counts
     if pretty_print:
@@ -46,7 +67,8 @@ def split_particles(polydata: vtk.vtkPolyData, pretty_print=False):
             print(f'{name:8} {num:8} {percent:9.3f} %')
 
     # check counts
-    assert sum([type_polydata[name].GetNumberOfPoints() for name in type_mask]) == polydata.GetNumberOfPoints()
+    if selection is None:
+        assert sum([data.GetNumberOfPoints() for data in type_polydata.values()]) == polydata.GetNumberOfPoints()
 
     return type_polydata
 
@@ -62,20 +84,41 @@ def update_view_property(actor: vtk.vtkActor, color: vtk.vtkColor3d = None, opac
 
 
 # Normalize sph smoothing length to a given max value, and store it to radius array
-def update_radius(polydata: vtk.vtkPolyData, min_value: float = 0.01, max_value: float = 1.):
-    hh = vtk_to_numpy(polydata.GetPointData().GetArray('hh'))
-    if len(hh) == 0: return
+def normalize_radius(hh, min_value: float = 0.01, max_value: float = 1.):
     hmax = hh.max()
     hmin = hh.min()
     if hmax - hmin < 1e-6:
-        rad = np.ones_like(hh) * max_value
-    else:
-        rad = min_value + (max_value - min_value) * (hh - hmin) / (hmax - hmin)
+        return np.ones_like(hh) * max_value
+    return min_value + (max_value - min_value) * (hh - hmin) / (hmax - hmin)
+
+
+def update_radius(polydata: vtk.vtkPolyData, min_value: float = 0.01, max_value: float = 1.):
+    hh = vtk_to_numpy(polydata.GetPointData().GetArray('hh'))
+    if len(hh) == 0: return
+    rad = normalize_radius(hh, min_value, max_value)
     rad_arr = numpy_to_vtk(rad)
     rad_arr.SetName('radius')
     polydata.GetPointData().AddArray(rad_arr)
 
 
+# Radius of every point of a snapshot, with the smoothing length normalized over all particles of its type
+def type_radius(polydata: vtk.vtkPolyData, min_value: float = 0.01, max_value: float = 1.):
+    hh = vtk_to_numpy(polydata.GetPointData().GetArray('hh'))
+    rad = np.empty_like(hh)
+    offsets = particletype.get_offsets(polydata)
+    if offsets is not None:
+        for a, b in zip(offsets[:-1], offsets[1:]):
+            if b > a:
+                rad[a:b] = normalize_radius(hh[a:b], min_value, max_value)
+        return rad
+    labels = particletype.get_labels(polydata)
+    for code in particletype.TYPE_CODES.values():
+        selected = labels == code
+        if selected.any():
+            rad[selected] = normalize_radius(hh[selected], min_value, max_value)
+    return rad
+
+
 def update_view_property_data_view(actor: vtk.vtkActor, color: vtk.vtkColor3d, opacity: float, radius: float,
                                    show=None):
     actor.GetProperty().SetOpacity(0.2)
@@ -102,41 +145,15 @@ def create_view_color_transfer_function():
     colorTransferFunction.AddRGBPoint(255.0, 1.0, 1.0, 1.0)
     return colorTransferFunction
 
-def map_point_cloud_to_grid(polydata, bounds, grid_resolution):
-    grid = vtk.vtkImageData()
-    grid.SetDimensions(grid_resolution)
-    grid.SetOrigin(bounds[0], bounds[2], bounds[4])
-    grid.SetSpacing(
-        (bounds[1] - bounds[0]) / (grid_resolution[0] - 1),
-        (bounds[3] - bounds[2]) / (grid_resolution[1] - 1),
-        (bounds[5] - bounds[4]) / (grid_resolution[2] - 1)
-    )
-
-    scalars = vtk.vtkFloatArray()
-    scalars.SetNumberOfComponents(1)
-    scalars.SetNumberOfTuples(grid.GetNumberOfPoints())
-    scalars.SetName(config.ArrayName)
-
-    num_points = vtk.vtkTypeUInt32Array()
-    num_points.SetNumberOfComponents(1)
-    num_points.SetNumberOfTuples(grid.GetNumberOfPoints())
-
-    for i in range(polydata.GetNumberOfPoints()):
-        point = polydata.GetPoint(i)
-        value = polydata.GetPointData().GetArray(config.ArrayName).GetValue(i)
-        grid_point_id = grid.FindPoint(point)
-        if grid_point_id >= 0:
-            # Accumulate the value and the number of points to compute the average
-            scalars.SetValue(grid_point_id, scalars.GetValue(grid_point_id) + value)
-            num_points.SetValue(grid_point_id, num_points.GetValue(grid_point_id) + 1)
-
-    # Compute the average
-    for i in range(grid.GetNumberOfPoints()):
-        if num_points.GetValue(i) > 0:
-            scalars.SetValue(i, scalars.GetValue(i) / num_points.GetValue(i))
-
-    grid.GetPointData().SetScalars(scalars)
-    return grid
+def map_point_cloud_to_grid(polydata, bounds, grid_resolution, reduction=None):
+    '''
+    Bin the points onto a grid spanning bounds, each grid point gets the config.VolumeReduction of the values of
+    config.ArrayName of the points nearest to it. With a config.VolumeKernel other than 'ngp' the points are
+    deposited onto the grid instead, see gridding.grid_polydata.
+    '''
+    reduction = config.VolumeReduction if reduction is None else reduction
+    return gridding.grid_polydata(polydata, config.ArrayName, bounds, grid_resolution, reduction,
+                                  kernel=config.VolumeKernel)
 
 def create_grid_volume(grid, color_map):
     mapper = vtk.vtkSmartVolumeMapper()
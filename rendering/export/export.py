@@ -6,7 +6,10 @@ import numpy as np
 from vtkmodules.vtkCommonCore import vtkPoints
 from vtkmodules.vtkCommonDataModel import vtkPolyData
 import config
-import re
+from dataops import snapshot, derived
+from dataops.filters import extract_points
+from dataops.sampling import sample_keys, sample_mask
+from dataops.catalog import Catalog
 from rendering.export.exportactors import ExportActors
 
 
@@ -38,28 +41,23 @@ class Exporter:
         renderWindow.SetSize(1920, 1080)
         renderWindow.SetOffScreenRendering(1)
         renderWindow.AddRenderer(self.renderer)
-        filename1 = config.File
-        filename2 = config.File
+        catalog = Catalog.for_file(config.File)
+        steps = catalog.steps()
         timesteps = self.create_array(self.renderinterpolationsteps)
         frames = ["python3", "./rendering/export/videocreator.py"]
         frame = 0
-        for i in range(0, 623, 4):
-            self.window.bottombar.updateBottomBarProgress(i)
-            numbers1 = re.findall(r"\d+", filename1)
-            if numbers1:
-                filename1 = filename1.replace(numbers1[0].zfill(3), str(i).zfill(3))
-            numbers2 = re.findall(r"\d+", filename2)
-            if numbers2:
-                filename2 = filename2.replace(numbers2[0].zfill(3), str(i + 2).zfill(3))
-            reader1 = vtk.vtkXMLPolyDataReader()
-            reader1.SetFileName(filename1)
-            reader1.Update()
-            polydata1 = reader1.GetOutput()
-
-            reader2 = vtk.vtkXMLPolyDataReader()
-            reader2.SetFileName(filename2)
-            reader2.Update()
-            polydata2 = reader2.GetOutput()
+        for i, (step1, step2) in enumerate(zip(steps[0:-1:2], steps[1::2])):
+            self.window.bottombar.updateBottomBarProgress(2 * i, len(steps))
+            filename1 = catalog.path(step1)
+            filename2 = catalog.path(step2)
+            polydata1 = snapshot.read_polydata(filename1)
+            polydata2 = snapshot.read_polydata(filename2)
+            derived.add_arrays(polydata1, filename1, [config.ArrayName])
+            derived.add_arrays(polydata2, filename2, [config.ArrayName])
+            if config.ExportFraction < 1.:
+                # Keys follow the particle ids, so both snapshots keep the same particles
+                polydata1 = self.sample(polydata1)
+                polydata2 = self.sample(polydata2)
 
             polydata1, polydata2 = self.eliminate_unequal_ids(polydata1, polydata2)
             for timestep in timesteps:
@@ -84,6 +82,10 @@ class Exporter:
         self.window.bottombar.clearBottomBarProgress()
         return frames
 
+    def sample(self, polydata):
+        keys = sample_keys(vtk_to_numpy(polydata.GetPointData().GetArray('id')))
+        return extract_points(polydata, np.flatnonzero(sample_mask(keys, config.ExportFraction)))
+
     def eliminate_unequal_ids(self, polydata1, polydata2):
         points_data1 = polydata1.GetPointData()
         points_data2 = polydata2.GetPointData()
@@ -147,6 +149,9 @@ class Exporter:
         for i in range(points_data1.GetNumberOfArrays()):
             arr1 = points_data1.GetArray(i)
             arr2 = points_data2.GetArray(i)
+            if arr1.GetDataType() not in (vtk.VTK_FLOAT, vtk.VTK_DOUBLE):
+                interp_data.AddArray(arr1)  # ids, mask and type labels are kept as they are
+                continue
             interp_arr = vtk.vtkFloatArray()
             interp_arr.SetNumberOfComponents(arr1.GetNumberOfComponents())
             interp_arr.SetName(arr1.GetName())
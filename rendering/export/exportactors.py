@@ -5,7 +5,7 @@ import rendering.core as core
 import config
 import vtk
 
-from dataops.filters import threshold_points
+from dataops.filters import threshold_points, query_points
 from rendering.viewactors.dataviewactors import get_data_view_actors
 from rendering.viewactors.typeexploreractors import get_type_explorer_actors
 
@@ -42,29 +42,33 @@ class ExportActors:
                     self.renderer.AddActor(self.actors[name])
         elif config.CurrentView == 'Data View':
             pd = threshold_points(self.polydata)
+            if config.Query:
+                pd = query_points(pd, config.Query)
             split_polydata = core.split_particles(pd)
             self.actors = {name: get_data_view_actors(data) for name, data in split_polydata.items()}
             for name, (color, opacity, radius, show) in self.property_map.items():
                 if show:
                     self.renderer.AddActor(self.actors[name])
         elif config.CurrentView == 'Volume View':
-            bounds = self.polycopy.GetBounds()
-            grid_resolution = (100, 100, 100)
-            grid = core.map_point_cloud_to_grid(self.polycopy, bounds, grid_resolution)
-            color_map = core.create_view_color_map()
-            grid_actor = core.create_grid_actor(grid, color_map)
+            bounds = self.polydata.GetBounds()
+            grid = core.map_point_cloud_to_grid(self.polydata, bounds, config.VolumeResolution)
+            color_map = core.create_view_color_transfer_function()
+            grid_actor = core.create_grid_volume(grid, color_map)
             opacityTransferFunction = vtkPiecewiseFunction()
             opacityTransferFunction.AddPoint(20, 0)
             opacityTransferFunction.AddPoint(255, 1)
             grid_actor.GetProperty().SetColor(color_map)
             grid_actor.GetProperty().SetScalarOpacity(opacityTransferFunction)
             self.actors = {'grid': grid_actor}
-            self.renderer.AddActor(grid_actor)
+            self.renderer.AddVolume(grid_actor)
 
 
     def remove_actors(self):
-        for actor in self.actors.values():
-            self.renderer.RemoveActor(actor)
+        for name, actor in self.actors.items():
+            if name == 'grid':
+                self.renderer.RemoveVolume(actor)
+            else:
+                self.renderer.RemoveActor(actor)
         self.actors = {}
 
     def add_actors(self):
@@ -0,0 +1,128 @@
+import time
+
+import numpy as np
+from vtkmodules.util.numpy_support import vtk_to_numpy
+
+import config
+from dataops import lod
+from dataops.filters import extract_points
+
+
+class LODController:
+    '''
+    Swaps the point actors of the current view to a coarse level of detail while the camera is being moved and back
+    to full detail when it stops. The level is chosen so that, going by the last full-detail frame, a coarse frame
+    takes at most config.LODFrameBudget seconds. A volume is swapped the same way to a coarser level of its mip
+    pyramid.
+    '''
+
+    def __init__(self, window):
+        self.window = window
+        self.inputs = {}  # name -> (vtkActor, full detail polydata with a lod array)
+        self.coarse = {}  # name -> (mtime of the full polydata, level, coarse polydata)
+        self.interacting = False
+        self.seconds_per_point = None  # measured on full-detail frames
+        self.volume = None  # (vtkVolume, vtkImageData levels finest first)
+        self.seconds_per_sample = None  # per grid point along a ray, measured on full-detail volume frames
+        self.refresh = None  # callable re-making the inputs with levels of detail, True if it could
+        style = window.iren.GetInteractorStyle()
+        style.AddObserver('StartInteractionEvent', self.on_start_interaction)
+        style.AddObserver('EndInteractionEvent', self.on_end_interaction)
+        window.ren.AddObserver('StartEvent', self.on_start_render)
+        window.ren.AddObserver('EndEvent', self.on_end_render)
+        self.render_start = None
+
+    def set_input(self, name, actor, polydata):
+        self.inputs[name] = (actor, polydata)
+        actor.GetMapper().SetInputData(polydata)
+
+    def set_volume(self, volume, levels):
+        self.volume = (volume, levels)
+        volume.GetMapper().SetInputData(levels[0])
+
+    def clear(self):
+        self.inputs = {}
+        self.coarse = {}
+        self.volume = None
+
+    def num_points(self):
+        return sum(polydata.GetNumberOfPoints() for _, polydata in self.inputs.values())
+
+    def level(self):
+        # Coarsest level that still fits the frame budget, None if full detail does
+        if not config.LOD or self.seconds_per_point is None:
+            return None
+        levels = [vtk_to_numpy(polydata.GetPointData().GetArray(lod.LOD_ARRAY)) for _, polydata in self.inputs.values()
+                  if polydata.GetPointData().HasArray(lod.LOD_ARRAY)]
+        if not levels:
+            return None
+        return lod.choose_level(np.concatenate(levels), config.LODFrameBudget / self.seconds_per_point)
+
+    def volume_level(self):
+        '''
+        returns: index of the pyramid level drawn while interacting: the finest one of at most
+        config.VolumeInteractiveResolution grid points per axis if that is set, otherwise the finest one that fits
+        the frame budget. Ray casting time grows with the number of grid points a ray crosses.
+        '''
+        _, levels = self.volume
+        sizes = [max(level.GetDimensions()) for level in levels]
+        if config.VolumeInteractiveResolution is not None:
+            limit = config.VolumeInteractiveResolution
+        elif config.LOD and self.seconds_per_sample is not None:
+            limit = config.LODFrameBudget / self.seconds_per_sample
+        else:
+            return 0
+        fitting = [i for i, size in enumerate(sizes) if size <= limit]
+        return fitting[0] if fitting else len(levels) - 1
+
+    def coarse_polydata(self, name, level):
+        _, polydata = self.inputs[name]
+        cached = self.coarse.get(name)
+        if cached and cached[0] == polydata.GetMTime() and cached[1] == level:
+            return cached[2]
+        levels = polydata.GetPointData().GetArray(lod.LOD_ARRAY)
+        if levels is None:
+            return polydata
+        coarse = extract_points(polydata, np.flatnonzero(vtk_to_numpy(levels) <= level))
+        self.coarse[name] = (polydata.GetMTime(), level, coarse)
+        return coarse
+
+    def missing_levels(self):
+        return any(not polydata.GetPointData().HasArray(lod.LOD_ARRAY) for _, polydata in self.inputs.values())
+
+    def on_start_interaction(self, obj, event):
+        self.interacting = True
+        if config.LOD and self.refresh is not None and self.inputs and self.missing_levels():
+            # The levels are built in the background, an interaction before they are ready stays at full detail
+            self.refresh()
+        if self.volume is not None:
+            volume, levels = self.volume
+            volume.GetMapper().SetInputData(levels[self.volume_level()])
+        level = self.level()
+        if level is None:
+            return
+        for name, (actor, _) in self.inputs.items():
+            actor.GetMapper().SetInputData(self.coarse_polydata(name, level))
+
+    def on_end_interaction(self, obj, event):
+        self.interacting = False
+        for actor, polydata in self.inputs.values():
+            actor.GetMapper().SetInputData(polydata)
+        if self.volume is not None:
+            volume, levels = self.volume
+            volume.GetMapper().SetInputData(levels[0])
+        self.window.render()
+
+    def on_start_render(self, obj, event):
+        self.render_start = time.perf_counter()
+
+    def on_end_render(self, obj, event):
+        # Only full-detail frames tell how expensive the full point set is
+        if self.interacting or self.render_start is None:
+            return
+        seconds = time.perf_counter() - self.render_start
+        num_points = self.num_points()
+        if num_points:
+            self.seconds_per_point = seconds / num_points
+        if self.volume is not None:
+            self.seconds_per_sample = seconds / max(self.volume[1][0].GetDimensions())
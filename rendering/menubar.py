@@ -1,10 +1,12 @@
 import os
-import re
 import sys
+import threading
 from PyQt5 import QtWidgets, QtGui, QtCore
 
 import config
+from dataops.slicestack import sweep
 from rendering.export.export import Exporter
+from rendering.regionofinterest import RegionDialog, RegionBoxWidget
 
 
 class IntInputAction(QtWidgets.QWidgetAction):
@@ -20,6 +22,7 @@ class IntInputAction(QtWidgets.QWidgetAction):
 
 
 class MenuBar(QtWidgets.QWidget):
+    catalog_scanned = QtCore.pyqtSignal()
 
     def __init__(self, window):
         super(MenuBar, self).__init__()
@@ -29,6 +32,8 @@ class MenuBar(QtWidgets.QWidget):
         self.animation_bar = None
         self.timestep_input = None
         self.menubar = None
+        self.region_box = None
+        self.catalog_scanned.connect(self.on_catalog_scanned)
         self.initMenuBar()
 
 
@@ -42,6 +47,9 @@ class MenuBar(QtWidgets.QWidget):
         export_action = QtWidgets.QAction('Export', self.window)
         export_action.triggered.connect(self.export)
         file_menu.addAction(export_action)
+        slice_stack_action = QtWidgets.QAction('Export Slice Stack...', self.window)
+        slice_stack_action.triggered.connect(self.export_slice_stack)
+        file_menu.addAction(slice_stack_action)
         exit_action = QtWidgets.QAction('Exit', self.window)
         exit_action.triggered.connect(self.close)
         file_menu.addAction(exit_action)
@@ -62,6 +70,22 @@ class MenuBar(QtWidgets.QWidget):
         show_bot_bar = QtWidgets.QAction('Bottom Bar', self.window)
         show_bot_bar.triggered.connect(self.toggle_bottom_bar)
         show_menu.addAction(show_bot_bar)
+        global_range = QtWidgets.QAction('Global Color Range', self.window)
+        global_range.setCheckable(True)
+        global_range.setChecked(config.GlobalColorRange)
+        global_range.toggled.connect(self.toggle_global_color_range)
+        show_menu.addAction(global_range)
+        region_menu = self.menubar.addMenu('Region')
+        set_region = QtWidgets.QAction('Set Region of Interest...', self.window)
+        set_region.triggered.connect(self.set_region)
+        region_menu.addAction(set_region)
+        select_region = QtWidgets.QAction('Select Region with Box', self.window)
+        select_region.setCheckable(True)
+        select_region.toggled.connect(self.toggle_region_box)
+        region_menu.addAction(select_region)
+        clear_region = QtWidgets.QAction('Clear Region of Interest', self.window)
+        clear_region.triggered.connect(lambda: self.window.set_roi(None))
+        region_menu.addAction(clear_region)
 
         # Animation control
         self.animation_bar = QtWidgets.QToolBar()
@@ -142,46 +166,20 @@ class MenuBar(QtWidgets.QWidget):
     def forwardAnimation(self):
         if not self.window.actors.polydata:
             return
-        self.forward_action.setDisabled(True)
-        numbers = re.findall(r"\d+", config.File)
-        if numbers:
-            curr = numbers[0].zfill(3)
-            if int(curr) == 0:
-                self.back_action.setEnabled(True)
-            if int(curr) == 624:
-                return
-            number = str(int(curr) + 2).zfill(3)
-            config.CurrentTime = int(number)
-            filename = config.File.replace(curr, number)
-            self.timestep_input.setText(number)
-            self.window.open_file(filename)
-        else:
-            print("No number found in the string.")
-            exit(1)
-        if int(number) != 624:
-            self.forward_action.setEnabled(True)
+        catalog = self.window.catalog
+        step = catalog.next_step(catalog.step_of(config.File))
+        if step is None:
+            return
+        self.window.open_file(catalog.path(step))
 
     def backAnimation(self):
         if not self.window.actors.polydata:
             return
-        self.back_action.setDisabled(True)
-        numbers = re.findall(r"\d+", config.File)
-        if numbers:
-            curr = numbers[0].zfill(3)
-            if int(curr) == 624:
-                self.forward_action.setEnabled(True)
-            if int(curr) == 0:
-                return
-            number = str(int(curr) - 2).zfill(3)
-            config.CurrentTime = int(number)
-            filename = config.File.replace(curr, number)
-            self.timestep_input.setText(number)
-            self.window.open_file(filename)
-        else:
-            print("No number found in the string.")
-            exit(1)
-        if int(number) != 0:
-            self.back_action.setEnabled(True)
+        catalog = self.window.catalog
+        step = catalog.prev_step(catalog.step_of(config.File))
+        if step is None:
+            return
+        self.window.open_file(catalog.path(step))
 
     def stopAnimation(self):
         print('Stopping animation...')
@@ -198,37 +196,85 @@ class MenuBar(QtWidgets.QWidget):
         else:
             self.window.bottombar.bottombar.setVisible(True)
 
+    def toggle_global_color_range(self, checked):
+        config.GlobalColorRange = checked
+        if not self.window.actors.polydata:
+            return
+        if checked:
+            # Collecting array ranges reads every snapshot once, so do it in the background
+            self.window.catalog.scan_async(callback=lambda catalog: self.catalog_scanned.emit())
+        self.on_catalog_scanned()
+
+    def set_region(self):
+        dialog = RegionDialog(self.window, config.ROI)
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            self.window.set_roi(dialog.get_roi())
+
+    def toggle_region_box(self, checked):
+        if not self.region_box:
+            self.region_box = RegionBoxWidget(self.window.iren, self.window.set_roi)
+        if checked:
+            self.region_box.show(config.ROI)
+        else:
+            self.region_box.hide()
+        self.window.render()
+
+    def on_catalog_scanned(self):
+        if not self.window.actors.polydata:
+            return
+        self.window.actors.update_actors()
+        self.window.render()
+
     def set_timestep(self):
         timestep = self.timestep_input.text()
-        try:
-            if int(timestep) < 0 or int(timestep) > 624 or int(timestep) % 2 != 0:
-                print("invalid timestep")
-                self.timestep_input.clearFocus()
-                self.timestep_input.setText(config.CurrentTime)
-                return
-            if int(timestep) == 0:
-                self.back_action.setDisabled(True)
-                self.forward_action.setEnabled(True)
-            elif int(timestep) == 624:
-                self.back_action.setEnabled(True)
-                self.forward_action.setDisabled(True)
-            timestep = timestep.zfill(3)
-            numbers = re.findall(r"\d+", config.File)
-            if numbers:
-                curr = numbers[0].zfill(3)
-                filename = config.File.replace(curr, timestep)
-                config.CurrentTime = timestep
-                self.window.open_file(filename)
-                self.timestep_input.clearFocus()
-            else:
-                print("No number found in the string.")
-                exit(1)
-        except:
+        filename = None
+        if self.window.catalog and timestep.isdigit():
+            filename = self.window.catalog.path(int(timestep))
+        if filename is None:
+            print("invalid timestep")
             self.timestep_input.clearFocus()
             self.timestep_input.setText(config.CurrentTime)
             return
+        self.window.open_file(filename)
+        self.timestep_input.clearFocus()
 
     def export(self):
         if not self.window.actors.polydata:
             return
-        exporter = Exporter(self.window)
\ No newline at end of file
+        exporter = Exporter(self.window)
+
+    def export_slice_stack(self):
+        # Sweep the Data View scan plane through the box, with its axis, kernel and array
+        interpolator = getattr(self.window.toolbar, 'interpolator', None)
+        if not self.window.actors.polydata or interpolator is None:
+            print('Slice stacks are exported from the scan plane of the Data View')
+            return
+        axis = self.window.toolbar.scanPlaneAxis
+        num_slices, ok = QtWidgets.QInputDialog.getInt(self.window, 'Export Slice Stack', f'Slices along {axis}:',
+                                                       config.SliceStackSlices, 1, 4096)
+        if not ok:
+            return
+        filename, _filter = QtWidgets.QFileDialog.getSaveFileName(self.window, 'Export Slice Stack', os.getenv('HOME'),
+                                                                  'NumPy Files (*.npy)',
+                                                                  options=QtWidgets.QFileDialog.DontUseNativeDialog
+                                                                  )
+        if not filename:
+            return
+        if not filename.endswith('.npy'):
+            filename += '.npy'
+        png_dir = os.path.splitext(filename)[0] + '_png' if config.SliceStackPNG else None
+        # The particle arrays are taken here on the Qt thread, the sweep thread never reads the polydata
+        array_name = interpolator.array_name
+        data = interpolator.particle_data(array_name)
+        thread = threading.Thread(target=self.sweep_slices,
+                                  args=(interpolator, axis, num_slices, filename, png_dir, array_name, data),
+                                  daemon=True)
+        thread.start()
+
+    def sweep_slices(self, interpolator, axis, num_slices, filename, png_dir, array_name, data):
+        try:
+            stack = sweep(interpolator, axis, num_slices, filename, png_dir=png_dir, array_name=array_name, data=data)
+        except Exception as e:
+            print(f'Exporting the slice stack failed: {e}')
+            return
+        print(f'Wrote {len(stack)} slices along {axis} to {filename}')
@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5 import QtCore
+
+import config
+from dataops.sampling import prefix_fractions
+
+
+class ProgressiveDisplay(QtCore.QObject):
+    '''
+    Draws a large snapshot from a small random sample first and then fills it in with growing samples. The points
+    of every step are selected and split on a worker thread, from Actors.fill_source taken on the Qt thread, so the
+    window stays responsive while the remaining particles are added; the Qt thread only swaps the actor inputs.
+    '''
+    ready = QtCore.pyqtSignal(object, object)  # ((generation, display version, fraction), Future), on the Qt thread
+
+    def __init__(self, window):
+        super(ProgressiveDisplay, self).__init__()
+        self.window = window
+        self.fractions = []
+        self.generation = 0  # bumped by begin, steps of an earlier fill are dropped
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.ready.connect(self.show)
+
+    def begin(self):
+        # Call before the actors are built: picks the share of particles the first frame shows
+        self.generation += 1
+        self.fractions = []
+        actors = self.window.actors
+        actors.display_fraction = 1.
+        if not config.ProgressiveDisplay or config.CurrentView == 'Volume View' \
+                or actors.polydata.GetNumberOfPoints() < config.ProgressiveMinPoints:
+            return
+        self.fractions = prefix_fractions(config.ProgressiveFirstFraction)
+        actors.display_fraction = self.fractions.pop(0)
+
+    def start(self):
+        # Call after the first frame is rendered
+        if self.fractions:
+            self.submit()
+
+    def submit(self):
+        actors = self.window.actors
+        if config.CurrentView not in ('Data View', 'Type Explorer'):
+            # Switched to a view that is not sampled, it draws everything
+            self.fractions = []
+            actors.display_fraction = 1.
+            return
+        request = (self.generation, actors.display_version, self.fractions[0])
+        future = self.executor.submit(actors.select_points, self.fractions[0], actors.fill_source())
+        future.add_done_callback(lambda future: self.ready.emit(request, future))
+
+    def show(self, request, future):
+        generation, version, fraction = request
+        if generation != self.generation:
+            return  # another snapshot was opened
+        actors = self.window.actors
+        if version != actors.display_version:
+            self.submit()  # the points to draw changed meanwhile, select this step again
+            return
+        self.fractions.pop(0)
+        try:
+            split_polydata = future.result()
+        except Exception as e:
+            print(f'Filling in the snapshot failed: {e}')
+            self.fractions = []
+            actors.display_fraction = 1.
+            actors.update_display()
+        else:
+            actors.display_fraction = fraction
+            actors.update_display(split_polydata)
+        self.window.render()
+        if self.fractions:
+            self.submit()
+        elif hasattr(self.window.toolbar, 'update_kept_label'):
+            self.window.toolbar.update_kept_label()
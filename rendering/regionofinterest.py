@@ -0,0 +1,66 @@
+import vtk
+from PyQt5 import QtWidgets
+
+import config
+
+
+class RegionDialog(QtWidgets.QDialog):
+    '''
+    Dialog for typing the bounds of the region of interest. Bounds may reach past the box, the region then
+    wraps around the periodic domain.
+    '''
+
+    def __init__(self, parent, roi=None):
+        super(RegionDialog, self).__init__(parent)
+        self.setWindowTitle('Region of Interest')
+        roi = roi or (0, config.CoordMax, 0, config.CoordMax, 0, config.CoordMax)
+        layout = QtWidgets.QFormLayout(self)
+        self.inputs = []
+        for axis in range(3):
+            row = QtWidgets.QHBoxLayout()
+            for value in roi[2 * axis:2 * axis + 2]:
+                box = QtWidgets.QDoubleSpinBox()
+                box.setRange(-config.CoordMax, 2 * config.CoordMax)
+                box.setDecimals(3)
+                box.setValue(value)
+                row.addWidget(box)
+                self.inputs.append(box)
+            layout.addRow(QtWidgets.QLabel(f'{"xyz"[axis]} min / max:'), row)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+    def get_roi(self):
+        values = [box.value() for box in self.inputs]
+        for axis in range(3):
+            lo, hi = values[2 * axis], values[2 * axis + 1]
+            values[2 * axis], values[2 * axis + 1] = min(lo, hi), max(lo, hi)
+        return tuple(values)
+
+
+class RegionBoxWidget:
+    '''
+    Interactive box in the render window. Whenever the user releases the box, the callback gets its bounds.
+    '''
+
+    def __init__(self, interactor, callback):
+        self.callback = callback
+        self.representation = vtk.vtkBoxRepresentation()
+        self.representation.SetPlaceFactor(1.0)
+        self.representation.GetOutlineProperty().SetColor(1.0, 0.8, 0.0)
+        self.widget = vtk.vtkBoxWidget2()
+        self.widget.SetInteractor(interactor)
+        self.widget.SetRepresentation(self.representation)
+        self.widget.RotationEnabledOff()  # the region is an axis-aligned box
+        self.widget.AddObserver('EndInteractionEvent', self.on_end_interaction)
+
+    def show(self, roi=None):
+        self.representation.PlaceWidget(roi or (0, config.CoordMax, 0, config.CoordMax, 0, config.CoordMax))
+        self.widget.On()
+
+    def hide(self):
+        self.widget.Off()
+
+    def on_end_interaction(self, obj, event):
+        self.callback(tuple(self.representation.GetBounds()))
@@ -0,0 +1,55 @@
+import threading
+
+from PyQt5 import QtCore
+
+
+class ScanPlaneWorker(QtCore.QObject):
+    '''
+    Interpolates scan planes on a background thread so that dragging the slider never waits for the interpolator.
+    Only the latest request is kept: requests that arrive while a plane is being computed replace each other. Every
+    finished plane is delivered, so that the plane follows a drag even when requests keep overtaking each other;
+    the receiver draws it if it is newer than the plane on screen.
+    '''
+    finished = QtCore.pyqtSignal(object, object, int)  # (Interpolator, vtkPolyData, generation), on the Qt thread
+
+    def __init__(self):
+        super(ScanPlaneWorker, self).__init__()
+        self.condition = threading.Condition()
+        self.request = None  # (Interpolator, axis, value, resolution, sharpness, radius, array name, particle data,
+                             # cache)
+        self.generation = 0  # bumped by every request
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, interpolator, axis, val, resolution, cache=True):
+        # Kernel parameters and the particle arrays are read here on the Qt thread, which owns the polydata, later
+        # edits do not change this request
+        data = interpolator.particle_data(interpolator.array_name)
+        with self.condition:
+            self.request = (interpolator, axis, val, resolution, interpolator.sharpness, interpolator.radius,
+                            interpolator.array_name, data, cache)
+            self.generation += 1
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.request is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                request, generation = self.request, self.generation
+                self.request = None
+            interpolator, axis, val, resolution, sharpness, radius, array_name, data, cache = request
+            try:
+                plane = interpolator.interpolate(axis, val, resolution, sharpness, radius, array_name, data, cache)
+            except Exception as e:
+                print(f'Interpolating the scan plane failed: {e}')
+                continue
+            self.finished.emit(interpolator, plane, generation)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
@@ -1,11 +1,15 @@
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtCore import QLocale
 from PyQt5.QtGui import QDoubleValidator
+from vtkmodules.util.numpy_support import vtk_to_numpy
 
 import config
+from dataops.query import QueryError
 from dataops.interpolator import Interpolator
+from dataops.spatialindex import load_spatial_index
 from dataops.glyph import Glyph
 from helpers import create_legend
+from rendering.scanplane import ScanPlaneWorker
 
 class CustomArrayBox(QtWidgets.QGroupBox):
     def __init__(self, name, toolbox):
@@ -62,18 +66,22 @@ class ScanPlaneGroupBox(QtWidgets.QGroupBox):
         self.toggled.connect(self.on_toggled)
 
     def init_checked(self):
+        self.show_widgets(config.ShowScanPlane)
+
+    def show_widgets(self, checked):
+        # The Gaussian kernel settings only apply in 'kernel' mode
+        kernel_mode = self.toolbox.interpolator.mode == 'kernel'
         for i in range(self.layout().count()):
-            self.layout().itemAt(i).widget().setVisible(config.ShowScanPlane)
-            self.layout().itemAt(i).widget().setEnabled(config.ShowScanPlane)
+            widget = self.layout().itemAt(i).widget()
+            widget.setVisible(checked)
+            widget.setEnabled(checked and (kernel_mode or widget not in self.toolbox.kernel_widgets))
 
     def on_toggled(self, checked):
         if checked:
             self.layout().setContentsMargins(10, 10, 10, 10)
         else:
             self.layout().setContentsMargins(0, 0, 0, 0)
-        for i in range(self.layout().count()):
-            self.layout().itemAt(i).widget().setVisible(checked)
-            self.layout().itemAt(i).widget().setEnabled(checked)
+        self.show_widgets(checked)
         config.ShowLegend = checked
         self.toolbox.toggle_plane(checked)
 
@@ -128,6 +136,19 @@ def slider_to_glyph_density(value):
     return (value / 100) ** 5
 
 
+# Threshold suggestions: name -> (lower, upper) percentile
+PERCENTILE_PRESETS = {
+    'Custom': None,
+    'All': (0., 100.),
+    '1 - 99 %': (1., 99.),
+    '5 - 95 %': (5., 95.),
+    '25 - 75 %': (25., 75.),
+    'Top 10 %': (90., 100.),
+    'Top 1 %': (99., 100.),
+    'Bottom 10 %': (0., 10.),
+}
+
+
 def point_opaticy_to_slider(opacity):
     return int(opacity ** (1 / 2.4) * 100)
 
@@ -157,13 +178,27 @@ class DataViewToolBar(QtWidgets.QWidget):
         self.toolbar.setFixedWidth(250)
         self.setContentsMargins(10, 10, 10, 10)
         self.toolbar.setStyleSheet("QToolBar { border: none; }")
-        self.interpolator = Interpolator(self.actors.polydata)
-        self.glyph = Glyph(self.actors.polydata)
+        self.interpolator = self.create_interpolator()
+        self.scan_worker = None
+        if config.AsyncScanPlane:
+            self.scan_worker = ScanPlaneWorker()
+            self.scan_worker.finished.connect(self.on_plane_interpolated)
+        self.shown_generation = 0  # worker request of the plane on screen
+        # Refines the coarse planes drawn while dragging once the slider has been still for a moment
+        self.scanPlaneTimer = QtCore.QTimer()
+        self.scanPlaneTimer.setSingleShot(True)
+        self.scanPlaneTimer.setInterval(config.ScanPlaneSettleMs)
+        self.scanPlaneTimer.timeout.connect(self.update_plane)
+        self.glyph = None  # created on first use, so that the velocity arrays are only loaded when needed
         self.legend = create_legend(config.Lut)
         self.kernelSharpnessInput = None
         self.kernelRadiusInput = None
+        self.kernel_widgets = []  # disabled in 'grid' mode
         self.min_thresh = None
         self.max_thresh = None
+        self.percentileComboBox = None
+        self.keptLabel = None
+        self.queryInput = None
         self.scanPlaneSlider = None
         self.scanPlaneAxis = 'z'
         self.show_legend = True
@@ -196,6 +231,17 @@ class DataViewToolBar(QtWidgets.QWidget):
         self.max_thresh.setValidator(validator)
         self.max_thresh.returnPressed.connect(self.set_max_threshold)
         layout.addRow(QtWidgets.QLabel("Max:"), self.max_thresh)
+        self.percentileComboBox = QtWidgets.QComboBox()
+        self.percentileComboBox.addItems(PERCENTILE_PRESETS.keys())
+        self.percentileComboBox.activated.connect(self.onPercentileComboBoxChange)
+        layout.addRow(QtWidgets.QLabel("Percentile:"), self.percentileComboBox)
+        self.queryInput = QtWidgets.QLineEdit()
+        self.queryInput.setPlaceholderText('e.g. rho > 1e10 & type in (gas, star)')
+        self.queryInput.setText(config.Query)
+        self.queryInput.returnPressed.connect(self.set_query)
+        layout.addRow(QtWidgets.QLabel("Query:"), self.queryInput)
+        self.keptLabel = QtWidgets.QLabel()
+        layout.addRow(self.keptLabel)
 
         self.toolbar.addWidget(widget)
         self.toolbar.addSeparator()
@@ -249,6 +295,7 @@ class DataViewToolBar(QtWidgets.QWidget):
         self.scanPlaneSlider.setRange(0, 100)
         self.scanPlaneSlider.setValue(50)
         self.scanPlaneSlider.valueChanged.connect(self.onScanPlaneSliderChange)
+        self.scanPlaneSlider.sliderReleased.connect(self.update_plane)
         layout.addRow(axisComboBox, self.scanPlaneSlider)
 
         label = QtWidgets.QLabel("Kernel Sharpness:")
@@ -264,6 +311,7 @@ class DataViewToolBar(QtWidgets.QWidget):
         kernelRadiusInput.returnPressed.connect(self.onKernelRadiusChange)
         self.kernelRadiusInput = kernelRadiusInput
         layout.addRow(label, kernelRadiusInput)
+        self.kernel_widgets = [self.kernelSharpnessInput, self.kernelRadiusInput]
         groupBox.init_checked()
         self.toolbar.addWidget(groupBox)
 
@@ -316,8 +364,8 @@ class DataViewToolBar(QtWidgets.QWidget):
         # Add toolbar to window
         self.window.addToolBar(QtCore.Qt.RightToolBarArea, self.toolbar)
         self.window.ren.AddActor(self.interpolator.get_plane_actor())
+        self.update_plane()  # nothing to do unless the plane is shown
         self.window.ren.AddActor(self.legend)
-        self.window.ren.AddActor(self.glyph.get_actor())
         thmin = config.RangeMin
         thmax = config.RangeMax
         if config.ThresholdMin is not None:
@@ -342,11 +390,11 @@ class DataViewToolBar(QtWidgets.QWidget):
         config.ArrayName = array_name
         self.actors.update_actors()
         self.set_thresh_text(config.ThresholdMin, config.ThresholdMax)
+        self.percentileComboBox.setCurrentIndex(0)
         if self.interpolator:
-            self.window.ren.RemoveActor(self.interpolator.get_plane_actor())
-        self.interpolator = Interpolator(self.actors.polydata)
-        self.interpolator.get_plane_actor().SetVisibility(config.ShowScanPlane)
-        self.window.ren.AddActor(self.interpolator.get_plane_actor())
+            # Same plane, other array: the kernel weights of the plane position are reused
+            self.interpolator.set_array(array_name)
+            self.update_plane()
         self.window.render()
 
     def recenter(self):
@@ -356,14 +404,44 @@ class DataViewToolBar(QtWidgets.QWidget):
         min_thresh = self.min_thresh.text()
         max_thresh = self.max_thresh.text()
         config.ThresholdMin = min(float(min_thresh), float(max_thresh))
-        self.actors.update_actors()
+        self.percentileComboBox.setCurrentIndex(0)
+        self.actors.update_threshold()
+        self.update_kept_label()
         self.window.render()
 
     def set_max_threshold(self):
         min_thresh = self.min_thresh.text()
         max_thresh = self.max_thresh.text()
         config.ThresholdMax = max(float(min_thresh), float(max_thresh))
-        self.actors.update_actors()
+        self.percentileComboBox.setCurrentIndex(0)
+        self.actors.update_threshold()
+        self.update_kept_label()
+        self.window.render()
+
+    def set_query(self):
+        previous = config.Query
+        config.Query = self.queryInput.text().strip()
+        try:
+            self.actors.update_threshold()
+        except QueryError as e:
+            print(f'Invalid query: {e}')
+            self.queryInput.setStyleSheet("QLineEdit { color: red; }")
+            config.Query = previous
+            self.actors.update_threshold()
+            return
+        self.queryInput.setStyleSheet("")
+        self.update_kept_label()
+        self.window.render()
+
+    def onPercentileComboBoxChange(self, index):
+        percentiles = PERCENTILE_PRESETS[self.percentileComboBox.itemText(index)]
+        stats = self.actors.statistics(config.ArrayName)
+        if percentiles is None or stats is None:
+            return
+        config.ThresholdMin = stats.percentile(percentiles[0])
+        config.ThresholdMax = stats.percentile(percentiles[1])
+        self.set_thresh_text(config.ThresholdMin, config.ThresholdMax)
+        self.actors.update_threshold()
         self.window.render()
 
     def onPointOpacitySliderChange(self, value):
@@ -382,10 +460,48 @@ class DataViewToolBar(QtWidgets.QWidget):
                 self.actors.actors[name].GetMapper().SetScaleFactor(config.DataViewRadius)
         self.window.render()
 
+    def create_interpolator(self):
+        # Plane weights are shared under the snapshot and region. Without a region the snapshot's spatial index is
+        # reused, loaded from the snapshot cache when the first plane is interpolated.
+        index = None
+        if self.actors.roi_ids is None:
+            index = self.actors.spatial
+            if index is None and config.UseSnapshotCache:
+                filename, points = config.File, vtk_to_numpy(self.actors.polycopy.GetPoints().GetData())
+                index = lambda: load_spatial_index(filename, points)
+        return Interpolator(self.actors.polydata, source=(config.File, config.ROI), index=index)
+
     def onScanPlaneSliderChange(self, value):
         if not self.interpolator: return
-        alpha = value / 100
-        self.interpolator.set_plane(self.scanPlaneAxis, alpha * config.CoordMax)
+        self.update_plane(coarse=self.scanPlaneSlider.isSliderDown())
+
+    def update_plane(self, coarse=False):
+        '''
+        Move the scan plane to the slider position. With config.AsyncScanPlane the plane is interpolated on a
+        worker thread and drawn when it is ready, at a lower resolution while the slider is being dragged.
+        '''
+        if not self.interpolator.get_plane_actor().GetVisibility():
+            return  # interpolated once the plane is shown
+        val = self.scanPlaneSlider.value() / 100 * config.CoordMax
+        if self.scan_worker is None:
+            self.interpolator.set_plane(self.scanPlaneAxis, val)
+            self.window.render()
+            return
+        resolution = max(config.CellRes // config.ScanPlaneCoarseFactor, 1) if coarse else config.CellRes
+        # Coarse drag positions are passed once, caching them would evict the planes worth keeping
+        self.scan_worker.submit(self.interpolator, self.scanPlaneAxis, val, resolution, cache=not coarse)
+        if coarse:
+            self.scanPlaneTimer.start()
+        else:
+            self.scanPlaneTimer.stop()
+
+    def on_plane_interpolated(self, interpolator, plane, generation):
+        if interpolator is not self.interpolator:
+            return  # requested before the metric changed
+        if generation <= self.shown_generation:
+            return  # a newer plane is already on screen
+        self.shown_generation = generation
+        interpolator.show_plane(plane)
         self.window.render()
 
     def onKernelSharpnessChange(self):
@@ -398,7 +514,7 @@ class DataViewToolBar(QtWidgets.QWidget):
         print('kernel sharpness: ', sharpness)
         self.kernelSharpnessInput.setText(str(sharpness))
         self.interpolator.set_kernel_sharpness(sharpness)
-        self.window.render()
+        self.update_plane()
 
     def onKernelRadiusChange(self):
         if not self.interpolator: return
@@ -410,12 +526,16 @@ class DataViewToolBar(QtWidgets.QWidget):
         print('kernel radius: ', radius)
         self.kernelRadiusInput.setText(str(radius))
         self.interpolator.set_kernel_radius(radius)
-        self.window.render()
+        self.update_plane()
 
     def clear(self):
+        self.scanPlaneTimer.stop()
+        if self.scan_worker:
+            self.scan_worker.stop()
         self.window.ren.RemoveActor(self.interpolator.get_plane_actor())
         self.window.ren.RemoveActor(self.legend)
-        self.window.ren.RemoveActor(self.glyph.get_actor())
+        if self.glyph:
+            self.window.ren.RemoveActor(self.glyph.get_actor())
         self.toolbar.clear()
         self.toolbar.destroy()
         self.close()
@@ -431,6 +551,34 @@ class DataViewToolBar(QtWidgets.QWidget):
     def set_thresh_text(self, min_thresh, max_thresh):
         self.min_thresh.setText(f'{min_thresh:.4e}')
         self.max_thresh.setText(f'{max_thresh:.4e}')
+        self.update_kept_label()
+
+    def update_kept_label(self):
+        if config.Query:
+            # The query result is exact, the threshold part of it comes from the sorted index
+            total = self.actors.polydata.GetNumberOfPoints()
+            kept = self.actors.num_selected
+            self.keptLabel.setText(f'Keeps {kept:,} points ({kept / total * 100 if total else 0:.1f} %)')
+            return
+        lo = config.RangeMin if config.ThresholdMin is None else config.ThresholdMin
+        hi = config.RangeMax if config.ThresholdMax is None else config.ThresholdMax
+        index = self.actors.threshold_indices.get(config.ArrayName)
+        if index is not None:
+            # Exact from the sorted index once thresholding built it, two binary searches per type
+            kept, total = index.count(lo, hi), len(index.order)
+        elif self.actors.display_fraction < 1.:
+            # The snapshot is filling in, its fill builds the index and updates the label when done
+            self.keptLabel.setText('')
+            return
+        else:
+            # Estimated from the quantile table, so it never scans the array
+            stats = self.actors.statistics(config.ArrayName)
+            if stats is None:
+                self.keptLabel.setText('')
+                return
+            kept, total = stats.count(lo, hi), stats.num_points
+        percent = kept / total * 100 if total else 0
+        self.keptLabel.setText(f'Keeps {kept:,} points ({percent:.1f} %)')
 
     def toggle_legend(self, state):
         if state == QtCore.Qt.Checked:
@@ -442,18 +590,31 @@ class DataViewToolBar(QtWidgets.QWidget):
 
     def toggle_plane(self, state):
         self.interpolator.get_plane_actor().SetVisibility(state)
+        self.update_plane()
         self.window.render()
 
     def set_plane_axis(self, index):
         self.scanPlaneAxis = ['x','y','z'][index]
-        value = self.scanPlaneSlider.value()
-        alpha = value / 100
-        self.interpolator.set_plane(self.scanPlaneAxis, alpha * config.CoordMax)
-        self.window.render()
+        self.update_plane()
+
+    def create_glyph(self):
+        self.actors.require_arrays(['vx', 'vy', 'vz', '|v|'])
+        # Arrows are sized over the speeds of the whole snapshot, so they keep their size in every sample and region
+        stats = self.actors.statistics('|v|')
+        self.glyph = Glyph(self.actors.polydata, self.actors.sample_keys(),
+                           magnitude_range=stats.range() if stats else None)
+        self.glyph.set_scale(config.GlyphScale)
+        self.glyph.set_opacity(config.GlyphOpacity)
+        self.glyph.set_ratio(config.GlyphDensity)
+        self.glyph.set_color_mode(config.ColorGlyph)
+        self.window.ren.AddActor(self.glyph.get_actor())
 
     def on_glyph_toggled(self, state):
         config.ShowGlyph = state
-        self.glyph.get_actor().SetVisibility(state)
+        if state and not self.glyph:
+            self.create_glyph()
+        if self.glyph:
+            self.glyph.get_actor().SetVisibility(state)
         for widget in self.glyph_widgets:
             widget.setEnabled(state)
             widget.setVisible(state)
@@ -461,20 +622,24 @@ class DataViewToolBar(QtWidgets.QWidget):
 
     def on_glyph_scale_slider_change(self, value):
         config.GlyphScale = slider_to_glyph_scale(value)
+        if not self.glyph: return
         self.glyph.set_scale(config.GlyphScale)
         self.window.render()
 
     def on_glyph_opacity_slider_change(self, value):
         config.GlyphOpacity = slider_to_glyph_opacity(value)
+        if not self.glyph: return
         self.glyph.set_opacity(config.GlyphOpacity)
         self.window.render()
 
     def on_glyph_color_toggled(self, state):
         config.ColorGlyph = state
+        if not self.glyph: return
         self.glyph.set_color_mode(state)
         self.window.render()
 
     def on_glyph_density_slider_change(self, value):
         config.GlyphDensity = slider_to_glyph_density(value)
+        if not self.glyph: return
         self.glyph.set_ratio(config.GlyphDensity)
         self.window.render()
@@ -75,6 +75,12 @@ class CollapsibleGroupBox(QtWidgets.QGroupBox):
             self.layout().itemAt(i).widget().setEnabled(checked)
         self.toolbox.toggle_plane(checked)
 
+
+# Volume View choices of grid points per axis, when the camera is still and while it moves
+VOLUME_RESOLUTIONS = [64, 100, 128, 256, 512]
+INTERACTIVE_RESOLUTIONS = [32, 64, 128]
+
+
 class VolumeViewToolBar(QtWidgets.QWidget):
     def __init__(self, window, actors):
         super(VolumeViewToolBar, self).__init__()
@@ -91,8 +97,37 @@ class VolumeViewToolBar(QtWidgets.QWidget):
         self.initToolBar()
 
     def initToolBar(self):
+        # Add resolution control: the grid drawn when the camera is still, and the pyramid level while it moves
+        widget = QtWidgets.QWidget()
+        layout = QtWidgets.QFormLayout(widget)
+        resolutionComboBox = QtWidgets.QComboBox()
+        resolutionComboBox.addItems([str(n) for n in VOLUME_RESOLUTIONS])
+        if max(config.VolumeResolution) in VOLUME_RESOLUTIONS:
+            resolutionComboBox.setCurrentIndex(VOLUME_RESOLUTIONS.index(max(config.VolumeResolution)))
+        resolutionComboBox.setFixedWidth(100)
+        resolutionComboBox.activated.connect(self.onResolutionComboBoxChange)
+        layout.addRow(QtWidgets.QLabel("Resolution:"), resolutionComboBox)
+        interactiveComboBox = QtWidgets.QComboBox()
+        interactiveComboBox.addItems(['Auto'] + [str(n) for n in INTERACTIVE_RESOLUTIONS])
+        if config.VolumeInteractiveResolution in INTERACTIVE_RESOLUTIONS:
+            interactiveComboBox.setCurrentIndex(INTERACTIVE_RESOLUTIONS.index(config.VolumeInteractiveResolution) + 1)
+        interactiveComboBox.setFixedWidth(100)
+        interactiveComboBox.activated.connect(self.onInteractiveComboBoxChange)
+        layout.addRow(QtWidgets.QLabel("While moving:"), interactiveComboBox)
+        self.toolbar.addWidget(widget)
+
         self.window.addToolBar(QtCore.Qt.RightToolBarArea, self.toolbar)
 
+    def onResolutionComboBoxChange(self, index):
+        resolution = VOLUME_RESOLUTIONS[index]
+        config.VolumeResolution = (resolution, resolution, resolution)
+        self.actors.update_actors()
+        self.window.render()
+
+    def onInteractiveComboBoxChange(self, index):
+        # Takes effect the next time the camera starts moving
+        config.VolumeInteractiveResolution = None if index == 0 else INTERACTIVE_RESOLUTIONS[index - 1]
+
     def recenter(self):
         self.window.recenter()
 
@@ -3,7 +3,8 @@ import config
 import numpy as np
 from vtkmodules.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 
-from dataops.filters import threshold_points
+from dataops import lod
+from dataops.filters import threshold_range
 import rendering.core as core
 
 
@@ -14,8 +15,7 @@ def get_data_view_actors(polydata: vtk.vtkPolyData, color: vtk.vtkColor3d = None
     mapper.SetScalarRange([config.RangeMin, config.RangeMax])
     mapper.SetScaleFactor(config.DataViewRadius)
     mapper.EmissiveOff()
-    mapper.SetScaleArray('radius')  # assign heterogenous radius to each point
-    core.update_radius(polydata, min_value=0.01, max_value=0.2)
+    mapper.SetScaleArray('radius')  # assign heterogenous radius to each point, see select_data_view_points
     mapper.SetLookupTable(config.Lut)
     actor = vtk.vtkActor()
     actor.SetMapper(mapper)
@@ -23,10 +23,44 @@ def get_data_view_actors(polydata: vtk.vtkPolyData, color: vtk.vtkColor3d = None
     return actor
 
 
+def select_data_view_points(actor, fraction=None, source=None):
+    '''
+    One polydata per type with the points inside the threshold range
+
+    fraction: share of the sample to draw, actor.display_fraction by default
+    source: Actors.fill_source taken on the Qt thread, to select on a worker thread while the snapshot fills in
+    '''
+    fraction = actor.display_fraction if fraction is None else fraction
+    polydata, mask = source or (actor.polydata, None)
+    if actor.radius is None:
+        # Normalized over the whole type rather than the selection, so thresholding does not rescale the points
+        actor.radius = core.type_radius(polydata, min_value=0.01, max_value=0.2)
+    selection = actor.threshold_selection(config.ArrayName, *threshold_range(), fraction,
+                                          None if source is None else polydata)
+    if config.Query:
+        mask = actor.query_mask(config.Query) if mask is None else mask
+        selection = [ids[mask[ids]] for ids in selection]
+    actor.num_selected = sum(len(ids) for ids in selection)
+    selection = actor.sample_selection(selection, fraction)
+    arrays = {'radius': actor.radius}
+    levels = actor.lod_levels()
+    if levels is not None:
+        arrays[lod.LOD_ARRAY] = levels
+    return core.split_particles(polydata, selection=selection, arrays=arrays)
+
+
+def update_data_view_actors(actor, split_polydata=None):
+    # Threshold change: the actors and mappers stay, only their input is swapped
+    split_polydata = select_data_view_points(actor) if split_polydata is None else split_polydata
+    for name, data in split_polydata.items():
+        actor.lod_controller.set_input(name, actor.actors[name], data)
+
+
 def create_data_view_actors(actor):
-    pd = threshold_points(actor.polydata)
-    split_polydata = core.split_particles(pd)
+    split_polydata = select_data_view_points(actor)
     actor.actors = {name: get_data_view_actors(data) for name, data in split_polydata.items()}
+    for name, data in split_polydata.items():
+        actor.lod_controller.set_input(name, actor.actors[name], data)
     for name, (color, opacity, radius, show) in actor.property_map.items():
         if show:
             actor.parent.ren.AddActor(actor.actors[name])
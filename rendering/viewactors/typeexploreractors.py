@@ -1,5 +1,6 @@
 import vtk
 import rendering.core as core
+from dataops import lod, particletype
 
 
 def get_type_explorer_actors(polydata: vtk.vtkPolyData, color: vtk.vtkColor3d = None, opacity: float = None,
@@ -18,9 +19,31 @@ def get_type_explorer_actors(polydata: vtk.vtkPolyData, color: vtk.vtkColor3d =
     return actor
 
 
+def select_type_explorer_points(actorhandler, fraction=None, source=None):
+    # fraction and source as for dataviewactors.select_data_view_points
+    fraction = actorhandler.display_fraction if fraction is None else fraction
+    polydata = actorhandler.polydata if source is None else source[0]
+    selection = None
+    if fraction < 1.:
+        selection = actorhandler.sample_selection(particletype.type_ids(polydata), fraction)
+    levels = actorhandler.lod_levels()
+    return core.split_particles(polydata, selection=selection,
+                                arrays={} if levels is None else {lod.LOD_ARRAY: levels})
+
+
+def update_type_explorer_actors(actorhandler, split_polydata=None):
+    # Keep the actors and their properties, only swap in the points to draw
+    split_polydata = select_type_explorer_points(actorhandler) if split_polydata is None else split_polydata
+    for name, data in split_polydata.items():
+        actorhandler.lod_controller.set_input(name, actorhandler.actors[name], data)
+        core.update_view_property(actorhandler.actors[name], *actorhandler.property_map[name])
+
+
 def create_type_explorer_actors(actorhandler):
-    split_polydata = core.split_particles(actorhandler.polydata)
+    split_polydata = select_type_explorer_points(actorhandler)
     actorhandler.actors = {name: get_type_explorer_actors(data) for name, data in split_polydata.items()}
+    for name, data in split_polydata.items():
+        actorhandler.lod_controller.set_input(name, actorhandler.actors[name], data)
     for name, actor in actorhandler.actors.items():
         core.update_view_property(actor, *actorhandler.property_map[name])
     for name, (color, opacity, radius, show) in actorhandler.property_map.items():
@@ -5,41 +5,7 @@ import config
 
 
 def create_volume_view_actors(actorhandler):
-    bounds = actorhandler.polydata.GetBounds()
-
-    grid_resolution = (100, 100, 100)
-    grid = vtk.vtkImageData()
-    grid.SetDimensions(grid_resolution)
-    grid.SetOrigin(bounds[0], bounds[2], bounds[4])
-    grid.SetSpacing(
-        (bounds[1] - bounds[0]) / (grid_resolution[0] - 1),
-        (bounds[3] - bounds[2]) / (grid_resolution[1] - 1),
-        (bounds[5] - bounds[4]) / (grid_resolution[2] - 1)
-    )
-    scalars = vtk.vtkFloatArray()
-    scalars.SetNumberOfComponents(1)
-    scalars.SetNumberOfTuples(grid.GetNumberOfPoints())
-    scalars.SetName(config.ArrayName)
-
-    num_points = vtk.vtkTypeUInt32Array()
-    num_points.SetNumberOfComponents(1)
-    num_points.SetNumberOfTuples(grid.GetNumberOfPoints())
-
-    for i in range(actorhandler.polydata.GetNumberOfPoints()):
-        point = actorhandler.polydata.GetPoint(i)
-        value = actorhandler.polydata.GetPointData().GetArray(config.ArrayName).GetValue(i)
-        grid_point_id = grid.FindPoint(point)
-        if grid_point_id >= 0:
-            # accumulate
-            scalars.SetValue(grid_point_id, scalars.GetValue(grid_point_id) + value)
-            num_points.SetValue(grid_point_id, num_points.GetValue(grid_point_id) + 1)
-
-    # normalize
-    for i in range(grid.GetNumberOfPoints()):
-        if num_points.GetValue(i) > 0:
-            scalars.SetValue(i, scalars.GetValue(i) / num_points.GetValue(i))
-
-    grid.GetPointData().SetScalars(scalars)
+    levels = actorhandler.volume_levels()
 
     color_map = vtk.vtkColorTransferFunction()
 
@@ -50,7 +16,6 @@ def create_volume_view_actors(actorhandler):
     color_map.AddRGBPoint(255.0, 1.0, 1.0, 1.0)
     mapper = vtk.vtkSmartVolumeMapper()
     mapper.SetRequestedRenderModeToGPU()
-    mapper.SetInputData(grid)
 
     volume_property = vtk.vtkVolumeProperty()
     volume_property.SetColor(color_map)
@@ -66,5 +31,6 @@ def create_volume_view_actors(actorhandler):
 
     grid_actor.GetProperty().SetColor(color_map)
     grid_actor.GetProperty().SetScalarOpacity(opacityTransferFunction)
-    #actorhandler.actors = {'grid': grid_actor}
-    actorhandler.parent.ren.AddVolume(grid_actor)
\ No newline at end of file
+    actorhandler.actors = {'grid': grid_actor}
+    actorhandler.lod_controller.set_volume(grid_actor, levels)
+    actorhandler.parent.ren.AddVolume(grid_actor)
@@ -1,6 +1,6 @@
-import re
 import vtk
 import config
+from dataops.catalog import Catalog
 from PyQt5 import QtWidgets
 from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 from rendering.menubar import MenuBar
@@ -8,6 +8,7 @@ from rendering.bottombar import BottomBar
 from rendering.toolbars.typeexplorertoolbar import TypeExplorerToolBar
 from rendering.toolbars.dataviewtoolbar import DataViewToolBar
 from rendering.actors import Actors
+from rendering.progressive import ProgressiveDisplay
 from rendering.toolbars.volumeviewtoolbar import VolumeViewToolBar
 
 class Window(QtWidgets.QMainWindow):
@@ -41,27 +42,31 @@ class Window(QtWidgets.QMainWindow):
         self.menubar = MenuBar(self)
         self.bottombar = BottomBar(self)
         self.toolbar = None
+        self.catalog = None
+        self.progressive = ProgressiveDisplay(self)
 
     def open_file(self, filename):
+        self.catalog = Catalog.for_file(filename)
+        step = self.catalog.step_of(filename)
+        if step is None:
+            print("Not a snapshot: {}".format(filename))
+            exit(1)
         self.actors.remove_actors()
         self.actors.load_polytope(filename)
+        self.progressive.begin()
         self.actors.update_actors()
-        numbers = re.findall(r"\d+", filename)
-        if numbers:
-            numbers = numbers[0].zfill(3)
-            if int(numbers) == 0:
-                self.menubar.back_action.setDisabled(True)
-            elif int(numbers) == 624:
-                self.menubar.forward_action.setDisabled(True)
-            else:
-                self.menubar.back_action.setEnabled(True)
-                self.menubar.forward_action.setEnabled(True)
-            self.menubar.timestep_input.setEnabled(True)
-            config.CurrentTime = numbers
-            self.menubar.timestep_input.setText(numbers)
-        else:
-            print("No number found in the string.")
-            exit(1)
+        self.menubar.back_action.setEnabled(self.catalog.prev_step(step) is not None)
+        self.menubar.forward_action.setEnabled(self.catalog.next_step(step) is not None)
+        self.menubar.timestep_input.setEnabled(True)
+        config.CurrentTime = self.catalog.format_step(step)
+        self.menubar.timestep_input.setText(config.CurrentTime)
+        self.reset_toolbar()
+        self.render()
+        self.progressive.start()
+        self.update_bottombar()
+
+    def reset_toolbar(self):
+        # Toolbars hold on to the working set (scan plane, glyphs), so they are recreated when it changes
         if self.toolbar:
             self.toolbar.clear()
             del self.toolbar
@@ -72,8 +77,16 @@ class Window(QtWidgets.QMainWindow):
             self.toolbar = DataViewToolBar(self, self.actors)
         elif config.CurrentView == 'Volume View':
             self.toolbar = VolumeViewToolBar(self, self.actors)
+
+    def set_roi(self, roi):
+        if not self.actors.polydata:
+            config.ROI = roi
+            return
+        self.actors.remove_actors()
+        self.actors.set_roi(roi)
+        self.actors.update_actors()
+        self.reset_toolbar()
         self.render()
-        self.update_bottombar()
 
     def render(self):
         self.iren.Render()